@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the detection latency of the GUI alarms.
+
+A reader thread produces samples at the stream rate, a threshold being
+crossed every now and then, while the main thread plays the GUI: every
+sampling interval it takes the samples read, and sometimes it is busy,
+in Python holding the GIL, for up to the stall time, as for a long
+paint or a page load. The alarms are checked either by the main thread,
+as set_data does without the alarm process, or by the AlarmProcess fed
+by the reader thread. Reported is the latency from the arrival of the
+sample crossing a threshold to its detection, mean and maximum, for
+each stall time.
+
+Usage:
+    ./bench_alarm_latency.py [duration of each run, s]
+"""
+
+import os
+import random
+import sys
+import time
+from collections import deque
+from threading import Thread
+
+import numpy as np
+
+GUI_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'gui')
+sys.path.insert(0, GUI_DIR)
+# pylint: disable=C0413
+from alarms.alarmstate import NORMAL, ACTIVE, SNOOZED, evaluate
+from alarms.alarmprocess import AlarmProcess
+
+RATE = 100.
+INTERVAL = 0.02
+N_FIELDS = 10
+N_ALARMS = 6
+SETMIN = np.zeros(N_ALARMS)
+SETMAX = np.ones(N_ALARMS)
+PERSISTENCE = np.zeros(N_ALARMS)
+HOLDOFF = np.zeros(N_ALARMS)
+
+
+def read_samples(duration, sink):
+    """
+    Produces the samples, in range except for the alarm 0 in 1 sample
+    out of 50, and passes them to sink(arrivals, rows).
+
+    returns: the list of the arrival times of the samples out of range.
+    """
+    crossings = []
+    row = np.full((1, N_FIELDS), 0.5)
+    start = time.monotonic()
+    count = 0
+    while time.monotonic() - start < duration:
+        count += 1
+        time.sleep(max(start + count / RATE - time.monotonic(), 0.))
+        arrival = time.monotonic()
+        row[0, 0] = 2. if count % 50 == 0 else 0.5
+        if count % 50 == 0:
+            crossings.append(arrival)
+        sink(np.array([arrival]), row.copy())
+    return crossings
+
+
+def play_gui(duration, stall, tick):
+    """
+    Calls tick() every INTERVAL, stalling for up to stall seconds one
+    time out of ten.
+    """
+    start = time.monotonic()
+    while time.monotonic() - start < duration:
+        tick()
+        busy = random.uniform(0, stall) if random.random() < 0.1 else 0.
+        until = time.monotonic() + busy
+        while time.monotonic() < until:
+            pass
+        time.sleep(INTERVAL)
+
+
+def run_in_gui(duration, stall):
+    """
+    Checks the alarms in the main thread.
+
+    returns: the detection latencies.
+    """
+    queue = deque()
+    latencies = []
+    state = np.full(N_ALARMS, NORMAL)
+    since = np.zeros(N_ALARMS)
+
+    def tick():
+        while queue:
+            arrivals, rows = queue.popleft()
+            values = rows[:, :N_ALARMS]
+            fired, fired_at = evaluate(state, since, (values < SETMIN) | (values > SETMAX),
+                                       arrivals, PERSISTENCE, HOLDOFF)
+            if fired.any():
+                latencies.append(time.monotonic() - fired_at)
+                # cleared by the user right away
+                state[state == ACTIVE] = SNOOZED
+
+    reader = Thread(target=read_samples, args=(duration, lambda *sample: queue.append(sample)))
+    reader.start()
+    play_gui(duration, stall, tick)
+    reader.join()
+    return latencies
+
+
+def run_in_process(duration, stall):
+    """
+    Checks the alarms in the alarm process.
+
+    returns: the detection latencies.
+    """
+    process = AlarmProcess(N_FIELDS, range(N_ALARMS), np.ones(N_FIELDS))
+    process.set_thresholds(SETMIN, SETMAX, PERSISTENCE, HOLDOFF)
+    process.set_running(True)
+    latencies = []
+
+    def fired(indexes, first, fired_at): # pylint: disable=W0613
+        latencies.append(time.monotonic() - fired_at)
+        for index in indexes:
+            process.clear(index)
+
+    process.connect(fired)
+    # let it start
+    time.sleep(1.)
+    reader = Thread(target=read_samples, args=(duration, process.stream_sink))
+    reader.start()
+    play_gui(duration, stall, lambda: None)
+    reader.join()
+    time.sleep(0.2)
+    process.close()
+    return latencies
+
+
+def main():
+    """
+    Main function.
+    """
+
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 10.
+    print("%-10s %-8s %8s %10s %10s" % ("checked", "stall", "alarms", "mean [ms]", "max [ms]"))
+    for stall in (0., 0.1, 0.5):
+        for name, run in (("in GUI", run_in_gui), ("process", run_in_process)):
+            latencies = np.array(run(duration, stall)) * 1e3
+            print("%-10s %-8s %8d %10.2f %10.2f" % (name, "%g s" % stall, len(latencies),
+                                                   latencies.mean(), latencies.max()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the event journal.
+
+Fills a journal in a temporary directory with a week of events, one
+every 0.6 s, far more than a real session, and reports the time spent
+by the caller to record an event, the number of batches written and the
+longest one, the time to open the journal again, and the time spent
+querying time ranges from 1 min to the whole week, against reading the
+whole journal.
+
+Usage:
+    ./bench_journal.py [number of days]
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import timeit
+
+GUI_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'gui')
+sys.path.insert(0, GUI_DIR)
+# pylint: disable=C0413
+from journal import EventJournal, read_journal, ESP_ALARM, SETTING
+
+
+def main():
+    """
+    Main function.
+    """
+
+    days = float(sys.argv[1]) if len(sys.argv) > 1 else 7.
+    period = 0.6
+    nevents = int(days * 86400 / period)
+    origin = time.time() - days * 86400
+
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "journal.bin")
+    try:
+        journal = EventJournal(path, flush_interval=0.1)
+        start = time.perf_counter()
+        for i in range(nevents):
+            if i % 2:
+                journal.record(ESP_ALARM, 1 << (i % 8), "Gas pressure too low",
+                               timestamp=origin + i * period)
+            else:
+                journal.record(SETTING, text="rate=%d" % (i % 30),
+                               timestamp=origin + i * period)
+        elapsed = time.perf_counter() - start
+        journal.close()
+        stats = journal.statistics()
+        print("%d events over %g days: %.1f us/record, %d batches, longest %.1f ms,"
+              " %.1f MB" % (nevents, days, elapsed / nevents * 1e6, stats["batches"],
+                            stats["fsync_max"] * 1e3, os.path.getsize(path) / 1e6))
+
+        start = time.perf_counter()
+        journal = EventJournal(path)
+        print("open: %.1f ms" % ((time.perf_counter() - start) * 1e3))
+
+        middle = origin + days * 86400 / 2
+        print("%-10s %10s %12s" % ("range", "events", "query [ms]"))
+        for span in (60, 3600, 86400, days * 86400):
+            first = middle - span / 2
+            result = journal.events(first, first + span)
+            nquery = max(1, int(1000 / (1 + len(result) / 100)))
+            query_time = timeit.timeit(lambda: journal.events(first, first + span),
+                                       number=nquery) / nquery
+            print("%-10s %10d %12.3f" % ("%d s" % span, len(result), query_time * 1e3))
+        journal.close()
+
+        start = time.perf_counter()
+        read_journal(path)
+        print("whole journal read: %.1f ms" % ((time.perf_counter() - start) * 1e3))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
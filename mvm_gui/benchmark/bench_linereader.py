@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the line framing of the ESP32 serial connection.
+
+A pseudo-terminal pair stands for the serial cable: a thread writes
+get_all-like replies on the master side as fast as possible, while the
+slave side is read either with pySerial's read_until(), the way
+ESP32Serial used to read, or with the buffered LineReader.
+
+Usage (Linux/macOS only, pty is required):
+    ./bench_linereader.py [number of lines] [number of fields]
+"""
+
+import os
+import pty
+import sys
+import time
+import tty
+from threading import Thread
+
+import serial  # pySerial
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'gui'))
+from communication.linereader import LineReader  # pylint: disable=C0413
+
+
+def writer(master, line, nlines):
+    """
+    Writes nlines times line to the master side of the pty.
+    """
+
+    chunk = line * 64
+    written = 0
+    while written < nlines:
+        count = min(64, nlines - written)
+        data = chunk if count == 64 else line * count
+        view = memoryview(data)
+        while view:
+            view = view[os.write(master, view):]
+        written += count
+
+
+def read_with_read_until(connection, nlines):
+    """
+    Reads nlines lines byte by byte with read_until.
+    """
+
+    for _ in range(nlines):
+        connection.read_until(terminator=b'\n')
+
+
+def read_with_linereader(connection, nlines):
+    """
+    Reads nlines lines with the buffered LineReader.
+    """
+
+    lines = LineReader(connection, b'\n')
+    for _ in range(nlines):
+        lines.readline(1)
+
+
+def run(reader, line, nlines):
+    """
+    Times a reader over a fresh pty.
+
+    returns: (wall time, process CPU time) in seconds.
+    """
+
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    connection = serial.Serial(os.ttyname(slave), timeout=1)
+
+    thread = Thread(target=writer, args=(master, line, nlines), daemon=True)
+    start_wall = time.monotonic()
+    start_cpu = time.process_time()
+    thread.start()
+    reader(connection, nlines)
+    wall = time.monotonic() - start_wall
+    cpu = time.process_time() - start_cpu
+    thread.join()
+
+    connection.close()
+    os.close(master)
+    os.close(slave)
+    return wall, cpu
+
+
+def main():
+    """
+    Main function.
+    """
+
+    nlines = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    nfields = int(sys.argv[2]) if len(sys.argv) > 2 else 13
+    line = ("valore=" + ",".join(["%.3f" % (i * 1.234) for i in range(nfields)])
+            + "\r\n").encode()
+
+    print("%d lines of %d bytes (%d fields)" % (nlines, len(line), nfields))
+    for name, reader in (("read_until", read_with_read_until),
+                         ("LineReader", read_with_linereader)):
+        wall, cpu = run(reader, line, nlines)
+        print("%-12s wall %7.3f s  cpu %7.3f s  %9.0f lines/s  %6.1f us cpu/line"
+              % (name, wall, cpu, nlines / wall, cpu / nlines * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the plot redraws.
+
+The plots of the default settings are connected to a DataFiller, fed
+with random data, and redrawn frame after frame, in scrolling and in
+looping mode. The plots are also drawn the way update_plot used to do
+it, on widgets of their own: parsing the color, building a new pen and
+copying the x and y arrays on every redraw, and sending the whole trace
+to pyqtgraph even when looping.
+
+For each, the time per frame, paint included, and the memory allocated
+while updating a frame, as traced by tracemalloc, are reported.
+
+Qt runs on the offscreen platform, so no display is needed.
+
+Usage:
+    ./bench_plot_update.py [number of frames] [samples per frame] [nsamples] [decimation]
+"""
+
+import os
+import sys
+import time
+import tracemalloc
+from ast import literal_eval
+from copy import copy
+
+import numpy as np
+import yaml
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+GUI_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'gui')
+sys.path.insert(0, GUI_DIR)
+# pylint: disable=C0413
+from PyQt5 import QtWidgets
+import pyqtgraph as pg
+from data_filler import DataFiller
+
+
+def make_widgets(config):
+    """
+    Returns: a dict of shown PlotWidgets, keyed by plot name.
+    """
+
+    widgets = {}
+    for name in config['plots']:
+        widget = pg.PlotWidget()
+        widget.resize(800, 130)
+        widget.show()
+        widgets[name] = widget
+    return widgets
+
+
+def legacy_render(filler, items, config):
+    # pylint: disable=protected-access
+    """
+    Redraws all the plots the way update_plot used to do.
+    """
+
+    times = filler._times.view()
+    for name, item in items.items():
+        color = literal_eval(config['plots'][name]['color'].replace('rgb', ''))
+        observable = config['plots'][name]['observable']
+        item.setData(
+            copy(times - times[-1]),
+            copy(filler.plot_data(observable)),
+            pen=pg.mkPen(color, width=config['line_width']))
+        item.getViewBox().setXRange(-filler._time_window, 0)
+
+
+def filler_render(filler):
+    # pylint: disable=protected-access
+    """
+    Redraws all the plots with the DataFiller render clock.
+    """
+
+    filler._dirty.update(filler._plots)
+    filler.render()
+
+
+def measure(app, render, filler, blocks):
+    """
+    Adds the blocks of rows to the plots, rendering after each.
+
+    returns: (mean time per frame, mean bytes allocated per frame)
+    """
+
+    durations = []
+    allocated = []
+    for rows in blocks:
+        filler.add_data_points(rows)
+
+        start = time.perf_counter()
+        render()
+        app.processEvents()
+        durations.append(time.perf_counter() - start)
+
+        # traced apart, tracing slows everything down; restarting the
+        # tracing resets the peak
+        filler.add_data_points(rows)
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        render()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        allocated.append(peak - before)
+        app.processEvents()
+
+    return np.mean(durations), np.mean(allocated)
+
+
+def main():
+    """
+    Main function.
+    """
+
+    nframes = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    per_frame = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    with open(os.path.join(GUI_DIR, 'default_settings.yaml')) as fsettings:
+        config = yaml.load(fsettings, Loader=yaml.FullLoader)
+    if len(sys.argv) > 3:
+        config['nsamples'] = int(sys.argv[3])
+    if len(sys.argv) > 4:
+        config['decimation'] = sys.argv[4]
+
+    app = QtWidgets.QApplication(sys.argv)
+    blocks = np.random.RandomState(0).normal(
+        size=(nframes, per_frame, len(config['get_all_fields'])))
+
+    print("%d plots, %d samples each, %d frames of %d samples, decimation %s"
+          % (len(config['plots']), config['nsamples'], nframes, per_frame,
+             config['decimation']))
+    for looping in (False, True):
+        config['use_looping_plots'] = looping
+        filler = DataFiller(config)
+        widgets = make_widgets(config)
+        for name, widget in widgets.items():
+            filler.connect_plot(name, widget)
+        legacy_widgets = make_widgets(config)
+        legacy_items = {name: widget.plot()
+                        for name, widget in legacy_widgets.items()}
+
+        mode = "looping" if looping else "scrolling"
+        for label, render in (("legacy", lambda: legacy_render(filler, legacy_items, config)),
+                              ("DataFiller", lambda: filler_render(filler))):
+            duration, allocated = measure(app, render, filler, blocks)
+            print("%-9s %-10s %8.1f us/frame  allocated %8.0f B/frame"
+                  % (mode, label, duration * 1e6, allocated))
+
+        for widget in list(widgets.values()) + list(legacy_widgets.values()):
+            widget.close()
+
+
+if __name__ == "__main__":
+    main()
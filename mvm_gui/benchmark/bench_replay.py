@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the ESP32Serial code path on a recorded traffic log.
+
+The incoming bytes of the log are first split and decoded in memory, to
+time the framing and the decoding alone. Then the log is played as fast
+as possible on a pseudo-terminal while ESP32Serial sends the recorded
+commands again, to time the whole code path, serial port included.
+
+Without a log, one is first recorded against the ESP32 emulator of
+mock/esp32_emulator.py.
+
+Usage (Linux/macOS only, pty is required):
+    ./bench_replay.py [--log /tmp/session.traffic] [--duration 5] [--binary]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import yaml
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BASE_DIR, '..', 'gui'))
+sys.path.insert(0, os.path.join(BASE_DIR, '..', 'mock'))
+# pylint: disable=C0413
+from communication.esp32serial import ESP32Serial, ESP32Exception
+from communication.binaryframe import BINARY_REPLY, FrameDecoder
+from communication.linereader import LineReader
+from communication.traffic import TrafficReplayer, read_traffic, OUTGOING, INCOMING
+from esp32_emulator import ESP32Emulator
+
+COMMANDS = ["get all", "get alarm", "get warning", "set watchdog_reset 1"]
+
+
+class MemoryPort:
+    """
+    The bare minimum of a serial.Serial reading from memory, for
+    LineReader.
+    """
+
+    def __init__(self, data):
+        self.timeout = 0
+        self._data = memoryview(data)
+        self._position = 0
+
+    @property
+    def in_waiting(self):
+        """
+        Returns: the number of bytes left.
+        """
+        return min(len(self._data) - self._position, 4096)
+
+    def read(self, size):
+        """
+        Returns: the next size bytes at most.
+        """
+        data = self._data[self._position:self._position + size].tobytes()
+        self._position += len(data)
+        return data
+
+
+def record(config, path, duration, binary):
+    """
+    Records a log of duration seconds against the emulator.
+    """
+
+    emulator = ESP32Emulator(config["get_all_fields"])
+    config["port"] = emulator.start()
+    esp32 = ESP32Serial(config, record=path)
+    if binary:
+        esp32.use_binary_frames(True)
+
+    start = time.monotonic()
+    while time.monotonic() - start < duration:
+        esp32.transact(COMMANDS)
+
+    esp32.close()
+    emulator.stop()
+
+
+def bench_decode(config, path):
+    """
+    Splits and decodes the incoming bytes of the log in memory.
+    """
+
+    fields = config["get_all_fields"]
+    decoder = FrameDecoder(fields)
+    data = b"".join(data for _, direction, data in read_traffic(path)
+                    if direction == INCOMING)
+    lines = LineReader(MemoryPort(data), b"\r\n",
+                       {BINARY_REPLY: decoder.line_length(BINARY_REPLY)})
+    row = np.zeros(len(fields))
+
+    count = 0
+    start = time.process_time()
+    line = lines.readline(1)
+    while line:
+        if line.startswith(BINARY_REPLY):
+            decoder.decode(line[len(BINARY_REPLY):], row)
+        elif line.startswith(b"valore=") and line.count(b",") == len(fields) - 1:
+            row[:] = line[7:].split(b",")
+        count += 1
+        line = lines.readline(1)
+    cpu = time.process_time() - start
+
+    print("decode: %d lines, %d bytes in %.3f s cpu: %.1f us/line"
+          % (count, len(data), cpu, cpu / max(count, 1) * 1e6))
+
+
+def bench_replay(config, path):
+    """
+    Sends the recorded commands again to the log played as fast as
+    possible.
+    """
+
+    records = list(read_traffic(path))
+    bursts = [data.decode().split("\r\n")[:-1] for _, direction, data in records
+              if direction == OUTGOING]
+
+    replayer = TrafficReplayer(path, speed=0)
+    config["port"] = replayer.start()
+    esp32 = ESP32Serial(config)
+
+    failures = 0
+    start = time.monotonic()
+    start_cpu = time.process_time()
+    for burst in bursts:
+        replies = esp32.transact(burst)
+        failures += sum(isinstance(reply, ESP32Exception) for reply in replies)
+    wall = time.monotonic() - start
+    cpu = time.process_time() - start_cpu
+
+    recorded = records[-1][0] - records[0][0]
+    print("replay: %d transactions in %.2f s (recorded in %.2f s), "
+          "%.0f/s, %.0f us cpu each, %d failed commands"
+          % (len(bursts), wall, recorded, len(bursts) / wall,
+             cpu / max(len(bursts), 1) * 1e6, failures))
+
+    esp32.close()
+    replayer.stop()
+
+
+def main():
+    """
+    Main function.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument("--log", help="the traffic log, recorded if missing")
+    parser.add_argument("--duration", type=float, default=5.,
+                        help="length of the recording in seconds")
+    parser.add_argument("--binary", action="store_true",
+                        help="record with the binary get all frames")
+    args = parser.parse_args()
+
+    with open(os.path.join(BASE_DIR, '..', 'gui', 'default_settings.yaml')) as fsettings:
+        config = yaml.load(fsettings, Loader=yaml.FullLoader)
+
+    path = args.log
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(), "bench.traffic")
+        record(config, path, args.duration, args.binary)
+
+    bench_decode(config, path)
+    bench_replay(config, path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the sample store of the plots.
+
+Times adding a sample to the last n ones, the way DataFiller used to do,
+shifting a NumPy array by one, and with the RingBuffer, for increasing n.
+
+Usage:
+    ./bench_ringbuffer.py [number of samples added]
+"""
+
+import os
+import sys
+import timeit
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'gui'))
+from ringbuffer import RingBuffer  # pylint: disable=C0413
+
+
+def main():
+    """
+    Main function.
+    """
+
+    nadd = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    print("%-10s %14s %14s" % ("samples", "shift [us]", "RingBuffer [us]"))
+    for size in (100, 1000, 10000, 100000, 1000000):
+        data = np.zeros(size)
+        ring = RingBuffer(size)
+
+        def shift():
+            data[:-1] = data[1:]
+            data[-1] = 1.
+
+        shift_time = timeit.timeit(shift, number=nadd) / nadd
+        ring_time = timeit.timeit(lambda: ring.append(1.), number=nadd) / nadd
+        print("%-10d %14.2f %14.2f" % (size, shift_time * 1e6, ring_time * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the long term history of the observables.
+
+Fills a TrendStore with the default levels and all the observables of
+the default settings, with 72 h of samples at 50 Hz in blocks of 3,
+and reports the time spent adding a block and the time spent querying
+time ranges from 1 min to 72 h for an 800 pixel wide plot, with the
+number of buckets returned.
+
+Usage:
+    ./bench_trendstore.py [sampling rate in Hz]
+"""
+
+import os
+import sys
+import time
+import timeit
+
+import numpy as np
+import yaml
+
+GUI_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'gui')
+sys.path.insert(0, GUI_DIR)
+from trendstore import TrendStore  # pylint: disable=C0413
+
+
+def main():
+    """
+    Main function.
+    """
+
+    rate = float(sys.argv[1]) if len(sys.argv) > 1 else 50.
+    with open(os.path.join(GUI_DIR, 'default_settings.yaml')) as fsettings:
+        config = yaml.load(fsettings, Loader=yaml.FullLoader)
+    fields = config['get_all_fields']
+    store = TrendStore(fields, config['trend_levels'])
+
+    per_block = 3
+    duration = 72 * 3600
+    nblocks = int(duration * rate / per_block)
+    block = np.random.RandomState(0).normal(size=(per_block, len(fields)))
+    times = np.arange(per_block) / rate
+
+    start = time.perf_counter()
+    for i in range(nblocks):
+        store.add(times + i * per_block / rate, block)
+    elapsed = time.perf_counter() - start
+    print("%d observables, %d blocks of %d samples: %.1f us/block"
+          % (len(fields), nblocks, per_block, elapsed / nblocks * 1e6))
+
+    # pylint: disable=W0212
+    memory = sum(level._times._storage.nbytes + level._values._storage.nbytes
+                 for level in store.levels)
+    print("memory: %.1f MB" % (memory / 1e6))
+
+    now = nblocks * per_block / rate
+    print("%-10s %10s %12s" % ("range", "buckets", "query [us]"))
+    for span in (60, 600, 3600, 12 * 3600, 72 * 3600):
+        result = store.query(fields[0], now - span, now, 800)
+        nquery = 1000
+        query_time = timeit.timeit(
+            lambda: store.query(fields[0], now - span, now, 800),
+            number=nquery) / nquery
+        print("%-10s %10d %12.1f" % ("%d s" % span, len(result[0]), query_time * 1e6))
+
+
+if __name__ == "__main__":
+    main()
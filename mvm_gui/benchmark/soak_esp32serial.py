@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Benchmark and soak test of the ESP32Serial code path.
+
+The ESP32 emulator of mock/esp32_emulator.py is run on a pseudo-terminal,
+with the requested latency and injected errors, and ESP32Serial sends it
+the same transaction the GUI sends on every sampling interval, either at
+a fixed rate or as fast as possible.
+
+Usage (Linux/macOS only, pty is required):
+    ./soak_esp32serial.py --duration 60 --drop 0.01 --garble 0.01
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import yaml
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BASE_DIR, '..', 'gui'))
+sys.path.insert(0, os.path.join(BASE_DIR, '..', 'mock'))
+# pylint: disable=C0413
+from communication.esp32serial import ESP32Serial, ESP32Exception
+from esp32_emulator import ESP32Emulator
+
+COMMANDS = ["get all", "get alarm", "get warning", "set watchdog_reset 1"]
+
+
+def main():
+    """
+    Main function.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument("--duration", type=float, default=10.,
+                        help="length of the run in seconds")
+    parser.add_argument("--rate", type=float, default=0.,
+                        help="transactions per second, 0 for as fast as possible")
+    parser.add_argument("--latency", type=float, default=0.)
+    parser.add_argument("--jitter", type=float, default=0.)
+    parser.add_argument("--drop", type=float, default=0.)
+    parser.add_argument("--garble", type=float, default=0.)
+    parser.add_argument("--noise", type=float, default=0.)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--binary", action="store_true",
+                        help="use the binary get all frames")
+    args = parser.parse_args()
+
+    with open(os.path.join(BASE_DIR, '..', 'gui', 'default_settings.yaml')) as fsettings:
+        config = yaml.load(fsettings, Loader=yaml.FullLoader)
+
+    emulator = ESP32Emulator(config["get_all_fields"], args.latency, args.jitter,
+                             args.drop, args.garble, args.noise, args.seed)
+    config["port"] = emulator.start()
+    esp32 = ESP32Serial(config, latency_budget=config["latency_budget"])
+    if args.binary:
+        esp32.use_binary_frames(True)
+
+    row = np.zeros(len(config["get_all_fields"]))
+    durations = []
+    failures = 0
+    start = time.monotonic()
+    next_start = start
+    while time.monotonic() - start < args.duration:
+        if args.rate:
+            time.sleep(max(next_start - time.monotonic(), 0.))
+            next_start += 1. / args.rate
+
+        sent = time.monotonic()
+        replies = esp32.transact(COMMANDS)
+        durations.append(time.monotonic() - sent)
+        failures += sum(isinstance(reply, ESP32Exception) for reply in replies)
+        if isinstance(replies[0], bytes):
+            esp32.frame_decoder.decode(replies[0], row)
+
+    elapsed = time.monotonic() - start
+    events = esp32.drain_link_events()
+    durations = np.array(durations) * 1e3
+
+    print("%d transactions of %d commands in %.1f s: %.0f/s, %d failed commands"
+          % (len(durations), len(COMMANDS), elapsed, len(durations) / elapsed, failures))
+    print("transaction time [ms]: median %.2f  p99 %.2f  max %.2f"
+          % (np.median(durations), np.percentile(durations, 99), durations.max()))
+    print("round trip time estimate [ms]: %.2f" % (1e3 * (esp32.rtt or 0.)))
+    print("link state changes: %d, last: %s" %
+          (len(events), events[-1][1:] if events else esp32.link_state))
+    print("emulator:", emulator.statistics)
+    print("frames:", esp32.frame_statistics())
+
+    esp32.close()
+    emulator.stop()
+
+
+if __name__ == "__main__":
+    main()
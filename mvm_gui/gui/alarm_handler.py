@@ -2,6 +2,10 @@
 Tools for asking the ESP about any alarms that have been raised,
 and telling the user about them if so.
 
+The ESP alarm and warning words come with the get all data if alarm and
+warning are in the get_all_fields, otherwise they are asked for
+periodically. Only the bits which changed add or remove a button.
+
 The top alarmbar shows little QPushButtons for each alarm that is currently active.
 If the user clicks a button, they are shown the message text and a "snooze" button
 for that alarm.
@@ -11,15 +15,23 @@ the user has selected.
 """
 
 import sys
-from PyQt5 import QtCore, QtWidgets
+from PyQt5 import QtWidgets
 
-from messagebox import MessageBox
-from communication.esp32serial import ESP32Exception
+from messagebox import MessageBox, show_later
+from communication.esp32serial import ESP32Exception, LANE_ALARMS
+from communication.binaryframe import BITFIELDS
+from communication.esp32alarm import ESP32Alarm, ESP32Warning
+from journal import (ESP_ALARM, ESP_ALARM_CLEARED, ESP_ALARM_SNOOZE, ESP_WARNING,
+                     ESP_WARNING_CLEARED, ESP_WARNING_SNOOZE)
 
 BITMAP = {1 << x: x for x in range(32)}
 ERROR = 0
 WARNING = 1
 
+# the kinds of journal events of a raised and of a cleared ERROR or WARNING
+JOURNAL_KINDS = {ERROR: (ESP_ALARM, ESP_ALARM_CLEARED),
+                 WARNING: (ESP_WARNING, ESP_WARNING_CLEARED)}
+
 class SnoozeButton:
     """
     Takes care of snoozing alarms.
@@ -75,6 +87,16 @@ class SnoozeButton:
         """
         self._alarmsnooze.show()
 
+    def is_for(self, mode, code):
+        """
+        Arguments:
+        - mode: ERROR or WARNING
+        - code: Integer alarm code
+
+        Returns: True if the button is set to snooze this alarm.
+        """
+        return self._mode == mode and self._code == code
+
     def _on_click_snooze(self):
         """
         The callback function called when the alarm snooze button is clicked.
@@ -173,35 +195,44 @@ class AlarmButton(QtWidgets.QPushButton):
 
 class AlarmHandler:
     """
-    This class starts a QTimer dedicated to checking is there are any errors
-    or warnings coming from ESP32
+    This class checks if there are any errors or warnings coming from ESP32,
+    from the alarm and warning words of the get all data, or else by
+    registering a periodic request to the serial scheduler.
 
     Class members:
     - _esp32: ESP32Serial object for communication
-    - _alarm_time: Timer that will periodically ask the ESP about any alarms
     - _err_buttons: {int: AlarmButton} for any active ERROR alarms
     - _war_buttons: {int: AlarmButton} for any active WARNING alarms
+    - _words: {int: int} the last alarm word (ERROR) and warning word
+        (WARNING) of the ESP, less the bits snoozed since
+    - _journal: EventJournal where the alarms and warnings raised,
+        cleared and snoozed are recorded, None if none
     - _alarmlabel: QLabel showing text of the currently-selected alarm
     - _alarmstack: Stack of QPushButtons for active alarms
     - _alarmsnooze: QPushButton for snoozing an alarm
     - _snooze_btn: SnoozeButton that manipulates _alarmsnooze
     """
 
-    def __init__(self, config, esp32, alarmbar):
+    def __init__(self, config, esp32, scheduler, alarmbar, journal=None):
         """
         Constructor
 
         Arguments: see relevant class members.
+        - scheduler: SerialScheduler that will periodically ask the ESP about any alarms
         """
 
         self._esp32 = esp32
+        self._journal = journal
 
-        self._alarm_timer = QtCore.QTimer()
-        self._alarm_timer.timeout.connect(self.handle_alarms)
-        self._alarm_timer.start(config["alarminterval"] * 1000)
+        # The words in the get all data are given by the DataHandler
+        if not all(name in config["get_all_fields"] for name in BITFIELDS):
+            scheduler.register("alarms", config["alarminterval"],
+                               ["get alarm", "get warning"], self.handle_alarms,
+                               LANE_ALARMS)
 
         self._err_buttons = {}
         self._war_buttons = {}
+        self._words = {ERROR: 0, WARNING: 0}
 
         self._alarmlabel = alarmbar.findChild(QtWidgets.QLabel, "alarmlabel")
         self._alarmstack = alarmbar.findChild(QtWidgets.QHBoxLayout, "alarmstack")
@@ -209,59 +240,111 @@ class AlarmHandler:
 
         self._snooze_btn = SnoozeButton(self._esp32, self, self._alarmsnooze)
 
-    def handle_alarms(self):
+    def handle_alarms(self, replies):
         """
-        The callback method which is called periodically to check if the ESP raised any
-        alarm or warning.
+        The callback method which is called periodically by the scheduler with the
+        alarm and warning retrieved from the ESP.
+
+        Arguments:
+        - replies: the replies to "get alarm" and "get warning"
         """
 
-        # Retrieve alarms and warnings from the ESP
+        # Whichever of the two made it is handled anyway.
+        words = []
+        for name, reply in zip(("alarm", "warning"), replies):
+            if not isinstance(reply, ESP32Exception):
+                try:
+                    reply = int(reply)
+                except ValueError:
+                    reply = ESP32Exception("get", "get " + name, reply)
+            words.append(reply)
+        alarm, warning = words
         try:
-            esp32alarm = self._esp32.get_alarms()
-            esp32warning = self._esp32.get_warnings()
+            if not isinstance(alarm, ESP32Exception):
+                self.set_words(alarm=alarm)
+            if not isinstance(warning, ESP32Exception):
+                self.set_words(warning=warning)
+            for word in words:
+                if isinstance(word, ESP32Exception):
+                    raise word
         except ESP32Exception as error:
-            esp32alarm = None
-            esp32warning = None
             err_msg = "Severe hardware communication error. "
             err_msg += "Cannot retrieve alarm and warning statuses from hardware."
             msg = MessageBox()
-            func = msg.critical("Critical",
-                                err_msg,
-                                str(error),
-                                "Communication error",
-                                {msg.Retry: lambda: None,
-                                 msg.Abort: lambda: sys.exit(-1)})
-            func()
+            detail = str(error)
+            show_later("alarms_comm_error", lambda: msg.critical(
+                "Critical",
+                err_msg,
+                detail,
+                "Communication error",
+                {msg.Retry: lambda: None,
+                 msg.Abort: lambda: sys.exit(-1)})())
+
+    def set_words(self, alarm=None, warning=None):
+        """
+        Shows a button for each alarm and warning raised since the
+        previous words, and removes those of the alarms and warnings
+        cleared.
 
-        #
-        # ALARMS
-        #
-        if esp32alarm:
-            errors = esp32alarm.strerror_all()
+        Arguments:
+        - alarm: the alarm word of the ESP, None if unknown
+        - warning: the warning word of the ESP, None if unknown
+        """
 
-            alarm_codes = esp32alarm.get_alarm_codes()
+        if alarm is not None and alarm != self._words[ERROR]:
+            self._update_buttons(ERROR, ESP32Alarm, self._err_buttons, alarm)
+        if warning is not None and warning != self._words[WARNING]:
+            self._update_buttons(WARNING, ESP32Warning, self._war_buttons, warning)
 
-            for alarm_code, err_str in zip(alarm_codes, errors):
-                if alarm_code not in self._err_buttons:
-                    btn = AlarmButton(ERROR, alarm_code, err_str,
-                                      self._alarmlabel, self._snooze_btn)
-                    self._alarmstack.addWidget(btn)
-                    self._err_buttons[alarm_code] = btn
+    def _update_buttons(self, mode, word_class, buttons, word):
+        """
+        Adds and removes the buttons of the bits of a word which changed.
 
-        #
-        # WARNINGS
-        #
-        if esp32warning:
-            errors = esp32warning.strerror_all()
+        Arguments:
+        - mode: ERROR or WARNING
+        - word_class: ESP32Alarm or ESP32Warning
+        - buttons: _err_buttons or _war_buttons
+        - word: the new word
+        """
 
-            warning_codes = esp32warning.get_alarm_codes()
+        changed = self._words[mode] ^ word
+        cleared = self._words[mode] & changed
+        self._words[mode] = word
+
+        for code in list(buttons):
+            if code & cleared:
+                self._remove_button(mode, buttons, code)
+
+        if self._journal is not None:
+            for code in word_class(cleared).get_alarm_codes():
+                self._journal.record(JOURNAL_KINDS[mode][1], code)
+
+        raised = word_class(word & changed)
+        for code, err_str in zip(raised.get_alarm_codes(), raised.strerror_all()):
+            if self._journal is not None:
+                self._journal.record(JOURNAL_KINDS[mode][0], code, err_str)
+            if code not in buttons:
+                btn = AlarmButton(mode, code, err_str,
+                                  self._alarmlabel, self._snooze_btn)
+                self._alarmstack.addWidget(btn)
+                buttons[code] = btn
+
+    def _remove_button(self, mode, buttons, code):
+        """
+        Removes the button of an alarm or warning, and its message if
+        shown.
 
-            for warning_code, err_str in zip(warning_codes, errors):
-                if warning_code not in self._war_buttons:
-                    btn = AlarmButton(
-                        WARNING, warning_code, err_str, self._alarmlabel, self._snooze_btn)
-                    self._alarmstack.addWidget(btn)
-                    self._war_buttons[warning_code] = btn
+        Arguments:
+        - mode: ERROR or WARNING
+        - buttons: _err_buttons or _war_buttons
+        - code: integer alarm code
+        """
+        buttons[code].deleteLater()
+        del buttons[code]
+        if self._snooze_btn.is_for(mode, code):
+            self._alarmlabel.setText('')
+            self._alarmlabel.setStyleSheet('QLabel { background-color: black; }')
+            self._alarmsnooze.hide()
 
     def snooze_alarm(self, code):
         """
@@ -273,11 +356,11 @@ class AlarmHandler:
         if code not in self._err_buttons:
             raise Exception('Cannot snooze code %s as alarm button doesn\'t exist.' % code)
 
-        self._err_buttons[code].deleteLater()
-        del self._err_buttons[code]
-        self._alarmlabel.setText('')
-        self._alarmlabel.setStyleSheet('QLabel { background-color: black; }')
-        self._alarmsnooze.hide()
+        if self._journal is not None:
+            self._journal.record(ESP_ALARM_SNOOZE, code)
+        self._remove_button(ERROR, self._err_buttons, code)
+        # the next word still carrying the bit shows the button again
+        self._words[ERROR] &= ~code
 
     def snooze_warning(self, code):
         """
@@ -289,8 +372,8 @@ class AlarmHandler:
         if code not in self._war_buttons:
             raise Exception('Cannot snooze code %s as warning button doesn\'t exist.' % code)
 
-        self._war_buttons[code].deleteLater()
-        del self._war_buttons[code]
-        self._alarmlabel.setText('')
-        self._alarmlabel.setStyleSheet('QLabel { background-color: black; }')
-        self._alarmsnooze.hide()
+        if self._journal is not None:
+            self._journal.record(ESP_WARNING_SNOOZE, code)
+        self._remove_button(WARNING, self._war_buttons, code)
+        # the next word still carrying the bit shows the button again
+        self._words[WARNING] &= ~code
@@ -0,0 +1,322 @@
+"""
+Evaluation of the GUI alarms in a separate process, so that a long
+paint, a modal message box or a page load of the GUI does not delay
+their detection.
+
+The samples are written into a ring in shared memory by ESP32Serial, as
+soon as they are read: by the stream reader thread when streaming,
+otherwise by the I/O thread with the replies to get all. The alarm
+process waits for them, checks them against the thresholds, also in
+shared memory, and runs the alarm state machine, see alarmstate.py.
+The states are published in shared memory, and each alarm becoming
+ACTIVE is sent back through a pipe to a listener thread of the GUI
+process, which does not wait for the GUI either.
+"""
+
+import multiprocessing
+import os
+import time
+from threading import Lock, Thread
+
+import numpy as np
+
+from alarms.alarmstate import ACTIVE, NORMAL, PENDING, SNOOZED, evaluate
+
+# the longest time the process sleeps without looking at its commands
+_POLL_INTERVAL = 0.1
+
+
+def _run(shared, columns, commands, events, wake):
+    # pylint: disable=too-many-locals
+    """
+    Body of the alarm process.
+
+    Arguments:
+    - shared: the dict of the shared memory arrays and values, see
+        AlarmProcess
+    - columns: the index in the rows of the observable of each alarm
+    - commands: the Connection the ("clear", index) and ("stop",)
+        commands are received from
+    - events: the Connection the alarms becoming ACTIVE are sent to, as
+        (indexes, first, fired_at, detected_at)
+    - wake: the Semaphore released when samples are written or a
+        command sent
+    """
+    parent = os.getppid()
+    capacity = len(shared["times"])
+    values = np.frombuffer(shared["values"]).reshape(capacity, -1)
+    times = np.frombuffer(shared["times"])
+    setmin = np.frombuffer(shared["setmin"])
+    setmax = np.frombuffer(shared["setmax"])
+    persistence = np.frombuffer(shared["persistence"])
+    holdoff = np.frombuffer(shared["holdoff"])
+    state = np.frombuffer(shared["state"], dtype=np.int32)
+    since = np.zeros(len(state))
+    columns = np.asarray(columns, dtype=int)
+
+    # the samples written while the process was starting are evaluated
+    read = 0
+    while True:
+        if wake.acquire(timeout=_POLL_INTERVAL):
+            while wake.acquire(False):
+                pass
+        if os.getppid() != parent:
+            # the GUI is gone
+            return
+
+        while commands.poll():
+            command = commands.recv()
+            if command[0] == "stop":
+                return
+            if command[0] == "clear" and state[command[1]] == ACTIVE:
+                state[command[1]] = SNOOZED
+                since[command[1]] = time.monotonic()
+
+        written = shared["written"].value
+        if written == read:
+            continue
+        first = max(read, written - capacity)
+        shared["overruns"].value += first - read
+        slots = np.arange(first, written) % capacity
+        rows = values[slots, :][:, columns]
+        stamps = times[slots]
+        # the oldest rows may have been overwritten while being copied
+        valid = np.arange(first, written) >= shared["written"].value - capacity
+        rows, stamps = rows[valid], stamps[valid]
+        read = written
+        shared["evaluated"].value += len(stamps)
+
+        if not shared["running"].value:
+            state[state == PENDING] = NORMAL
+            continue
+
+        any_active = (state == ACTIVE).any()
+        fired, fired_at = evaluate(state, since, (rows < setmin) | (rows > setmax),
+                                   stamps, persistence, holdoff)
+        if fired_at is not None:
+            events.send((np.flatnonzero(fired).tolist(), not any_active,
+                         float(fired_at), time.monotonic()))
+
+
+class AlarmProcess:
+    """
+    Starts and feeds the alarm process.
+
+    Class members:
+    - capacity: the number of samples the ring holds
+    - _shared: {str: RawArray or RawValue} the shared memory: the ring
+        of samples ("values", "times", "written", the number of samples
+        written so far), the thresholds ("setmin", "setmax",
+        "persistence", "holdoff"), the "state" of each alarm, the
+        "running" flag and the counters of the "evaluated" samples and
+        of the samples lost in "overruns"
+    - _conversions: NumPy array with the conversion factor of each field,
+        applied to the streamed samples
+    - _process: the multiprocessing Process
+    - _listener: the Thread receiving the alarms becoming ACTIVE
+    - _callbacks: the functions called by the listener, see connect
+    - _failure_callbacks: the functions called by the listener if the
+        process dies, see connect_failure
+    - _closing: True once close has been called
+    - _latencies: the detection latencies, in seconds
+    """
+
+    def __init__(self, n_fields, columns, conversions, capacity=1024):
+        """
+        Constructor: starts the alarm process.
+
+        Arguments: see relevant class members.
+        - n_fields: the number of get_all_fields
+        - columns: the index in the get_all_fields of the observable of
+            each alarm
+        """
+        self.capacity = capacity
+        self._conversions = np.asarray(conversions, dtype=float)
+        n_alarms = len(columns)
+
+        # spawned rather than forked from a process running Qt and the
+        # serial threads
+        context = multiprocessing.get_context("spawn")
+        self._shared = {
+            "values": context.RawArray("d", capacity * n_fields),
+            "times": context.RawArray("d", capacity),
+            "written": context.RawValue("q", 0),
+            "setmin": context.RawArray("d", n_alarms),
+            "setmax": context.RawArray("d", n_alarms),
+            "persistence": context.RawArray("d", n_alarms),
+            "holdoff": context.RawArray("d", n_alarms),
+            "state": context.RawArray("i", n_alarms),
+            "running": context.RawValue("b", 0),
+            "evaluated": context.RawValue("q", 0),
+            "overruns": context.RawValue("q", 0),
+        }
+        self._values = np.frombuffer(self._shared["values"]).reshape(capacity, n_fields)
+        self._times = np.frombuffer(self._shared["times"])
+        self._write_lock = Lock()
+
+        commands, self._commands = context.Pipe(duplex=False)
+        self._events, events = context.Pipe(duplex=False)
+        # not an Event: setting one whose waiter was killed blocks for ever
+        self._wake = context.Semaphore(0)
+        self._process = context.Process(
+            target=_run, name="AlarmProcess", daemon=True,
+            args=(self._shared, list(columns), commands, events, self._wake))
+        self._process.start()
+        # the ends of the process are its own
+        commands.close()
+        events.close()
+
+        self._callbacks = []
+        self._failure_callbacks = []
+        self._closing = False
+        self._latencies = []
+        self._listener = Thread(target=self._listen, name="AlarmProcess-listener",
+                                daemon=True)
+        self._listener.start()
+
+    def set_thresholds(self, setmin, setmax, persistence, holdoff):
+        """
+        Sets the thresholds of the alarms, see GuiAlarms.
+
+        Arguments:
+        - setmin, setmax, persistence, holdoff: NumPy arrays with a
+            value per alarm
+        """
+        for name, value in (("setmin", setmin), ("setmax", setmax),
+                            ("persistence", persistence), ("holdoff", holdoff)):
+            np.frombuffer(self._shared[name])[:] = value
+
+    def set_running(self, running):
+        """
+        Tells the process if ventilation is happening, alarms being
+        raised only if so.
+        """
+        self._shared["running"].value = bool(running)
+
+    def write(self, rows, times, convert=False):
+        """
+        Writes samples into the ring and wakes the process up.
+
+        Arguments:
+        - rows: 2-D NumPy array with one row of values of the
+            get_all_fields per sample, in order, oldest first
+        - times: the host monotonic time of each row, or a single one
+            for all
+        - convert: if True, the conversions are applied to the rows, as
+            streamed by the ESP
+        """
+        rows = np.asarray(rows, dtype=float).reshape(-1, self._values.shape[1])
+        with self._write_lock:
+            written = self._shared["written"].value
+            slots = np.arange(written, written + len(rows)) % self.capacity
+            if convert:
+                self._values[slots] = rows * self._conversions
+            else:
+                self._values[slots] = rows
+            self._times[slots] = times
+            # the samples are complete before they are counted
+            self._shared["written"].value = written + len(rows)
+        self._wake.release()
+
+    def stream_sink(self, arrivals, rows):
+        """
+        Writes streamed samples, as ESP32Serial.set_frame_sink expects.
+
+        Arguments:
+        - arrivals: the host monotonic time of arrival of each row
+        - rows: 2-D NumPy array of the raw values of the get_all_fields
+        """
+        self.write(rows, arrivals, convert=True)
+
+    def clear(self, index):
+        """
+        Snoozes an ACTIVE alarm, as the user cleared it.
+
+        Arguments:
+        - index: the index of the alarm
+        """
+        self._commands.send(("clear", index))
+        self._wake.release()
+
+    def states(self):
+        """
+        Returns: a NumPy array with the state of each alarm.
+        """
+        return np.frombuffer(self._shared["state"], dtype=np.int32).copy()
+
+    def connect(self, callback):
+        """
+        Registers a function called, from the listener thread, whenever
+        alarms become ACTIVE, with arguments:
+        - indexes: the list of the indexes of the alarms
+        - first: True if no other alarm was ACTIVE
+        - fired_at: the host monotonic time of the sample which made the
+            first one ACTIVE
+        """
+        self._callbacks.append(callback)
+
+    def connect_failure(self, callback):
+        """
+        Registers a function called, from the listener thread, if the
+        process dies before close, with its exit code as argument.
+        """
+        self._failure_callbacks.append(callback)
+
+    def _listen(self):
+        """
+        Body of the listener thread. The process holds the only writing
+        end of the pipe, so it is closed exactly when the process exits.
+        """
+        while True:
+            try:
+                indexes, first, fired_at, detected_at = self._events.recv()
+            except (EOFError, OSError):
+                process = self._process
+                if self._closing or process is None:
+                    return
+                process.join(1.)
+                print("ERROR: the alarm process died, exit code %s" % process.exitcode)
+                for callback in self._failure_callbacks:
+                    callback(process.exitcode)
+                return
+            for callback in self._callbacks:
+                callback(indexes, first, fired_at)
+            self._latencies.append((detected_at - fired_at, time.monotonic() - fired_at))
+
+    def statistics(self):
+        """
+        Returns: a dict with the number of samples evaluated and lost,
+        the number of detections, and the mean and maximum latency, in
+        seconds, from the arrival of the sample to the detection by the
+        process and to the end of the callbacks.
+        """
+        stats = {"evaluated": self._shared["evaluated"].value,
+                 "overruns": self._shared["overruns"].value,
+                 "detections": len(self._latencies)}
+        if self._latencies:
+            latencies = np.array(self._latencies)
+            stats.update({"detection_mean": float(latencies[:, 0].mean()),
+                          "detection_max": float(latencies[:, 0].max()),
+                          "handled_mean": float(latencies[:, 1].mean()),
+                          "handled_max": float(latencies[:, 1].max())})
+        return stats
+
+    def close(self):
+        """
+        Stops the alarm process.
+        """
+        if self._process is None:
+            return
+        self._closing = True
+        try:
+            self._commands.send(("stop",))
+        except OSError:
+            # the process is gone already
+            pass
+        self._wake.release()
+        self._process.join(1.)
+        if self._process.is_alive():
+            self._process.terminate()
+        self._process = None
+        self._events.close()
+        self._commands.close()
@@ -0,0 +1,85 @@
+"""
+The state machine of the GUI alarms, shared by GuiAlarms and the alarm
+process.
+
+Each alarm goes through:
+- NORMAL: in range
+- PENDING: out of range for less than the persistence time
+- ACTIVE: out of range for longer, until the user clears it
+- SNOOZED: cleared by the user, not raised again before the hold-off
+    time, then back to NORMAL
+"""
+
+import numpy as np
+
+# The states of an alarm
+NORMAL = 0
+PENDING = 1
+ACTIVE = 2
+SNOOZED = 3
+
+
+def step(state, since, crossed, now, persistence, holdoff):
+    # pylint: disable=too-many-arguments
+    """
+    Moves the alarms through their state machine with a new sample.
+
+    Arguments:
+    - state: NumPy array with the state of each alarm, updated in place
+    - since: NumPy array with the time each alarm entered its state,
+        updated in place
+    - crossed: NumPy array of bools, True for the alarms whose
+        thresholds the sample crosses
+    - now: the host monotonic time of the sample
+    - persistence: NumPy array with the time each alarm must stay
+        crossed before it becomes ACTIVE
+    - holdoff: NumPy array with the time each alarm stays SNOOZED
+
+    Returns: a NumPy array of bools, True for the alarms which have
+    just become ACTIVE.
+    """
+    state[(state == SNOOZED) & (now - since >= holdoff)] = NORMAL
+
+    start = (state == NORMAL) & crossed
+    state[start] = PENDING
+    since[start] = now
+    state[(state == PENDING) & ~crossed] = NORMAL
+
+    fired = (state == PENDING) & (now - since >= persistence)
+    state[fired] = ACTIVE
+    since[fired] = now
+    return fired
+
+
+def evaluate(state, since, crossed, times, persistence, holdoff):
+    # pylint: disable=too-many-arguments
+    """
+    Moves the alarms through their state machine with a block of
+    samples, stepping sample by sample only if a state can change.
+
+    Arguments: see step
+    - crossed: 2-D NumPy array of bools, one row per sample
+    - times: the host monotonic time of each sample
+
+    Returns: (fired, fired_at), a NumPy array of bools, True for the
+    alarms which have become ACTIVE, and the time of the first sample
+    which made one ACTIVE, None if none.
+    """
+    fired = np.zeros(len(state), dtype=bool)
+    touched = crossed.any(axis=0)
+    if not touched.any():
+        # nothing crossed, only pending alarms can change
+        state[state == PENDING] = NORMAL
+        return fired, None
+
+    if (state[touched] == ACTIVE).all() and not (state == PENDING).any():
+        # the alarms crossed are already active, nothing changes
+        return fired, None
+
+    fired_at = None
+    for row, now in zip(crossed, times):
+        new = step(state, since, row, now, persistence, holdoff)
+        if fired_at is None and new.any():
+            fired_at = now
+        fired |= new
+    return fired, fired_at
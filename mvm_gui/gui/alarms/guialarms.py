@@ -2,7 +2,16 @@
 Alarm facility.
 """
 
+import time
+from collections import deque
 from copy import copy
+from threading import Timer
+import numpy as np
+from communication.esp32serial import ESP32Exception, LANE_ALARMS
+from journal import GUI_ALARM, GUI_ALARM_SNOOZE
+from messagebox import MessageBox
+from alarms.alarmstate import NORMAL, PENDING, ACTIVE, SNOOZED, evaluate
+from alarms.alarmprocess import AlarmProcess
 
 class GuiAlarms:
     """
@@ -10,6 +19,26 @@ class GuiAlarms:
     1) The monitor displaying this observable is set into an alarm state
     2) We tell the ESP about the alarm condition.
 
+    Each alarm goes through a state machine, so that a value staying out of
+    range is signalled once rather than on every sample:
+    - NORMAL: in range
+    - PENDING: out of range for less than the persistence time
+    - ACTIVE: out of range for longer, the monitor is in alarm state until
+        the user clears it
+    - SNOOZED: cleared by the user, not raised again before the hold-off
+        time, then back to NORMAL
+    The monitor is repainted when an alarm becomes ACTIVE, and the ESP is
+    told when the first alarm becomes ACTIVE and when the last is cleared.
+    If telling it fails, it is told again every alarm_retry seconds, as
+    long as an alarm is ACTIVE.
+
+    Unless alarm_process is False in the config, the thresholds are
+    checked by an AlarmProcess rather than in set_data, fed by the
+    ESP32Serial as soon as the values are read: the ESP is told and the
+    alarm recorded as soon as the process detects it, however busy the
+    GUI, and only the monitors wait for set_data to be repainted. Should
+    the process die, set_data checks the thresholds again.
+
     Class members:
     - _obs: {str: dict} for alarm settings, keyed by section name in the config file.
         See below for more details about dict keys.
@@ -18,6 +47,34 @@ class GuiAlarms:
     - _start_stop_worker: gui.start_stop_worker.StartStopWorker
     - _mon_to_obs: {str: str} for monitor name -> observable name
     - _alarmed_monitors: set of monitor names that are currently in alarm state
+    - _journal: EventJournal where the alarms raised and snoozed are
+        recorded, None if none
+    - _fields: the get_all_fields, in order
+    - alarm_names: the names of the alarms checked, in the order of their bit
+        in the masks returned by check
+    - _columns: NumPy array with the index in the get_all_fields of the
+        observable of each alarm checked
+    - _setmin: NumPy array with the lower threshold of each alarm checked,
+        -inf if none
+    - _setmax: NumPy array with the upper threshold of each alarm checked,
+        +inf if none
+    - _bits: NumPy array with the bit of each alarm checked
+    - _persistence: NumPy array with the time each alarm checked must stay
+        crossed before it becomes ACTIVE
+    - _holdoff: NumPy array with the time each alarm checked stays SNOOZED
+    - _state: NumPy array with the state of each alarm checked
+    - _since: NumPy array with the host monotonic time each alarm checked
+        entered its state
+    - _process: AlarmProcess checking the alarms, None if they are
+        checked in set_data
+    - _process_failed: True once the process died, for set_data to
+        take over
+    - _failure_box: the MessageBox telling the process died, None before
+    - _fired: deque of the indexes of the alarms the process made ACTIVE,
+        whose monitors are still to be repainted
+    - _retry: the time, in seconds, after which a failed raise_gui_alarm
+        is sent again
+    - _success: the reply of the ESP to a successful set
 
     Keys for the settings in self._obs:
     - min: Minimum value that can be set for setmin/setmax
@@ -28,8 +85,10 @@ class GuiAlarms:
     - observable: Name of this observable
     - under_threshold_code: Not implemented yet
     - over_threshold_code: Not implemented yet
+    - persistence: (Optional) Overrides alarm_persistence for this alarm
+    - holdoff: (Optional) Overrides alarm_holdoff for this alarm
     """
-    def __init__(self, config, esp32, monitors):
+    def __init__(self, config, esp32, monitors, journal=None):
         """
         Constructor
 
@@ -38,6 +97,7 @@ class GuiAlarms:
         self._obs = copy(config["alarms"])
         self._esp32 = esp32
         self._monitors = monitors
+        self._journal = journal
         self._start_stop_worker = None
         self._mon_to_obs = {}
 
@@ -49,8 +109,29 @@ class GuiAlarms:
             settings['setmax'] = settings.get('setmax', settings.get('max'))
 
         self._alarmed_monitors = set()
+        self._fields = list(config["get_all_fields"])
+        self._default_persistence = config.get("alarm_persistence", 0.)
+        self._default_holdoff = config.get("alarm_holdoff", 10.)
+        self._retry = config.get("alarm_retry", 1.)
+        self._success = config.get("return_success_code", "OK")
+        self._process = None
+        self._compile()
+        self._state = np.full(len(self.alarm_names), NORMAL)
+        self._since = np.zeros(len(self.alarm_names))
         self.update_mon_thresholds()
 
+        self._process_failed = False
+        self._failure_box = None
+        self._fired = deque()
+        if config.get("alarm_process", False):
+            conv = config.get("conversions", {})
+            self._process = AlarmProcess(len(self._fields), self._columns,
+                                         [conv.get(name, 1.) for name in self._fields])
+            self._compile()
+            self._process.connect(self._on_process_alarms)
+            self._process.connect_failure(self._on_process_failure)
+            self._esp32.set_frame_sink(self._process.stream_sink)
+
     def connect_workers(self, start_stop_worker):
         """
         GuiAlarm is governed by the state of start_stop worker.
@@ -69,70 +150,60 @@ class GuiAlarms:
                                       settings.get('max'),
                                       settings.get('setmax'))
 
-    def _get_by_observable(self, observable):
+    def _compile(self):
         """
-        Gets the dict configuration for a particular observable.
-
-        Arguments:
-        - observable: string
-
-        Returns:
-        dict, or None if observable not found
+        Compiles the thresholds into vectors, so that a block of get_all
+        rows is checked in a single comparison. To be called whenever
+        a threshold changes.
         """
-        for settings in self._obs.values():
-            if settings['observable'] == observable:
-                return settings
+        self.alarm_names = [name for name, settings in self._obs.items()
+                            if settings['observable'] in self._fields]
+        settings = [self._obs[name] for name in self.alarm_names]
 
-        return None
+        self._columns = np.array([self._fields.index(item['observable'])
+                                  for item in settings], dtype=int)
+        self._setmin = np.array([-np.inf if item['setmin'] is None else item['setmin']
+                                 for item in settings], dtype=float)
+        self._setmax = np.array([np.inf if item['setmax'] is None else item['setmax']
+                                 for item in settings], dtype=float)
+        self._bits = np.left_shift(1, np.arange(len(settings), dtype=np.int64))
+        self._persistence = np.array([item.get('persistence', self._default_persistence)
+                                      for item in settings], dtype=float)
+        self._holdoff = np.array([item.get('holdoff', self._default_holdoff)
+                                  for item in settings], dtype=float)
+        if self._process is not None:
+            self._process.set_thresholds(self._setmin, self._setmax,
+                                         self._persistence, self._holdoff)
 
-    def _test_over_threshold(self, item, value):
+    def check(self, rows):
         """
-        If the current value is above configured max threshold, set the monitor
-        into an alarmed state.
-
-        Does nothing if there is no upper threshold defined.
+        Checks get_all rows against the thresholds.
 
         Arguments:
-        - item: dict of settings from the config file
-        - value: value to test against
-        """
-        if item['setmax'] is not None:
-            if value > item["setmax"]:
-                self._esp32.raise_gui_alarm()
-                linked_monitor = self._monitors[item['linked_monitor']]
-                linked_monitor.set_alarm_state(isalarm=True)
-                self._alarmed_monitors.add(linked_monitor.configname)
-
-    def _test_under_threshold(self, item, value):
-        """
-        If the current value is below configured min threshold, set the monitor
-        into an alarmed state.
+        - rows: NumPy array with one row, or a block of rows, of values of
+            the get_all_fields, in order
 
-        Does nothing if there is no upper threshold defined.
-
-        Arguments:
-        - item: dict of settings from the config file
-        - value: value to test against
+        Returns: a NumPy array with, for each row, the bitmask of the
+        alarms whose thresholds are crossed, bit i for alarm_names[i].
         """
-        if item['setmin'] is not None:
-            if value < item["setmin"]:
-                self._esp32.raise_gui_alarm()
-                linked_monitor = self._monitors[item['linked_monitor']]
-                linked_monitor.set_alarm_state(isalarm=True)
-                self._alarmed_monitors.add(linked_monitor.configname)
+        values = np.asarray(rows, dtype=float).reshape(-1, len(self._fields))[:, self._columns]
+        crossed = (values < self._setmin) | (values > self._setmax)
+        return crossed.dot(self._bits)
 
-    def _test_thresholds(self, item, value):
+    def _on_process_alarms(self, indexes, first, fired_at): # pylint: disable=W0613
         """
-        If ventilation is currently happening, check if any monitors need
-        to be put into an alarm state.
+        Called by the listener thread of the alarm process when alarms
+        become ACTIVE: the ESP is told and the alarms recorded right
+        away, the monitors are left to set_data.
 
-        Arguments:
-        - item: dict of settings from the config file
-        - value: value to test against
+        Arguments: see AlarmProcess.connect
         """
-        if self._start_stop_worker is not None and self._start_stop_worker.is_running():
-            self._test_over_threshold(item, value)
-            self._test_under_threshold(item, value)
+        if first:
+            self._raise_esp_alarm()
+        for index in indexes:
+            if self._journal is not None:
+                self._journal.record(GUI_ALARM, 1 << index, self.alarm_names[index])
+        self._fired.extend(indexes)
 
     def clear_alarm(self, name):
         """
@@ -143,9 +214,23 @@ class GuiAlarms:
         - name: Monitor name
         """
 
+        obs = self._mon_to_obs.get(name, None)
+        if obs in self.alarm_names:
+            index = self.alarm_names.index(obs)
+            states = self._state if self._process is None else self._process.states()
+            if states[index] == ACTIVE:
+                if self._process is None:
+                    self._state[index] = SNOOZED
+                    self._since[index] = time.monotonic()
+                else:
+                    self._process.clear(index)
+                if self._journal is not None:
+                    self._journal.record(GUI_ALARM_SNOOZE, 1 << index, obs)
+
         if name in self._alarmed_monitors:
             self._alarmed_monitors.remove(name)
-            if len(self._alarmed_monitors) == 0:
+            # the alarms the process made ACTIVE meanwhile are still on
+            if len(self._alarmed_monitors) == 0 and not self._fired:
                 self._esp32.snooze_gui_alarm()
 
         # self._esp32.reset_alarms()
@@ -158,17 +243,166 @@ class GuiAlarms:
         #    if over_code is not None:
         #        self._esp32.snooze_hw_alarm(over_code)
 
-    def set_data(self, data):
+    def set_data(self, rows, times=None):
+        """
+        If ventilation is currently happening, checks new get_all rows
+        against the thresholds and moves the alarms through their state
+        machine. The monitors of the alarms becoming ACTIVE are put into
+        an alarm state, and the ESP is told if none was.
+
+        Arguments:
+        - rows: NumPy array with one row, or a block of rows, of values of
+            the get_all_fields, in order
+        - times: the host monotonic time of each row, or a single one for
+            all, default now
+
+        Returns: the bitmask of the alarms crossed in any of the rows, see
+        check, 0 if not ventilating.
+        """
+        running = self._start_stop_worker is not None and self._start_stop_worker.is_running()
+        if self._process_failed and self._process is not None:
+            self._take_over()
+        if self._process is not None:
+            # the rows have been checked by the process already
+            self._process.set_running(running)
+            self._show_fired()
+            return int(np.bitwise_or.reduce(self.check(rows))) if running else 0
+
+        if not running:
+            self._state[self._state == PENDING] = NORMAL
+            return 0
+
+        masks = self.check(rows)
+        if times is None:
+            times = time.monotonic()
+        times = np.broadcast_to(np.asarray(times, dtype=float), masks.shape)
+        fired, _ = evaluate(self._state, self._since, (masks[:, np.newaxis] & self._bits) != 0,
+                            times, self._persistence, self._holdoff)
+
+        if fired.any():
+            if not self._alarmed_monitors:
+                self._raise_esp_alarm()
+            for index in np.flatnonzero(fired):
+                self._show_alarm(index)
+                if self._journal is not None:
+                    self._journal.record(GUI_ALARM, 1 << index, self.alarm_names[index])
+
+        return int(np.bitwise_or.reduce(masks))
+
+    def _on_process_failure(self, exitcode): # pylint: disable=W0613
+        """
+        Called by the listener thread of the alarm process if it dies:
+        the thresholds are checked by set_data from then on.
+
+        Arguments:
+        - exitcode: the exit code of the process
+        """
+        self._esp32.set_frame_sink(None)
+        self._process_failed = True
+
+    def _take_over(self):
+        """
+        Checks the thresholds in set_data rather than in the dead alarm
+        process, starting from the states it left, and tells the user.
+        """
+        self._state[:] = self._process.states()
+        self._since[:] = time.monotonic()
+        self._show_fired()
+        self._process.close()
+        self._process = None
+
+        # not to hold the checks up, the message does not block
+        self._failure_box = MessageBox()
+        self._failure_box.critical("Alarm process failure",
+                                   "The alarm process stopped.",
+                                   "The alarm thresholds are now checked by the GUI, "
+                                   "and their detection may be delayed when it is busy.",
+                                   "Alarm process failure",
+                                   {MessageBox.Ok: lambda: None},
+                                   do_not_block=True)
+        self._failure_box.show()
+
+    def _any_active(self):
+        """
+        Returns: True if an alarm is ACTIVE.
+        """
+        states = self._state if self._process is None else self._process.states()
+        return bool((states == ACTIVE).any())
+
+    def _raise_esp_alarm(self):
+        """
+        Tells the ESP there is an alarm, without waiting for it: the
+        outcome is checked by _esp_alarm_raised.
+        """
+        try:
+            future = self._esp32.submit(self._esp32.raise_gui_alarm, lane=LANE_ALARMS)
+        except ESP32Exception as error:
+            print("ERROR: raising the GUI alarm failing: %s" % str(error))
+            return
+        future.add_done_callback(self._esp_alarm_raised)
+
+    def _esp_alarm_raised(self, future):
         """
-        Check new observable values against thresholds.
+        Called, from whichever thread completed it, when raise_gui_alarm
+        is over: if it failed, it is sent again after _retry seconds,
+        unless no alarm is ACTIVE any more by then.
 
         Arguments:
-        - data: dict values, keyed by observable name.
+        - future: the Future of the raise_gui_alarm call
+        """
+        error = future.exception()
+        if error is None and future.result() == self._success:
+            return
+
+        print("ERROR: raising the GUI alarm failing: %s" %
+              str(future.result() if error is None else error))
+        if self._any_active():
+            retry = Timer(self._retry, self._retry_esp_alarm)
+            retry.daemon = True
+            retry.start()
+
+    def _retry_esp_alarm(self):
+        """
+        Sends raise_gui_alarm again, if an alarm is still ACTIVE.
+        """
+        if self._any_active():
+            self._raise_esp_alarm()
+
+    def _show_fired(self):
+        """
+        Puts the monitors of the alarms the process made ACTIVE into an
+        alarm state.
+        """
+        while self._fired:
+            self._show_alarm(self._fired[0])
+            self._fired.popleft()
+
+    def _show_alarm(self, index):
+        """
+        Puts the monitor of an alarm into an alarm state.
+
+        Arguments:
+        - index: the index of the alarm in alarm_names
+        """
+        linked_monitor = self._monitors[self._obs[self.alarm_names[index]]['linked_monitor']]
+        linked_monitor.set_alarm_state(isalarm=True)
+        self._alarmed_monitors.add(linked_monitor.configname)
+
+    def statistics(self):
+        """
+        Returns: the statistics of the alarm process, see
+        AlarmProcess.statistics, None if there is no process.
+        """
+        if self._process is None:
+            return None
+        return self._process.statistics()
+
+    def close(self):
+        """
+        Stops the alarm process, if any.
         """
-        for observable in data:
-            item = self._get_by_observable(observable)
-            if item is not None:
-                self._test_thresholds(item, data[observable])
+        if self._process is not None:
+            self._process.close()
 
     def has_valid_minmax(self, name):
         """
@@ -257,6 +491,7 @@ class GuiAlarms:
         obs = self._mon_to_obs.get(name, None)
         if obs is not None:
             self._obs[obs]['setmin'] = minvalue
+            self._compile()
             self.update_mon_thresholds()
 
     def update_max(self, name, maxvalue):
@@ -270,4 +505,5 @@ class GuiAlarms:
         obs = self._mon_to_obs.get(name, None)
         if obs is not None:
             self._obs[obs]['setmax'] = maxvalue
+            self._compile()
             self.update_mon_thresholds()
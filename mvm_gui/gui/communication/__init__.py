@@ -5,3 +5,7 @@ Init file for ESP32Serial and ESP32Alarms
 
 from .esp32alarm import *
 from .esp32serial import *
+from .scheduler import *
+from .linereader import *
+from .binaryframe import *
+from .traffic import *
@@ -0,0 +1,162 @@
+"""
+Binary encoding of the get_all frames.
+
+Once enabled with "set binary_frames 1", the ESP32 replies to "get all"
+with a BINARY_REPLY line and streams BINARY_STREAM lines instead of the
+ASCII "valore=" and "stream=" ones. After the prefix comes a fixed
+layout payload, all little-endian:
+
+    uint16      sequence counter, incremented on every frame sent
+    float32[n]  the get_all_fields, in order, except the BITFIELDS which
+                are uint32, so that all their 32 bits are exact
+    uint16      CRC-16/CCITT-FALSE of the above
+
+followed by the usual "\r\n". The payload may contain the terminator,
+so the lines are framed by their length, see LineReader.
+"""
+
+import struct
+from binascii import crc_hqx
+
+__all__ = ("BINARY_REPLY", "BINARY_STREAM", "BITFIELDS", "FrameDecoder",
+           "crc16", "encode_frame")
+
+BINARY_REPLY = b"valbin="
+BINARY_STREAM = b"strbin="
+
+# the get_all_fields carrying the alarm and warning words of the ESP32
+BITFIELDS = ("alarm", "warning")
+
+
+def crc16(data):
+    """
+    Computes the CRC-16/CCITT-FALSE (polynomial 0x1021, initial value
+    0xFFFF) of data, as the ESP32 does.
+
+    arguments:
+    - data           a bytes-like object
+
+    returns: the CRC as an integer
+    """
+
+    return crc_hqx(data, 0xFFFF)
+
+
+def _layout(fields):
+    """
+    Returns: the struct format of the values of a payload, uint32 for
+    the BITFIELDS and float32 for any other of the fields.
+    """
+
+    return "".join("I" if name in BITFIELDS else "f" for name in fields)
+
+
+def encode_frame(sequence, values, fields=None):
+    """
+    Encodes a frame payload, the way the ESP32 does.
+
+    arguments:
+    - sequence       the sequence counter, wrapped to 16 bits
+    - values         the list of the get_all_fields values
+    - fields         the get_all_fields, None if there are no BITFIELDS
+
+    returns: the payload as bytes, without prefix nor terminator.
+    """
+
+    layout = "f" * len(values) if fields is None else _layout(fields)
+    values = [int(value) if code == "I" else value
+              for code, value in zip(layout, values)]
+    data = struct.pack("<H" + layout, sequence & 0xFFFF, *values)
+    return data + struct.pack("<H", crc16(data))
+
+
+class FrameDecoder:
+    """
+    Decodes the binary frames and keeps track of their sequence.
+
+    Class members:
+    - n_fields: the number of get_all_fields in a frame
+    - size: the size in bytes of a payload
+    - last_sequence: the sequence counter of the last good frame, None
+        before the first one
+    - frame_count: the sequence counter of the last good frame, unwrapped
+        and counted from the first one, so that frame_count divided by
+        the stream rate is the device time of the frame
+    - decoded: number of good frames
+    - dropped: number of frames missing in the sequence
+    - stale: number of frames repeated or out of order
+    - corrupted: number of frames with a wrong length or CRC
+    """
+
+    def __init__(self, fields):
+        """
+        Constructor
+
+        arguments:
+        - fields: the get_all_fields, in order
+        """
+        self.n_fields = len(fields)
+        self._layout = struct.Struct("<H%sH" % _layout(fields))
+        self.size = self._layout.size
+        self.last_sequence = None
+        self.frame_count = 0
+
+        self.decoded = 0
+        self.dropped = 0
+        self.stale = 0
+        self.corrupted = 0
+
+    def line_length(self, prefix, terminator=b"\r\n"):
+        """
+        Returns: the length of a whole line carrying a frame, prefix and
+        terminator included.
+        """
+        return len(prefix) + self.size + len(terminator)
+
+    def decode(self, payload, out):
+        """
+        Checks a payload and decodes its values into a preallocated row.
+
+        arguments:
+        - payload: the payload as a bytes-like object, possibly followed by
+            the line terminator
+        - out: a NumPy array of at least n_fields floats, filled with the
+            values if the frame is good and new
+
+        returns: True if out holds a new frame, False if the frame is
+        corrupted or stale, and must be skipped.
+        """
+        if len(payload) < self.size:
+            self.corrupted += 1
+            print("ERROR: binary frame too short: %d bytes" % len(payload))
+            return False
+
+        # a single unpack is cheaper than np.frombuffer for so few values
+        fields = self._layout.unpack_from(payload)
+        if crc16(payload[:self.size - 2]) != fields[-1]:
+            self.corrupted += 1
+            print("ERROR: binary frame CRC mismatch")
+            return False
+
+        sequence = fields[0]
+        if self.last_sequence is not None:
+            delta = (sequence - self.last_sequence) & 0xFFFF
+            if delta == 0 or delta >= 0x8000:
+                self.stale += 1
+                return False
+            self.dropped += delta - 1
+            self.frame_count += delta
+        self.last_sequence = sequence
+
+        out[:self.n_fields] = fields[1:-1]
+        self.decoded += 1
+        return True
+
+    def statistics(self):
+        """
+        Returns: a dict with the frame counters.
+        """
+        return {"decoded": self.decoded,
+                "dropped": self.dropped,
+                "stale": self.stale,
+                "corrupted": self.corrupted}
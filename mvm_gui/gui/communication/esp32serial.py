@@ -2,11 +2,41 @@
 Library to interface with the ESP32
 """
 
-from threading import Lock
+import time
+from collections import deque
+from concurrent.futures import Future
+from itertools import count
+from queue import Queue, PriorityQueue, Empty
+from threading import Thread, current_thread
+import numpy as np
 import serial  # pySerial
+from .binaryframe import BINARY_REPLY, BINARY_STREAM, BITFIELDS, FrameDecoder
+from .linereader import LineReader
+from .traffic import TrafficRecorder, OUTGOING, INCOMING
 from . import ESP32Alarm, ESP32Warning
 
-__all__ = ("ESP32Serial", "ESP32Exception")
+__all__ = ("ESP32Serial", "ESP32Exception", "completed_future",
+           "decode_get_all", "LANE_WATCHDOG", "LANE_CONTROL", "LANE_ALARMS",
+           "LANE_BULK", "LANE_NAMES", "LINK_OK", "LINK_DEGRADED",
+           "LINK_DOWN")
+
+# Priority lanes of the I/O thread, most urgent first: the watchdog must
+# never wait behind anything else, user commands (run, mode, pause_*) come
+# next, then the alarm polling and last the bulk telemetry.
+LANE_WATCHDOG = 0
+LANE_CONTROL = 1
+LANE_ALARMS = 2
+LANE_BULK = 3
+LANE_NAMES = ("watchdog", "control", "alarms", "bulk")
+
+# sorts after any lane, so that close() lets the pending calls run first
+_LANE_SHUTDOWN = len(LANE_NAMES)
+
+# States of the link with the ESP32: replies come in time, replies come
+# only after a retry or a resynchronization, replies don't come at all.
+LINK_OK = "ok"
+LINK_DEGRADED = "degraded"
+LINK_DOWN = "down"
 
 
 class ESP32Exception(Exception):
@@ -32,9 +62,68 @@ class ESP32Exception(Exception):
             "ERROR in %s: line: '%s'; output: %s" % (verb, line, output))
 
 
+class _Preempted(Exception):
+    """
+    Raised on the I/O thread to give way to a more urgent call.
+    """
+
+
+def completed_future(function, *args):
+    """
+    Runs a function right away and wraps its outcome in a Future.
+
+    arguments:
+    - function       the callable to run
+    - args           the positional arguments to pass to it
+
+    returns: a concurrent.futures.Future which is already done.
+    """
+
+    future = Future()
+    try:
+        future.set_result(function(*args))
+    except Exception as exc: # pylint: disable=W0703
+        future.set_exception(exc)
+    return future
+
+
+def decode_get_all(fields, value):
+    """
+    Splits the reply to a "get all" command.
+
+    arguments:
+    - fields         the list of the get_all_fields
+    - value          the reply as a string, e.g. as returned by transact
+
+    returns: a dict with the fields as keys and values as strings.
+    """
+
+    values = value.split(',')
+    if len(values) != len(fields):
+        raise ESP32Exception("get", "get all", value)
+
+    return dict(zip(fields, values))
+
+
 class ESP32Serial:
     """
     Main class for interfacing with the ESP32 via a serial connection.
+
+    The serial port is owned by a dedicated I/O thread. The submit()
+    and *_async methods return a concurrent.futures.Future right away,
+    so that the GUI never waits for the ESP32; get, set, get_all and
+    the other helpers are blocking wrappers around them, handy for
+    scripts.
+
+    The calls are queued in priority lanes (see LANE_NAMES) and run in
+    lane order, first come first served within a lane. A call which is
+    retrying on a missing or garbled reply gives way to any more urgent
+    call waiting, and runs again from scratch afterwards.
+
+    Replies are awaited for a timeout adapted to the measured round trip
+    time, and each call gives up once its latency budget is over. The
+    changes of the link state are recorded as events which the GUI can
+    drain with drain_link_events() without ever blocking.
     """
 
     def __init__(self, config, **kwargs):
@@ -52,22 +141,66 @@ class ESP32Serial:
         - baudrate       the preferred baudrate, default 115200
         - terminator     the line terminator, binary encoded, default
                          b'\n'
-        - timeout        sets the read() timeout in seconds
+        - timeout        the longest time a reply is waited for, in
+                         seconds, default 1
+        - min_timeout    the shortest time a reply is waited for, in
+                         seconds, default 0.05
+        - latency_budget the time, in seconds, after which a call gives
+                         up retrying, default 2
+        - stream_buffer  the number of streamed frames kept in the ring
+                         buffer, default 1024
+        - pipeline_depth the maximum number of commands written in a
+                         single burst by get_many and set_many, default 8
+        - record         the path of a file where all the traffic is
+                         recorded, see traffic.py, default None (off)
         """
 
-        self.lock = Lock()
-
-        baudrate = kwargs["baudrate"] if "baudrate" in kwargs else 115200
-        timeout = kwargs["timeout"] if "timeout" in kwargs else 1
-        self.term = kwargs["terminator"] if "terminator" in kwargs else b'\n'
+        stream_buffer = kwargs.pop("stream_buffer", 1024)
+        self.pipeline_depth = kwargs.pop("pipeline_depth", 8)
+        record = kwargs.pop("record", None)
+        self._recorder = TrafficRecorder(record) if record else None
+        self._frames = deque(maxlen=stream_buffer)
+        self._lines = None
+        self._set_get_all_fields(config["get_all_fields"])
+        self._stream_period = 0.
+        self._frame_sink = None
+        self._replies = Queue()
+        self._reader = None
+        self._streaming = False
+
+        self.latency_budget = kwargs.pop("latency_budget", 2.)
+        self.min_timeout = kwargs.pop("min_timeout", 0.05)
+        self.max_timeout = kwargs.pop("timeout", 1)
+        self._srtt = None
+        self._rttvar = 0.
+        self._rto = self.max_timeout
+        self._link_state = LINK_OK
+        self._link_events = deque(maxlen=64)
+
+        baudrate = kwargs.pop("baudrate", 115200)
+        timeout = self.max_timeout
+        self.term = kwargs.pop("terminator", b'\n')
         self.connection = serial.Serial(port=config["port"],
                                         baudrate=baudrate, timeout=timeout,
                                         **kwargs)
 
-        self.get_all_fields = config["get_all_fields"]
-
         while self.connection.read():
             pass
+        tap = None
+        if self._recorder is not None:
+            tap = lambda data: self._recorder.record(INCOMING, data)
+        self._lines = LineReader(self.connection, self.term, {
+            prefix: self.frame_decoder.line_length(prefix)
+            for prefix in (BINARY_REPLY, BINARY_STREAM)}, tap)
+
+        self._jobs = PriorityQueue()
+        self._sequence = count()
+        self._running_lane = None
+        self._lane_stats = [{"count": 0, "delay_sum": 0., "delay_max": 0.,
+                             "preempted": 0} for _ in LANE_NAMES]
+        self._worker = Thread(target=self._worker_loop,
+                              name="ESP32Serial-io", daemon=True)
+        self._worker.start()
 
     def __del__(self):
         """
@@ -76,9 +209,442 @@ class ESP32Serial:
         Closes the connection.
         """
 
-        with self.lock:
-            if hasattr(self, "connection"):
-                self.connection.close()
+        self.close()
+
+    def close(self):
+        """
+        Stops the I/O thread, once the pending calls are over, and closes
+        the connection.
+        """
+
+        worker = getattr(self, "_worker", None)
+        if worker is None:
+            return
+
+        self._jobs.put((_LANE_SHUTDOWN, next(self._sequence), 0., None,
+                        None, ()))
+        if current_thread() is not worker:
+            worker.join()
+        self._worker = None
+
+        self._stop_reader()
+        self.connection.close()
+        if self._recorder is not None:
+            self._recorder.close()
+
+    def _write(self, data):
+        """
+        Writes data to the ESP32, recording it if requested.
+
+        arguments:
+        - data           the bytes to write
+        """
+
+        if self._recorder is not None:
+            self._recorder.record(OUTGOING, data)
+        self.connection.write(data)
+
+    def _worker_loop(self):
+        """
+        Body of the I/O thread: runs the submitted calls one at a time,
+        most urgent lane first.
+        """
+
+        while True:
+            job = self._jobs.get()
+            lane, _, queued, future, function, args = job
+            if function is None:
+                break
+
+            if not future.running():
+                if not future.set_running_or_notify_cancel():
+                    continue
+                delay = time.monotonic() - queued
+                stats = self._lane_stats[lane]
+                stats["count"] += 1
+                stats["delay_sum"] += delay
+                stats["delay_max"] = max(stats["delay_max"], delay)
+
+            self._running_lane = lane
+            try:
+                future.set_result(function(*args))
+            except _Preempted:
+                print("ESP32Serial-DEBUG: %s deferred" % function.__name__)
+                self._lane_stats[lane]["preempted"] += 1
+                self._flush_input()
+                # same sequence number: first in its lane once the more
+                # urgent calls are over
+                self._jobs.put(job)
+            except Exception as exc: # pylint: disable=W0703
+                print("ERROR: %s failing: %s" % (function.__name__, str(exc)))
+                future.set_exception(exc)
+            finally:
+                self._running_lane = None
+
+    def _yield_to_urgent(self):
+        """
+        Called by a call running on the I/O thread when it is stuck
+        waiting for the ESP32: raises _Preempted if a call in a more
+        urgent lane is waiting, so that it runs first.
+        """
+
+        with self._jobs.mutex:
+            waiting = self._jobs.queue[0][0] if self._jobs.queue else None
+
+        if (waiting is not None and self._running_lane is not None and
+                waiting < self._running_lane):
+            raise _Preempted()
+
+    def lane_statistics(self):
+        """
+        Returns: a dict, keyed by lane name, with the number of calls run,
+        their mean and maximum queueing delay in seconds and the number of
+        times a call in that lane gave way to a more urgent one.
+        """
+
+        return {name: {"count": stats["count"],
+                       "delay_mean": (stats["delay_sum"] / stats["count"]
+                                      if stats["count"] else 0.),
+                       "delay_max": stats["delay_max"],
+                       "preempted": stats["preempted"]}
+                for name, stats in zip(LANE_NAMES, self._lane_stats)}
+
+    def submit(self, function, *args, lane=LANE_CONTROL):
+        """
+        Schedules a call on the I/O thread.
+
+        arguments:
+        - function       the callable to run, usually a method of this
+                         class, e.g. esp32.submit(esp32.get_alarms)
+        - args           the positional arguments to pass to it
+
+        named arguments:
+        - lane           the priority lane, default LANE_CONTROL
+
+        returns: a concurrent.futures.Future with the outcome of the call.
+        """
+
+        if self._worker is None:
+            raise ESP32Exception("submit", function.__name__,
+                                 "connection closed")
+
+        if current_thread() is self._worker:
+            # already on the I/O thread, queueing would deadlock
+            return completed_future(function, *args)
+
+        future = Future()
+        self._jobs.put((lane, next(self._sequence), time.monotonic(),
+                        future, function, args))
+        return future
+
+    def _call(self, function, *args, lane=LANE_CONTROL):
+        """
+        Runs a call on the I/O thread and waits for its outcome.
+
+        arguments:
+        - function       the callable to run
+        - args           the positional arguments to pass to it
+
+        named arguments:
+        - lane           the priority lane, default LANE_CONTROL
+
+        returns: whatever function returns, or raises what it raises.
+        """
+
+        return self.submit(function, *args, lane=lane).result()
+
+    def _readline(self, timeout):
+        """
+        Reads a reply line from the ESP32.
+
+        When streaming, the serial port is owned by the reader thread and
+        the replies to get/set commands are collected from its queue.
+
+        arguments:
+        - timeout        the time to wait for the line, in seconds
+
+        returns: the line as a binary buffer, empty on timeout
+        """
+
+        if self._reader is None:
+            return self._lines.readline(timeout)
+
+        try:
+            return self._replies.get(timeout=timeout)
+        except Empty:
+            return b""
+
+    def _sample_rtt(self, rtt):
+        """
+        Updates the round trip time estimate and the timeout derived from
+        it, the same way TCP does (RFC 6298).
+
+        arguments:
+        - rtt            the measured round trip time in seconds
+        """
+
+        if self._srtt is None:
+            self._srtt = rtt
+            self._rttvar = rtt / 2.
+        else:
+            self._rttvar = 0.75 * self._rttvar + 0.25 * abs(self._srtt - rtt)
+            self._srtt = 0.875 * self._srtt + 0.125 * rtt
+
+        self._rto = min(max(self._srtt + 4. * self._rttvar, self.min_timeout),
+                        self.max_timeout)
+
+    def _backoff(self):
+        """
+        Doubles the timeout after a missing reply, up to the maximum.
+        """
+
+        self._rto = min(2. * self._rto, self.max_timeout)
+
+    @property
+    def rtt(self):
+        """
+        The smoothed round trip time in seconds, None until measured.
+        """
+
+        return self._srtt
+
+    @property
+    def link_state(self):
+        """
+        The current state of the link: LINK_OK, LINK_DEGRADED or LINK_DOWN.
+        """
+
+        return self._link_state
+
+    def _set_link_state(self, state, reason):
+        """
+        Changes the link state, recording an event if it actually changed.
+
+        arguments:
+        - state          the new state
+        - reason         a human readable description of the cause
+        """
+
+        if state == self._link_state:
+            return
+
+        print("ESP32Serial-DEBUG: link %s: %s" % (state, reason))
+        self._link_state = state
+        self._link_events.append((time.monotonic(), state, reason))
+
+    def drain_link_events(self):
+        """
+        Returns the link state changes since the last call, without
+        waiting for the I/O thread.
+
+        returns: a list of (host monotonic time, state, reason) tuples,
+        oldest first.
+        """
+
+        events = []
+        while self._link_events:
+            events.append(self._link_events.popleft())
+        return events
+
+    def _resync(self, deadline):
+        """
+        Recovers from a desynchronized input: discards what was received
+        so far, then whatever else shows up until the ESP32 has been quiet
+        for one timeout, so that late replies to the previous commands
+        are not taken as the replies to the next ones. On a healthy link
+        this takes one round trip.
+
+        arguments:
+        - deadline       the monotonic time at which to give up anyway
+        """
+
+        self._flush_input()
+
+        now = time.monotonic()
+        while now < deadline:
+            line = self._readline(min(self._rto, deadline - now))
+            if not line:
+                break
+            print("ESP32Serial-DEBUG: discarding %s" %
+                  line.decode(errors="replace").strip())
+            now = time.monotonic()
+
+    def _discard_stale_input(self, deadline):
+        """
+        Resynchronizes the input if something is waiting to be read
+        before a command is even sent: it can only be a reply nobody
+        expected, e.g. the two halves of a garbled one, which would be
+        taken as the reply to the next command, and so on.
+
+        arguments:
+        - deadline       the monotonic time at which to give up anyway
+        """
+
+        if self._reader is None:
+            stale = self._lines.pending()
+        else:
+            stale = not self._replies.empty()
+
+        if stale:
+            self._set_link_state(LINK_DEGRADED, "unexpected input")
+            self._resync(deadline)
+
+    def _exchange(self, verb, command, decode):
+        """
+        Writes a command and waits for its reply, to be run on the I/O
+        thread.
+
+        The reply is awaited for the adaptive timeout, skipping any line
+        which cannot be decoded. If no valid reply shows up in time, the
+        input is resynchronized and the command is sent again, until the
+        latency budget is over.
+
+        arguments:
+        - verb           the transmit verb, for the error messages
+        - command        the command, terminator included
+        - decode         the callable turning the reply value into the
+                         result
+
+        returns: the decoded reply.
+        """
+
+        deadline = time.monotonic() + self.latency_budget
+        self._discard_stale_input(deadline)
+
+        result = b""
+        attempt = 0
+        while True:
+            attempt += 1
+            garbled = False
+            sent = time.monotonic()
+            self._write(command.encode())
+
+            while True:
+                now = time.monotonic()
+                if now >= deadline:
+                    break
+                line = self._readline(min(self._rto, deadline - now))
+                if not line:
+                    break
+
+                result = line
+                try:
+                    value = decode(self._parse(result))
+                except Exception as exc: # pylint: disable=W0703
+                    print("ERROR: %s failing: %s %s" %
+                          (verb, result.decode(errors="replace"), str(exc)))
+                    garbled = True
+                    continue
+
+                if attempt == 1 and not garbled:
+                    # retried exchanges say nothing about the round trip
+                    self._sample_rtt(time.monotonic() - sent)
+                    self._set_link_state(LINK_OK, "reply in time")
+                else:
+                    self._set_link_state(LINK_DEGRADED, "%s: %s" %
+                                         (command.strip(), "garbled reply"))
+                return value
+
+            self._backoff()
+            self._set_link_state(LINK_DEGRADED, "%s: no reply" % command.strip())
+
+            self._resync(deadline)
+            if time.monotonic() >= deadline:
+                break
+
+            # give way to more urgent calls rather than insisting
+            self._yield_to_urgent()
+
+        self._set_link_state(LINK_DOWN, "%s: no valid reply in %g s" %
+                             (command.strip(), self.latency_budget))
+        raise ESP32Exception(verb, command, result.decode(errors="replace"))
+
+    def _reader_loop(self):
+        """
+        Body of the reader thread used in streaming mode.
+
+        Frames starting with 'stream=', or their binary counterpart, are
+        decoded and stored, together with the host monotonic time of
+        arrival and, for binary frames, the device time given by their
+        sequence counter, in the frames ring buffer. Any other line is a
+        reply to a get/set command and is forwarded to the replies queue.
+        """
+
+        n_fields = len(self.get_all_fields)
+        n_rows = len(self._frame_rows)
+
+        while self._streaming:
+            try:
+                lines = self._lines.readlines(self.max_timeout)
+            except serial.SerialException as exc:
+                print("ERROR: stream reader failing: %s" % str(exc))
+                self._set_link_state(LINK_DOWN, str(exc))
+                self._streaming = False
+                break
+
+            arrival = time.monotonic()
+            first = self._frame_index
+            count = 0
+            for line in lines:
+                row = self._frame_rows[self._frame_index]
+
+                if line.startswith(BINARY_STREAM):
+                    if not self._stream_decoder.decode(
+                            line[len(BINARY_STREAM):], row):
+                        continue
+                    device_time = self._stream_decoder.frame_count * self._stream_period
+                elif line.startswith(b"stream="):
+                    values = line[7:].decode(errors="replace").strip().split(',')
+                    if len(values) != n_fields:
+                        print("ERROR: stream frame mismatch: %s" % line)
+                        continue
+                    try:
+                        row[:] = [float(value) for value in values]
+                    except ValueError:
+                        print("ERROR: stream frame mismatch: %s" % line)
+                        continue
+                    device_time = float("nan")
+                else:
+                    self._replies.put(line)
+                    continue
+
+                self._frame_index = (self._frame_index + 1) % n_rows
+                # the ring goes on being written after a drain
+                self._frames.append((arrival, device_time, row.copy()))
+                count += 1
+
+            # read once, as it may be unset from another thread
+            sink = self._frame_sink
+            if count and sink is not None:
+                rows = self._frame_rows[np.arange(first, first + count) % n_rows]
+                sink(np.full(count, arrival), rows)
+
+    def _flush_input(self):
+        """
+        Discards whatever the ESP32 sent and nobody read yet.
+        """
+
+        if self._reader is None:
+            self.connection.reset_input_buffer()
+            self._lines.reset()
+
+        while not self._replies.empty():
+            self._replies.get_nowait()
+
+    def _stop_reader(self):
+        """
+        Stops the reader thread, if any, and discards whatever the
+        ESP32 sent in the meantime.
+        """
+
+        if self._reader is None:
+            return
+
+        self._streaming = False
+        self._reader.join()
+        self._reader = None
+
+        self._flush_input()
 
     def _parse(self, result):
         """
@@ -87,9 +653,13 @@ class ESP32Serial:
         arguments:
         - result         what the ESP replied as a binary buffer
 
-        returns the requested value as a string
+        returns the requested value as a string, or the payload as bytes
+        for a binary frame
         """
 
+        if result.startswith(BINARY_REPLY):
+            return result[len(BINARY_REPLY):]
+
         check_str, value = result.decode().split('=')
         check_str = check_str.strip()
 
@@ -97,9 +667,9 @@ class ESP32Serial:
             raise Exception("protocol error: 'valore=' expected")
         return value.strip()
 
-    def set(self, name, value):
+    def _set(self, name, value):
         """
-        Set command wrapper
+        Set command, to be run on the I/O thread.
 
         arguments:
         - name           the parameter name as a string
@@ -111,24 +681,34 @@ class ESP32Serial:
 
         print("ESP32Serial-DEBUG: set %s %s" % (name, value))
 
-        with self.lock:
-            # I know about Python 3.7 magic string formatting capability
-            # but I don't really remember now the version running on
-            # Raspbian
-            command = 'set ' + name + ' ' + str(value) + '\r\n'
-            self.connection.write(command.encode())
-
-            result = b""
-            retry = 10
-            while retry:
-                retry -= 1
-                try:
-                    result = self.connection.read_until(terminator=self.term)
-                    return self._parse(result)
-                except Exception as exc: # pylint: disable=W0703
-                    print("ERROR: set failing: %s %s" %
-                          (result.decode(), str(exc)))
-            raise ESP32Exception("set", command, result.decode())
+        # I know about Python 3.7 magic string formatting capability
+        # but I don't really remember now the version running on
+        # Raspbian
+        command = 'set ' + name + ' ' + str(value) + '\r\n'
+        return self._exchange("set", command, str)
+
+    def set_async(self, name, value):
+        """
+        Non-blocking version of set.
+
+        returns: a Future resolving to an "OK" string in case of success.
+        """
+
+        return self.submit(self._set, name, value)
+
+    def set(self, name, value):
+        """
+        Set command wrapper
+
+        arguments:
+        - name           the parameter name as a string
+        - value          the value to assign to the variable as any type
+                         convertible to string
+
+        returns: an "OK" string in case of success.
+        """
+
+        return self._call(self._set, name, value)
 
     def set_watchdog(self):
         """
@@ -137,7 +717,31 @@ class ESP32Serial:
         returns: an "OK" string in case of success.
         """
 
-        return self.set("watchdog_reset", 1)
+        return self._call(self._set, "watchdog_reset", 1, lane=LANE_WATCHDOG)
+
+    def _get(self, name):
+        """
+        Get command, to be run on the I/O thread.
+
+        arguments:
+        - name           the parameter name as a string
+
+        returns: the requested value
+        """
+
+        print("ESP32Serial-DEBUG: get %s" % name)
+
+        command = 'get ' + name + '\r\n'
+        return self._exchange("get", command, str)
+
+    def get_async(self, name):
+        """
+        Non-blocking version of get.
+
+        returns: a Future resolving to the requested value.
+        """
+
+        return self.submit(self._get, name)
 
     def get(self, name):
         """
@@ -149,23 +753,47 @@ class ESP32Serial:
         returns: the requested value
         """
 
-        print("ESP32Serial-DEBUG: get %s" % name)
+        return self._call(self._get, name)
+
+    def _get_all(self):
+        """
+        Get all command, to be run on the I/O thread.
 
-        with self.lock:
-            command = 'get ' + name + '\r\n'
-            self.connection.write(command.encode())
+        returns: a dict with the get_all_fields as keys and values as
+        strings.
+        """
 
-            result = b""
-            retry = 10
-            while retry:
-                retry -= 1
-                try:
-                    result = self.connection.read_until(terminator=self.term)
-                    return self._parse(result)
-                except Exception as exc: # pylint: disable=W0703
-                    print("ERROR: get failing: %s %s" %
-                          (result.decode(), str(exc)))
-            raise ESP32Exception("get", command, result.decode())
+        print("ESP32Serial-DEBUG: get all")
+
+        return self._exchange("get", "get all\r\n", self._decode_get_all)
+
+    def _decode_get_all(self, value):
+        """
+        Decodes the reply to get all, either ASCII or binary.
+
+        arguments:
+        - value          the value returned by _parse
+
+        returns: a dict with the get_all_fields as keys, and values as
+        strings, or as floats for a binary frame.
+        """
+
+        if not isinstance(value, bytes):
+            return decode_get_all(self.get_all_fields, value)
+
+        row = np.empty(len(self.get_all_fields))
+        if not self.frame_decoder.decode(value, row):
+            raise ESP32Exception("get", "get all", "bad binary frame")
+        return dict(zip(self.get_all_fields, row.tolist()))
+
+    def get_all_async(self):
+        """
+        Non-blocking version of get_all.
+
+        returns: a Future resolving to the get_all dict.
+        """
+
+        return self.submit(self._get_all, lane=LANE_BULK)
 
     def get_all(self):
         """
@@ -173,31 +801,240 @@ class ESP32Serial:
         object.
 
         returns: a dict with member keys as written above and values as
-        strings.
+        strings, or as floats if binary frames are in use.
         """
 
-        print("ESP32Serial-DEBUG: get all")
+        return self._call(self._get_all, lane=LANE_BULK)
 
-        with self.lock:
-            self.connection.write(b"get all\r\n")
+    def _transact(self, commands):
+        """
+        Writes the commands in bursts of at most pipeline_depth, then
+        reads the replies and matches them in order. To be run on the I/O
+        thread.
 
-            result = b""
-            retry = 10
-            while retry:
-                retry -= 1
-                try:
-                    result = self.connection.read_until(terminator=self.term)
-                    values = self._parse(result).split(',')
+        As in _exchange, a line which cannot be parsed is skipped. Once a
+        reply is missing, or cannot be the reply to its command, or the
+        latency budget is over, the input is resynchronized and the whole
+        burst fails, as well as the remaining commands: the replies are
+        not tagged, so a garbled or lost reply anywhere in the burst may
+        have made the others read those of the next commands.
 
-                    if len(values) != len(self.get_all_fields):
-                        raise Exception("get_all answer mismatch: expected: %s, got %s" % (
-                            self.get_all_fields, values))
+        arguments:
+        - commands       the list of commands, without line terminator
 
-                    return dict(zip(self.get_all_fields, values))
-                except Exception as exc: # pylint: disable=W0703
-                    print("ERROR: get failing: %s %s" %
-                          (result.decode(), str(exc)))
-            raise ESP32Exception("get", "get all", result.decode())
+        returns: a list with, for each command, the replied value as a
+        string or the ESP32Exception describing its failure.
+        """
+
+        print("ESP32Serial-DEBUG: %s" % "; ".join(commands))
+
+        deadline = time.monotonic() + self.latency_budget
+        self._discard_stale_input(deadline)
+
+        garbled = 0
+        results = []
+        for first in range(0, len(commands), self.pipeline_depth):
+            burst = commands[first:first + self.pipeline_depth]
+            sent = time.monotonic()
+            self._write(
+                "".join(command + '\r\n' for command in burst).encode())
+
+            for command in burst:
+                value = None
+                while value is None:
+                    now = time.monotonic()
+                    result = b""
+                    if now < deadline:
+                        result = self._readline(min(self._rto, deadline - now))
+                    if not result:
+                        break
+
+                    try:
+                        value = self._parse(result)
+                    except Exception as exc: # pylint: disable=W0703
+                        print("ERROR: %s failing: %s %s" %
+                              (command.split(' ')[0], result.decode(errors="replace"),
+                               str(exc)))
+                        garbled += 1
+
+                if value is not None and self._misplaced(command, value):
+                    print("ERROR: %s: out of place reply %s" % (command, value))
+                    garbled += 1
+                    value = None
+                if value is None:
+                    del results[first:]
+                    # the remaining replies may still show up later and
+                    # mess up the next commands
+                    self._backoff()
+                    self._resync(deadline)
+                    self._yield_to_urgent()
+                    break
+
+                if first == 0 and not results and not garbled:
+                    self._sample_rtt(time.monotonic() - sent)
+                if command == "get all":
+                    self._sink_reply(value)
+                results.append(value)
+
+            if len(results) < first + len(burst):
+                break
+
+        if not results and commands and not garbled:
+            self._set_link_state(LINK_DOWN, "%s: no reply" % commands[0])
+        elif len(results) < len(commands) or garbled:
+            self._set_link_state(LINK_DEGRADED, "%d of %d replies missing or "
+                                 "garbled" % (len(commands) - len(results) + garbled,
+                                              len(commands)))
+        else:
+            self._set_link_state(LINK_OK, "replies in time")
+
+        for command in commands[len(results):]:
+            results.append(ESP32Exception(command.split(' ')[0], command,
+                                          "no reply"))
+
+        return results
+
+    def _sink_reply(self, value):
+        """
+        Passes a get all reply to the frame sink, as soon as it is read.
+
+        arguments:
+        - value          the reply, as returned by _parse
+        """
+
+        arrival = time.monotonic()
+        # read once, as it may be unset from another thread
+        sink = self._frame_sink
+        if sink is None:
+            return
+        if isinstance(value, bytes):
+            if not self._sink_decoder.decode(value, self._sink_row[0]):
+                return
+        else:
+            values = value.split(',')
+            if len(values) != self._sink_row.shape[1]:
+                return
+            try:
+                self._sink_row[0] = [float(item) for item in values]
+            except ValueError:
+                return
+        sink(np.array([arrival]), self._sink_row)
+
+    @staticmethod
+    def _misplaced(command, value):
+        """
+        Tells a reply which cannot be the reply to a command, e.g. a get
+        all payload read for a get, as the replies are not tagged.
+
+        arguments:
+        - command        the command, without line terminator
+        - value          the parsed reply, see _parse
+
+        returns: True if value cannot be the reply to command.
+        """
+
+        if command == "get all":
+            return not isinstance(value, bytes) and ',' not in value
+        if isinstance(value, bytes) or ',' in value:
+            return True
+        if command.startswith("set "):
+            # a set is answered "OK" or with an error, never a number
+            try:
+                float(value)
+            except ValueError:
+                return False
+            return True
+        return value == "OK"
+
+    def transact_async(self, commands, lane=LANE_CONTROL):
+        """
+        Non-blocking version of transact.
+
+        returns: a Future resolving to the list of replies.
+        """
+
+        return self.submit(self._transact, list(commands), lane=lane)
+
+    def transact(self, commands, lane=LANE_CONTROL):
+        """
+        Sends several commands with a single round trip: all of them are
+        written at once, then the replies are read.
+
+        arguments:
+        - commands       the list of commands, e.g. ["get all",
+                         "set watchdog_reset 1"]
+        - lane           the priority lane, default LANE_CONTROL
+
+        returns: a list with, for each command, the replied value as a
+        string or the ESP32Exception describing its failure. A binary
+        get all frame is returned as bytes, see FrameDecoder.
+        """
+
+        return self._call(self._transact, list(commands), lane=lane)
+
+    def _get_many(self, names):
+        """
+        See get_many, to be run on the I/O thread.
+        """
+
+        results = self._transact(['get ' + name for name in names])
+        return dict(zip(names, results))
+
+    def get_many_async(self, names):
+        """
+        Non-blocking version of get_many.
+
+        returns: a Future resolving to the get_many dict.
+        """
+
+        return self.submit(self._get_many, list(names))
+
+    def get_many(self, names):
+        """
+        Gets several parameters with a single round trip: all the get
+        commands are written at once, then the replies are read.
+
+        arguments:
+        - names          an iterable of parameter names
+
+        returns: a dict keyed by name, with the requested value as a
+        string or the ESP32Exception raised for that parameter.
+        """
+
+        return self._call(self._get_many, list(names))
+
+    def _set_many(self, values):
+        """
+        See set_many, to be run on the I/O thread.
+        """
+
+        names = list(values)
+        results = self._transact(['set ' + name + ' ' + str(values[name])
+                                  for name in names])
+        return dict(zip(names, results))
+
+    def set_many_async(self, values):
+        """
+        Non-blocking version of set_many.
+
+        returns: a Future resolving to the set_many dict.
+        """
+
+        return self.submit(self._set_many, dict(values))
+
+    def set_many(self, values):
+        """
+        Sets several parameters with a single round trip: all the set
+        commands are written at once, then the replies are read.
+
+        arguments:
+        - values         a dict of values keyed by parameter name
+
+        returns: a dict keyed by name, with an "OK" string in case of
+        success or the ESP32Exception raised for that parameter.
+        """
+
+        return self._call(self._set_many, dict(values))
 
     def get_alarms(self):
         """
@@ -273,3 +1110,199 @@ class ESP32Serial:
         """
 
         return self.set("alarm_snooze", 29)
+
+    @property
+    def streaming(self):
+        """
+        True if the ESP32 is currently pushing get_all frames.
+        """
+
+        return self._streaming
+
+    def start_streaming(self, rate):
+        """
+        Asks the ESP32 to push the get_all frames continuously.
+
+        The ESP32 is requested to stream at the given rate, then the first
+        frame is awaited. If the firmware does not acknowledge the
+        request, or no frame shows up in time, streaming is turned off
+        again and the caller is expected to keep polling with get_all.
+
+        arguments:
+        - rate           the requested rate in Hz
+
+        returns: True if the ESP32 is streaming, False otherwise.
+        """
+
+        return self._call(self._start_streaming, rate)
+
+    def _start_streaming(self, rate):
+        """
+        See start_streaming, to be run on the I/O thread.
+        """
+
+        if self._reader is not None:
+            return self._streaming
+
+        self._frames.clear()
+        self._stream_period = 1. / rate
+        self._streaming = True
+        self._reader = Thread(target=self._reader_loop,
+                              name="ESP32Serial-reader", daemon=True)
+        self._reader.start()
+
+        try:
+            acknowledged = self._set("stream_rate", rate) == "OK"
+        except (ESP32Exception, _Preempted):
+            acknowledged = False
+
+        deadline = time.monotonic() + 3. / rate + self.max_timeout
+        while acknowledged and not self._frames:
+            if time.monotonic() > deadline:
+                break
+            time.sleep(1. / rate)
+
+        if self._frames:
+            return True
+
+        print("ESP32Serial-DEBUG: streaming not supported, polling")
+        self._stop_streaming()
+        return False
+
+    def stop_streaming(self):
+        """
+        Stops the ESP32 from pushing get_all frames and goes back to the
+        request/response protocol.
+        """
+
+        self._call(self._stop_streaming)
+
+    def _stop_streaming(self):
+        """
+        See stop_streaming, to be run on the I/O thread.
+        """
+
+        if self._reader is None:
+            return
+
+        try:
+            self._set("stream_rate", 0)
+        except ESP32Exception:
+            pass
+
+        self._stop_reader()
+
+    def use_binary_frames(self, enable):
+        """
+        Asks the ESP32 to send the get_all frames, replies and streamed
+        ones, in binary rather than in ASCII. Both encodings are always
+        understood, so a firmware ignoring the request does no harm.
+
+        arguments:
+        - enable         True for binary, False for ASCII
+
+        returns: True if the ESP32 acknowledged the request.
+        """
+
+        try:
+            return self.set("binary_frames", int(enable)) == "OK"
+        except ESP32Exception:
+            return False
+
+    def _set_get_all_fields(self, fields):
+        """
+        Sets the layout of the get all frames. Once connected, to be run
+        on the I/O thread.
+
+        arguments:
+        - fields         the get_all_fields, in order
+        """
+
+        self.get_all_fields = list(fields)
+        # the streamed values are decoded in place into the rows of this
+        # ring, the deque holds copies of them
+        self._frame_rows = np.zeros((self._frames.maxlen, len(self.get_all_fields)))
+        self._frame_index = 0
+        self.frame_decoder = FrameDecoder(self.get_all_fields)
+        self._stream_decoder = FrameDecoder(self.get_all_fields)
+        # the get all replies are decoded once more for the frame sink
+        self._sink_decoder = FrameDecoder(self.get_all_fields)
+        self._sink_row = np.zeros((1, len(self.get_all_fields)))
+        if self._lines is not None:
+            self._lines.records = {prefix: self.frame_decoder.line_length(prefix)
+                                   for prefix in (BINARY_REPLY, BINARY_STREAM)}
+
+    def detect_get_all_fields(self):
+        """
+        Checks that the firmware sends the alarm and warning words in the
+        get all frames, and leaves them out of the get_all_fields if it
+        sends one value less for each, as the firmwares not knowing about
+        them do. To be called before streaming or binary frames are
+        requested.
+
+        returns: the get_all_fields in use.
+        """
+
+        if not all(name in self.get_all_fields for name in BITFIELDS):
+            return self.get_all_fields
+
+        try:
+            reply = self.get("all")
+        except ESP32Exception as error:
+            print("ERROR: cannot check the get all fields: %s" % str(error))
+            return self.get_all_fields
+
+        n_values = len(reply.split(','))
+        if n_values == len(self.get_all_fields) - len(BITFIELDS):
+            print("ESP32Serial-DEBUG: no alarm and warning words in get all, "
+                  "they are polled")
+            self._call(self._set_get_all_fields,
+                       [name for name in self.get_all_fields if name not in BITFIELDS])
+        elif n_values != len(self.get_all_fields):
+            print("ERROR: get all has %d values, %d expected" %
+                  (n_values, len(self.get_all_fields)))
+        return self.get_all_fields
+
+    def frame_statistics(self):
+        """
+        Returns: a dict with the counters of the binary frames received
+        as replies and as stream.
+        """
+
+        return {"replies": self.frame_decoder.statistics(),
+                "stream": self._stream_decoder.statistics()}
+
+    def set_frame_sink(self, sink):
+        """
+        Registers a function called with the get all values as soon as
+        they are read: by the stream reader thread with the frames of
+        every read, without waiting for drain_frames, and by the I/O
+        thread with every reply to get all.
+
+        arguments:
+        - sink           a function taking the host monotonic time of
+                         arrival of each frame and a 2-D NumPy array with
+                         their rows, oldest first, or None
+        """
+
+        self._frame_sink = sink
+
+    def drain_frames(self):
+        """
+        Gets the frames streamed since the previous call.
+
+        returns: a list of (timestamp, device time, values) tuples, oldest
+        first, where timestamp is the host monotonic time of arrival,
+        device time the time of the frame on the ESP32 clock, from the
+        sequence counter of the binary frames, NaN for ASCII ones, and
+        values is a NumPy row with the get_all_fields, in order, which
+        belongs to the caller.
+        """
+
+        if self._reader is not None and not self._streaming:
+            raise ESP32Exception("get", "stream", "stream reader stopped")
+
+        frames = []
+        while self._frames:
+            frames.append(self._frames.popleft())
+        return frames
@@ -5,10 +5,14 @@ ESP32 chip isn't available.
 
 import random
 import time
+import numpy as np
 from PyQt5 import QtWidgets, uic
+from PyQt5.QtCore import pyqtSignal
 from PyQt5.QtGui import QTextCursor
 from communication.peep import PEEP
 from . import ESP32Alarm, ESP32Warning
+from .esp32serial import ESP32Exception, completed_future, LANE_CONTROL
+from .binaryframe import BITFIELDS
 
 
 class FakeMonitored(QtWidgets.QWidget):
@@ -61,13 +65,17 @@ class FakeESP32Serial(QtWidgets.QMainWindow):
     A widget class to emulate ESP32 functionality when not connected to hardware.
     """
     peep = PEEP()
+    # the messages logged, possibly from the alarm process listener
+    _logged = pyqtSignal(str)
 
     def __init__(self, config):
         super(FakeESP32Serial, self).__init__()
 
         uic.loadUi('communication/fakeesp32.ui', self)
         self.get_all_fields = config["get_all_fields"]
-        self.observables = {name: None for name in self.get_all_fields}
+        # the alarm and warning words are those raised with the buttons
+        self.observables = {name: None for name in self.get_all_fields
+                            if name not in BITFIELDS}
 
         self._arrange_fields()
         self.alarms_checkboxes = {}
@@ -98,6 +106,8 @@ class FakeESP32Serial(QtWidgets.QMainWindow):
 
         self.event_log = self.findChild(QtWidgets.QPlainTextEdit, "event_log")
         self.event_log.setReadOnly(True)
+        self._logged.connect(self._append_log)
+        self._frame_sink = None
         self.show()
 
     # pylint: disable=too-many-branches
@@ -228,15 +238,76 @@ class FakeESP32Serial(QtWidgets.QMainWindow):
 
     def log(self, message):
         """
-        Logs a given message.
+        Logs a given message, from any thread.
 
         arguments:
         -message: The message to be logged
         """
+        self._logged.emit(message)
+
+    def _append_log(self, message):
+        """
+        Appends a message to the event log, in the GUI thread.
+        """
         self.event_log.appendPlainText(message)
         cursor = self.event_log.textCursor()
         cursor.movePosition(QTextCursor.End)
 
+    def submit(self, function, *args, lane=LANE_CONTROL): # pylint: disable=W0613
+        """
+        Runs a call right away, as there is no I/O to wait for.
+
+        arguments:
+        - function       the callable to run
+        - args           the positional arguments to pass to it
+
+        named arguments:
+        - lane           ignored, there is nothing to wait behind
+
+        returns: a concurrent.futures.Future which is already done.
+        """
+
+        return completed_future(function, *args)
+
+    def close(self):
+        """
+        Nothing to close, there is no connection.
+        """
+
+    def lane_statistics(self):
+        """
+        Returns: an empty dict, calls never wait in a lane.
+        """
+
+        return {}
+
+    def set_async(self, name, value):
+        """
+        Non-blocking version of set.
+
+        returns: a Future resolving to an "OK" string.
+        """
+
+        return self.submit(self.set, name, value)
+
+    def get_async(self, name):
+        """
+        Non-blocking version of get.
+
+        returns: a Future resolving to the requested value.
+        """
+
+        return self.submit(self.get, name)
+
+    def get_all_async(self):
+        """
+        Non-blocking version of get_all.
+
+        returns: a Future resolving to the get_all dict.
+        """
+
+        return self.submit(self.get_all)
+
     def set(self, name, value):
         """
         Set command wrapper
@@ -310,6 +381,180 @@ class FakeESP32Serial(QtWidgets.QMainWindow):
 
         return dict(zip(self.get_all_fields, values))
 
+    @property
+    def streaming(self):
+        """
+        The fake ESP32 does not stream, so this is always False.
+        """
+
+        return False
+
+    def start_streaming(self, rate):
+        """
+        Streaming is not emulated: the caller falls back to get_all.
+
+        arguments:
+        - rate           the requested rate in Hz
+
+        returns: False
+        """
+
+        print("FakeESP32Serial-DEBUG: streaming at %s Hz refused" % rate)
+        return False
+
+    def stop_streaming(self):
+        """
+        Nothing to stop, streaming is never started.
+        """
+
+    def use_binary_frames(self, enable): # pylint: disable=W0613
+        """
+        The fake ESP32 always answers in ASCII.
+
+        returns: False
+        """
+
+        return False
+
+    def detect_get_all_fields(self):
+        """
+        Checks which get_all_fields the firmware sends.
+
+        returns: the get_all_fields, all of them being emulated.
+        """
+
+        return self.get_all_fields
+
+    def frame_statistics(self):
+        """
+        Returns: an empty dict, as no binary frame is ever sent.
+        """
+
+        return {}
+
+    @property
+    def link_state(self):
+        """
+        The fake link never fails.
+        """
+
+        return "ok"
+
+    def drain_link_events(self):
+        """
+        Gets the link state changes since the previous call.
+
+        returns: an empty list, as the fake link never fails.
+        """
+
+        return []
+
+    def set_frame_sink(self, sink):
+        """
+        Sets the function the get all values are passed to as soon as
+        they are generated.
+
+        arguments:
+        - sink           a function taking the host monotonic time of
+                         each row and a 2-D NumPy array with the rows,
+                         or None
+        """
+
+        self._frame_sink = sink
+
+    def drain_frames(self):
+        """
+        Gets the frames streamed since the previous call.
+
+        returns: an empty list, as streaming is not emulated.
+        """
+
+        return []
+
+    def transact(self, commands):
+        """
+        Executes several protocol commands.
+
+        arguments:
+        - commands       the list of commands, e.g. ["get all",
+                         "set watchdog_reset 1"]
+
+        returns: a list with, for each command, the value as a string or
+        the ESP32Exception describing its failure.
+        """
+
+        results = []
+        for command in commands:
+            words = command.split(' ')
+            if words[0] == 'get' and words[1] == 'all':
+                results.append(','.join(self.get_all().values()))
+                if self._frame_sink is not None:
+                    self._frame_sink(np.array([time.monotonic()]),
+                                     np.array([[float(value) for value in
+                                                results[-1].split(',')]]))
+            elif words[0] == 'get':
+                results.append(self.get(words[1]))
+            elif words[0] == 'set':
+                try:
+                    value = int(words[2])
+                except ValueError:
+                    value = float(words[2])
+                results.append(self.set(words[1], value))
+            else:
+                results.append(ESP32Exception(words[0], command, 'notok'))
+        return results
+
+    def transact_async(self, commands, lane=LANE_CONTROL):
+        """
+        Non-blocking version of transact.
+
+        returns: a Future resolving to the list of replies.
+        """
+
+        return self.submit(self.transact, commands, lane=lane)
+
+    def get_many(self, names):
+        """
+        Gets several parameters at once.
+
+        arguments:
+        - names          an iterable of parameter names
+
+        returns: a dict keyed by name with the requested values as strings.
+        """
+
+        return {name: self.get(name) for name in names}
+
+    def get_many_async(self, names):
+        """
+        Non-blocking version of get_many.
+
+        returns: a Future resolving to the get_many dict.
+        """
+
+        return self.submit(self.get_many, names)
+
+    def set_many(self, values):
+        """
+        Sets several parameters at once.
+
+        arguments:
+        - values         a dict of values keyed by parameter name
+
+        returns: a dict keyed by name with an "OK" string for each.
+        """
+
+        return {name: self.set(name, value) for name, value in values.items()}
+
+    def set_many_async(self, values):
+        """
+        Non-blocking version of set_many.
+
+        returns: a Future resolving to the set_many dict.
+        """
+
+        return self.submit(self.set_many, values)
+
     def get_alarms(self):
         """
         Get the alarms from the ESP32
@@ -0,0 +1,168 @@
+"""
+Buffered line framing for the serial connection with the ESP32.
+
+pySerial's read_until() reads one byte per call, which costs a Python
+round trip per byte. LineReader instead reads whatever the port has
+buffered in a single call, keeps it in a reusable bytearray and splits
+the complete lines out of it with bytearray.find().
+
+Lines starting with one of the registered record prefixes carry binary
+data, which may contain the terminator: they are framed by their fixed
+length instead.
+"""
+
+import time
+
+__all__ = ("LineReader",)
+
+
+class LineReader:
+    """
+    Splits the bytes coming from a serial port into lines.
+
+    Class members:
+    - connection: the serial.Serial object to read from
+    - terminator: the line terminator, binary encoded
+    - records: {bytes: int}, the length of the fixed length lines, prefix
+        and terminator included, keyed by their prefix
+    - tap: if not None, called with every chunk of bytes read
+    - _buffer: bytearray with the bytes read but not returned yet
+    - _scanned: number of bytes at the start of _buffer already known not
+        to contain a terminator
+    """
+
+    def __init__(self, connection, terminator=b'\n', records=None, tap=None):
+        """
+        Constructor
+
+        Arguments: see relevant class members.
+        """
+        self.connection = connection
+        self.terminator = terminator
+        self.records = dict(records or {})
+        self.tap = tap
+        self._buffer = bytearray()
+        self._scanned = 0
+
+    def pending(self):
+        """
+        Returns: the number of bytes received but not returned yet.
+        """
+        return len(self._buffer) + self.connection.in_waiting
+
+    def reset(self):
+        """
+        Discards the bytes read but not returned yet, e.g. a partial line.
+        """
+        del self._buffer[:]
+        self._scanned = 0
+
+    def _split(self):
+        """
+        Takes the first complete line out of the buffer.
+
+        returns: the line as bytes, terminator included, or None if there
+        is no complete line in the buffer.
+        """
+        for prefix, length in self.records.items():
+            if self._buffer.startswith(prefix):
+                if len(self._buffer) < length:
+                    return None
+                line = bytes(self._buffer[:length])
+                del self._buffer[:length]
+                self._scanned = 0
+                return line
+
+        index = self._buffer.find(self.terminator, self._scanned)
+        if index < 0:
+            # the terminator may straddle the end of the buffer
+            self._scanned = max(len(self._buffer) - len(self.terminator) + 1, 0)
+            return None
+
+        end = index + len(self.terminator)
+        line = bytes(self._buffer[:end])
+        del self._buffer[:end]
+        self._scanned = 0
+        return line
+
+    def _fill(self, timeout):
+        """
+        Appends to the buffer whatever the port has, waiting up to
+        timeout seconds for the first byte if it has nothing.
+
+        arguments:
+        - timeout: the time to wait, in seconds
+
+        returns: False on timeout, True otherwise.
+        """
+        connection = self.connection
+        waiting = connection.in_waiting
+        if not waiting:
+            # changing the timeout reconfigures the port, so do it only
+            # when it moved by more than a few milliseconds
+            timeout = round(timeout, 2)
+            if connection.timeout != timeout:
+                connection.timeout = timeout
+
+            data = connection.read(1)
+            if not data:
+                return False
+            waiting = connection.in_waiting
+            if waiting:
+                data += connection.read(waiting)
+        else:
+            data = connection.read(waiting)
+
+        self._buffer += data
+        if self.tap is not None:
+            self.tap(data)
+        return True
+
+    def readline(self, timeout):
+        """
+        Reads a line.
+
+        arguments:
+        - timeout: the time to wait for a complete line, in seconds
+
+        returns: the line as bytes, terminator included, or an empty bytes
+        object on timeout. A partial line is kept for the next call.
+        """
+        line = self._split()
+        if line is not None:
+            return line
+
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self._fill(remaining):
+                return b""
+
+            line = self._split()
+            if line is not None:
+                return line
+
+    def readlines(self, timeout):
+        """
+        Reads all the complete lines available, waiting for the first one
+        if needed.
+
+        arguments:
+        - timeout: the time to wait for the first line, in seconds
+
+        returns: a list of lines as bytes, terminator included, empty on
+        timeout.
+        """
+        line = self.readline(timeout)
+        if not line:
+            return []
+
+        lines = [line]
+        if self.connection.in_waiting:
+            self._fill(0)
+
+        line = self._split()
+        while line is not None:
+            lines.append(line)
+            line = self._split()
+        return lines
@@ -0,0 +1,372 @@
+"""
+Scheduler for the periodic traffic with the ESP32.
+
+Instead of having each part of the GUI poll the ESP32 with its own timer,
+the periodic requests are registered here. On every tick the requests
+which are due are coalesced into a single transaction per priority lane,
+sent through the ESP32 I/O thread, and the replies are handed back to each
+request on the GUI thread. Each lane has its own transaction in flight, so
+a slow telemetry read never delays the others.
+
+The watchdog reset must go on even while the GUI thread is held up, e.g.
+by a modal dialog, which stops the timer ticking the scheduler: it is
+sent by a Heartbeat, a thread of its own, instead.
+"""
+
+import time
+from threading import Event, Thread
+from .esp32serial import ESP32Exception, LANE_BULK, LANE_WATCHDOG
+
+__all__ = ("SerialScheduler", "PeriodicRequest", "Heartbeat")
+
+
+class PeriodicRequest:
+    # pylint: disable=too-many-instance-attributes
+    """
+    A request sent to the ESP32 at a fixed rate.
+
+    Class members:
+    - name: unique name of the request
+    - interval: time between two requests in seconds
+    - commands: list of protocol commands, e.g. ["get alarm"]. It can be
+        empty for requests which just need to be called back periodically
+    - callback: called with the list of replies, one per command, each
+        either a string or the ESP32Exception raised for that command
+    - lane: the ESP32Serial priority lane the commands are sent in
+    - enabled: if False the request is not sent
+    - deadline: monotonic time at which the request is due
+    - count: number of times the request has been sent
+    - late: number of times the request has been sent more than one tick
+        after its deadline
+    - skipped: number of periods skipped because the request was too late
+    - jitter_sum, jitter_max: delay between deadline and sending, in
+        seconds
+    - latency_max: maximum delay between deadline and reply, in seconds
+    """
+
+    def __init__(self, name, interval, commands, callback, lane=LANE_BULK):
+        """
+        Constructor
+
+        Arguments: see relevant class members.
+        """
+        self.name = name
+        self.interval = interval
+        self.commands = list(commands)
+        self.callback = callback
+        self.lane = lane
+        self.enabled = True
+        self.deadline = time.monotonic()
+
+        self.count = 0
+        self.late = 0
+        self.skipped = 0
+        self.jitter_sum = 0.
+        self.jitter_max = 0.
+        self.latency_max = 0.
+
+    def is_due(self, now):
+        """
+        Returns True if the request must be sent.
+
+        arguments:
+        - now: the current monotonic time
+        """
+        return self.enabled and now >= self.deadline
+
+    def mark_sent(self, now, tick):
+        """
+        Updates the statistics and moves the deadline one period ahead.
+
+        arguments:
+        - now: the current monotonic time
+        - tick: the scheduler tick in seconds
+
+        returns: the deadline the request was sent for
+        """
+        deadline = self.deadline
+        jitter = now - deadline
+
+        self.count += 1
+        self.jitter_sum += jitter
+        self.jitter_max = max(self.jitter_max, jitter)
+        if jitter > tick:
+            self.late += 1
+
+        self.deadline += self.interval
+        if self.deadline <= now:
+            # keep the phase, but don't try to catch up with the lost periods
+            missed = int((now - self.deadline) / self.interval) + 1
+            self.skipped += missed
+            self.deadline += missed * self.interval
+
+        return deadline
+
+    def mark_replied(self, now, deadline):
+        """
+        Updates the latency statistics.
+
+        arguments:
+        - now: the current monotonic time
+        - deadline: the deadline the request was sent for
+        """
+        self.latency_max = max(self.latency_max, now - deadline)
+
+    def statistics(self):
+        """
+        Returns: a dict with the timing statistics of this request.
+        """
+        return {"interval": self.interval,
+                "lane": self.lane,
+                "count": self.count,
+                "late": self.late,
+                "skipped": self.skipped,
+                "jitter_mean": self.jitter_sum / self.count if self.count else 0.,
+                "jitter_max": self.jitter_max,
+                "latency_max": self.latency_max}
+
+
+class SerialScheduler:
+    """
+    Plans the periodic requests to the ESP32.
+
+    Class members:
+    - _esp32: ESP32Serial object for communication
+    - _tick: the interval, in seconds, at which tick() is called
+    - _requests: {str: PeriodicRequest}, keyed by request name
+    - _pending: {int: (Future, batch)}, keyed by lane, the transactions
+        in flight; batch is a list of (request, deadline, first reply,
+        number of replies)
+    - _heartbeats: {str: Heartbeat}, keyed by request name, the requests
+        sent by threads of their own
+    """
+
+    def __init__(self, esp32, tick):
+        """
+        Constructor
+
+        Arguments: see relevant class members.
+        """
+        self._esp32 = esp32
+        self._tick = tick
+        self._requests = {}
+        self._pending = {}
+        self._heartbeats = {}
+
+    def register(self, name, interval, commands, callback, lane=LANE_BULK):
+        """
+        Registers a periodic request, replacing any request with the same
+        name. The request is due right away.
+
+        arguments:
+        - name: unique name of the request
+        - interval: time between two requests in seconds
+        - commands: list of protocol commands, possibly empty
+        - callback: called with the list of replies
+        - lane: the ESP32Serial priority lane, default LANE_BULK
+
+        returns: the PeriodicRequest
+        """
+        request = PeriodicRequest(name, interval, commands, callback, lane)
+        self._requests[name] = request
+        return request
+
+    def register_heartbeat(self, name, interval, commands, callback, lane=LANE_WATCHDOG):
+        # pylint: disable=too-many-arguments
+        """
+        Registers a periodic request sent by a Heartbeat rather than by
+        tick, so that it is sent on time whatever the GUI thread does.
+        The callback is called from the Heartbeat thread.
+
+        arguments: see register, but lane defaults to LANE_WATCHDOG
+
+        returns: the PeriodicRequest
+        """
+        request = PeriodicRequest(name, interval, commands, callback, lane)
+        self._heartbeats[name] = Heartbeat(self._esp32, request, self._tick)
+        return request
+
+    def stop(self):
+        """
+        Stops the Heartbeat threads.
+        """
+        for heartbeat in self._heartbeats.values():
+            heartbeat.stop()
+
+    def unregister(self, name):
+        """
+        Removes a periodic request. Replies still in flight are dropped.
+
+        arguments:
+        - name: the name of the request
+        """
+        self._requests.pop(name, None)
+
+    def set_enabled(self, name, enabled):
+        """
+        Suspends or resumes a periodic request. A resumed request is due
+        right away.
+
+        arguments:
+        - name: the name of the request
+        - enabled: True to resume, False to suspend
+        """
+        request = self._requests[name]
+        if enabled and not request.enabled:
+            request.deadline = time.monotonic()
+        request.enabled = enabled
+
+    def set_commands(self, name, commands):
+        """
+        Changes the commands sent by a periodic request.
+
+        arguments:
+        - name: the name of the request
+        - commands: list of protocol commands, possibly empty
+        """
+        self._requests[name].commands = list(commands)
+
+    def tick(self):
+        """
+        Called every tick seconds: hands the replies of the completed
+        transactions to their requests, then sends the due requests as a
+        single transaction per lane.
+        """
+        for lane in sorted(self._pending):
+            if self._pending[lane][0].done():
+                self._dispatch(lane)
+
+        now = time.monotonic()
+        commands = {}
+        batches = {}
+        callbacks = []
+        for request in list(self._requests.values()):
+            if request.lane in self._pending or not request.is_due(now):
+                # the lane is still busy, the request will be late
+                continue
+
+            deadline = request.mark_sent(now, self._tick)
+            if request.commands:
+                lane_commands = commands.setdefault(request.lane, [])
+                batches.setdefault(request.lane, []).append(
+                    (request, deadline, len(lane_commands), len(request.commands)))
+                lane_commands.extend(request.commands)
+            else:
+                callbacks.append(request)
+
+        for lane in sorted(commands):
+            self._pending[lane] = (
+                self._esp32.transact_async(commands[lane], lane=lane),
+                batches[lane])
+
+        for request in callbacks:
+            self._call(request, [])
+
+    def _dispatch(self, lane):
+        """
+        Hands the replies of a completed transaction to their requests.
+
+        arguments:
+        - lane: the lane of the transaction
+        """
+        pending, batch = self._pending.pop(lane)
+
+        try:
+            replies = pending.result()
+        except Exception as error: # pylint: disable=W0703
+            # whatever went wrong, it is a failure of these requests only
+            if not isinstance(error, ESP32Exception):
+                error = ESP32Exception("transact", "; ".join(
+                    "; ".join(request.commands) for request, _, _, _ in batch), str(error))
+            replies = [error] * sum(count for _, _, _, count in batch)
+
+        now = time.monotonic()
+        for request, deadline, first, count in batch:
+            if self._requests.get(request.name) is not request:
+                # unregistered in the meantime
+                continue
+            request.mark_replied(now, deadline)
+            self._call(request, replies[first:first + count])
+
+    @staticmethod
+    def _call(request, replies):
+        """
+        Hands the replies to a request, so that a failing callback does
+        not keep the other requests from being handled and sent.
+
+        arguments:
+        - request: the PeriodicRequest
+        - replies: the list of its replies
+        """
+        try:
+            request.callback(replies)
+        except Exception as error: # pylint: disable=W0703
+            print("ERROR: %s callback failing: %s" % (request.name, str(error)))
+
+    def statistics(self):
+        """
+        Returns: a dict, keyed by request name, with the timing statistics
+        of each request.
+        """
+        stats = {name: request.statistics()
+                 for name, request in self._requests.items()}
+        stats.update({name: heartbeat.request.statistics()
+                      for name, heartbeat in self._heartbeats.items()})
+        return stats
+
+
+class Heartbeat:
+    """
+    Sends a periodic request from a thread of its own, waiting for each
+    reply before sending the next.
+
+    Class members:
+    - request: the PeriodicRequest
+    - _esp32: ESP32Serial object for communication
+    - _tick: the delay, in seconds, after which the request is late
+    - _stopped: Event set to stop the thread
+    - _thread: the Thread sending the request
+    """
+
+    def __init__(self, esp32, request, tick):
+        """
+        Constructor: starts the thread.
+
+        Arguments: see relevant class members.
+        """
+        self.request = request
+        self._esp32 = esp32
+        self._tick = tick
+        self._stopped = Event()
+        self._thread = Thread(target=self._run, name="Heartbeat-" + request.name,
+                              daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        """
+        Body of the thread.
+        """
+        request = self.request
+        while not self._stopped.wait(max(request.deadline - time.monotonic(), 0.)):
+            if not request.enabled:
+                request.deadline = time.monotonic() + request.interval
+                continue
+
+            deadline = request.mark_sent(time.monotonic(), self._tick)
+            try:
+                replies = self._esp32.transact_async(request.commands,
+                                                     lane=request.lane).result()
+            except Exception as error: # pylint: disable=W0703
+                if not isinstance(error, ESP32Exception):
+                    error = ESP32Exception("transact", "; ".join(request.commands),
+                                           str(error))
+                replies = [error] * len(request.commands)
+            request.mark_replied(time.monotonic(), deadline)
+            SerialScheduler._call(request, replies) # pylint: disable=W0212
+
+    def stop(self):
+        """
+        Stops the thread, once the request in flight, if any, is over.
+        """
+        self._stopped.set()
+        self._thread.join()
@@ -0,0 +1,243 @@
+"""
+Recording and replay of the serial traffic with the ESP32.
+
+The log is a binary file: a header made of MAGIC and the wall clock and
+monotonic times at which the recording started (two little-endian
+doubles), then one record per chunk of traffic:
+
+    float64     host monotonic time
+    uint8       OUTGOING or INCOMING
+    uint32      length of the data
+    bytes       the data, as written to or read from the port
+
+The incoming data is recorded as read, partial lines included, so that
+the replay reproduces the framing the GUI saw.
+"""
+
+import os
+import select
+import struct
+import time
+from threading import Lock, Thread
+
+__all__ = ("OUTGOING", "INCOMING", "TrafficRecorder", "read_traffic",
+           "TrafficReplayer")
+
+MAGIC = b"MVMTRAF1"
+OUTGOING = 0
+INCOMING = 1
+
+_HEADER = struct.Struct("<dd")
+_RECORD = struct.Struct("<dBI")
+
+
+class TrafficRecorder:
+    """
+    Appends the traffic to a log file.
+
+    Class members:
+    - path: the path of the log file
+    - records: number of records written
+    """
+
+    def __init__(self, path):
+        """
+        Constructor: creates the log file, overwriting any previous one.
+
+        Arguments: see relevant class members.
+        """
+        self.path = path
+        self.records = 0
+        self._lock = Lock()
+        self._file = open(path, "wb")
+        self._file.write(MAGIC + _HEADER.pack(time.time(), time.monotonic()))
+
+    def record(self, direction, data):
+        """
+        Appends a record, timestamped now.
+
+        arguments:
+        - direction: OUTGOING or INCOMING
+        - data: the bytes written or read
+        """
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(_RECORD.pack(time.monotonic(), direction, len(data)))
+            self._file.write(data)
+            self.records += 1
+
+    def close(self):
+        """
+        Flushes and closes the log file.
+        """
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def read_traffic(path):
+    """
+    Reads a traffic log.
+
+    arguments:
+    - path: the path of the log file
+
+    returns: a generator of (monotonic time, direction, data) tuples.
+    """
+    with open(path, "rb") as log:
+        if log.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is not a traffic log" % path)
+        log.read(_HEADER.size)
+
+        while True:
+            head = log.read(_RECORD.size)
+            if len(head) < _RECORD.size:
+                # the end, possibly truncated by a crash
+                return
+            timestamp, direction, length = _RECORD.unpack(head)
+            data = log.read(length)
+            if len(data) < length:
+                return
+            yield timestamp, direction, data
+
+
+class TrafficReplayer:
+    """
+    Plays the ESP32 side of a traffic log on a pseudo-terminal, so that
+    ESP32Serial, and the whole GUI, can be fed with it.
+
+    With a positive speed the incoming data is sent at the recorded pace,
+    scaled by speed, whatever the GUI sends. With speed 0 the replay goes
+    as fast as possible: as soon as the GUI has written as many bytes as
+    the next outgoing record, the incoming data recorded up to the
+    following outgoing record is sent back at once.
+
+    Class members:
+    - records: the list of (monotonic time, direction, data) tuples
+    - speed: the replay speed, 1 for real time, 0 for as fast as possible
+    - done: True once the whole log has been played
+    """
+
+    def __init__(self, path, speed=1.):
+        """
+        Constructor
+
+        Arguments: see relevant class members.
+        - path: the path of the log file
+        """
+        self.records = list(read_traffic(path))
+        self.speed = speed
+        self.done = False
+        self._master = None
+        self._slave = None
+        self._thread = None
+        self._running = False
+
+    def start(self):
+        """
+        Opens the pseudo-terminal and replays the log from a background
+        thread.
+
+        returns: the path of the serial port to connect to.
+        """
+        # pylint: disable=C0415
+        # not available on Windows, where the recorder is still usable
+        import pty
+        import tty
+
+        self._master, self._slave = pty.openpty()
+        tty.setraw(self._slave)
+        self._running = True
+        self._thread = Thread(target=self._replay, name="TrafficReplayer",
+                              daemon=True)
+        self._thread.start()
+        return os.ttyname(self._slave)
+
+    def stop(self):
+        """
+        Stops the replay and closes the pseudo-terminal.
+        """
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        for descriptor in (self._master, self._slave):
+            if descriptor is not None:
+                os.close(descriptor)
+        self._master = self._slave = None
+
+    def _send(self, data):
+        """
+        Writes data to the GUI side.
+        """
+        view = memoryview(data)
+        while view:
+            view = view[os.write(self._master, view):]
+
+    def _wait_input(self, timeout):
+        """
+        Waits up to timeout seconds for the GUI to write, and discards
+        what it wrote.
+
+        returns: the number of bytes the GUI wrote.
+        """
+        readable, _, _ = select.select([self._master], [], [], timeout)
+        if readable:
+            return len(os.read(self._master, 4096))
+        return 0
+
+    def _replay(self):
+        """
+        Body of the replay thread.
+        """
+        try:
+            if self.speed > 0:
+                self._replay_timed()
+            else:
+                self._replay_reactive()
+        finally:
+            self.done = True
+
+    def _replay_timed(self):
+        """
+        Sends the incoming data at the recorded pace.
+        """
+        if not self.records:
+            return
+        origin = self.records[0][0]
+        start = time.monotonic()
+        for timestamp, direction, data in self.records:
+            if direction != INCOMING:
+                continue
+            due = start + (timestamp - origin) / self.speed
+            remaining = due - time.monotonic()
+            while self._running and remaining > 0:
+                self._wait_input(min(remaining, 0.05))
+                remaining = due - time.monotonic()
+            if not self._running:
+                return
+            self._send(data)
+
+    def _replay_reactive(self):
+        """
+        Sends the incoming data as soon as the GUI asks for it.
+        """
+        # the GUI writes are matched to the outgoing records by length,
+        # since the pty may split or merge them
+        received = 0
+        index = 0
+        while self._running and index < len(self.records):
+            # the incoming data before the first command, if any, is
+            # sent right away
+            if self.records[index][1] == OUTGOING:
+                length = len(self.records[index][2])
+                while self._running and received < length:
+                    received += self._wait_input(0.05)
+                received -= length
+                index += 1
+
+            while index < len(self.records) and self.records[index][1] == INCOMING:
+                self._send(self.records[index][2])
+                index += 1
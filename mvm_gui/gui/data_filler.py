@@ -3,11 +3,231 @@ Module containing the DataFiller class,
 which is responsible for filling data
 to plots and monitors
 '''
-from copy import copy
+import time
 from ast import literal_eval  # to convert a string to list
 import numpy as np
 from PyQt5 import QtGui, QtCore
 import pyqtgraph as pg
+from ringbuffer import RingBuffer
+from slidingminmax import SlidingMinMax
+from trendstore import TrendStore, DEFAULT_LEVELS
+from decimation import Decimator
+
+
+class PlotState():
+    '''
+    What a plot needs to be redrawn, created once when the plot is
+    connected, so that a redraw allocates nothing but what pyqtgraph
+    itself does.
+
+    Attributes:
+        item    (PlotDataItem) The curve of the plot
+        pen     (QPen) The pen of the curve, set once
+        xdata   (array) The displayed times, copied in on every redraw
+        ydata   (array) The displayed values, copied in on every redraw
+    '''
+
+    def __init__(self, item, pen, n_samples):
+        '''
+        Constructor
+
+        arguments:
+        - item: the PlotDataItem of the plot
+        - pen: the pen to draw it with
+        - n_samples: the number of samples displayed
+        '''
+        self.item = item
+        self.pen = pen
+        self.xdata = np.zeros(n_samples)
+        self.ydata = np.zeros(n_samples)
+        self.item.setPen(pen)
+
+    def update(self, xdata, data):
+        '''
+        Redraws the curve.
+
+        arguments:
+        - xdata: the values along x, copied as they keep changing
+        - data: the values to display, copied as they keep changing
+        '''
+        np.copyto(self.xdata, xdata)
+        np.copyto(self.ydata, data)
+        self.item.setData(self.xdata, self.ydata)
+
+
+class SweepState():
+    '''
+    What a looping plot needs to be redrawn as a sweep: the trace is
+    split into chunks of samples, each one a curve of its own, and
+    only the chunks with new samples are sent again to pyqtgraph, so
+    that only their region is repainted. Consecutive chunks share
+    their boundary sample, so that the trace has no holes.
+
+    Attributes:
+        items   (list) The PlotDataItems of the chunks
+        bounds  (list) The (start, stop) sample range of each chunk
+        chunk   (int) The number of samples per chunk
+        pen     (QPen) The pen of the curves, set once
+        xdata   (array) The displayed times, in place
+        ydata   (array) The displayed values, in place
+        drawn   (int) The number of samples added when last drawn
+    '''
+
+    def __init__(self, plot, pen, n_samples, chunks):
+        '''
+        Constructor
+
+        arguments:
+        - plot: the PlotItem to add the curves to
+        - pen: the pen to draw them with
+        - n_samples: the number of samples displayed
+        - chunks: the number of chunks to split the trace into
+        '''
+        self.chunk = max(1, -(-n_samples // max(1, chunks)))
+        self.bounds = [(start, min(start + self.chunk + 1, n_samples))
+                       for start in range(0, n_samples, self.chunk)]
+        self.items = [plot.plot() for _ in self.bounds]
+        self.pen = pen
+        self.xdata = np.zeros(n_samples)
+        self.ydata = np.zeros(n_samples)
+        self.drawn = 0
+        for item in self.items:
+            item.setPen(pen)
+
+    def update(self, xdata, data, added=None):
+        '''
+        Redraws the whole trace.
+
+        arguments:
+        - xdata: the values along x, in place
+        - data: the values to display, in place
+        - added: the number of samples added so far, if known
+        '''
+        np.copyto(self.xdata, xdata)
+        np.copyto(self.ydata, data)
+        for item, (start, stop) in zip(self.items, self.bounds):
+            item.setData(self.xdata[start:stop], self.ydata[start:stop])
+        if added is not None:
+            self.drawn = added
+
+    def sweep(self, xdata, data, index, added):
+        '''
+        Redraws the chunks with samples added since the last time.
+
+        arguments:
+        - xdata: the values along x, in place
+        - data: the values to display, in place
+        - index: where the next sample goes
+        - added: the number of samples added so far
+        '''
+        count = added - self.drawn
+        size = len(self.ydata)
+        if count >= size:
+            self.update(xdata, data, added)
+            return
+
+        dirty = set()
+        for position in range(index - count, index):
+            position %= size
+            self.xdata[position] = xdata[position]
+            self.ydata[position] = data[position]
+            dirty.add(position // self.chunk)
+            if position and position % self.chunk == 0:
+                # also the last sample of the previous chunk
+                dirty.add(position // self.chunk - 1)
+
+        for chunk in dirty:
+            start, stop = self.bounds[chunk]
+            self.items[chunk].setData(self.xdata[start:stop], self.ydata[start:stop])
+        self.drawn = added
+
+
+class DecimatedState():
+    '''
+    What a plot with more samples than pixel columns needs to be
+    redrawn: the samples are decimated as they come, and only a few
+    points per column are sent to pyqtgraph, whatever the window length.
+
+    Looping plots are also split into chunks of x, each one a curve of
+    its own, and only the chunks around the sweep, where the points
+    change, are sent again, as with a SweepState.
+
+    Attributes:
+        items       (list) The PlotDataItems of the chunks
+        chunk       (int) The number of samples per chunk
+        pen         (QPen) The pen of the curves, set once
+        decimator   (Decimator) The decimated samples
+        looping     (bool) True if the samples are displayed in place
+    '''
+
+    def __init__(self, plot, pen, n_samples, columns, method, looping, chunks=1):
+        '''
+        Constructor
+
+        arguments:
+        - plot: the PlotItem to add the curves to
+        - pen: the pen to draw them with
+        - n_samples: the number of samples displayed
+        - columns: the number of pixel columns of the plot
+        - method: the decimation, 'minmax' or 'lttb'
+        - looping: True if the samples are displayed in place
+        - chunks: the number of chunks to split a looping plot into
+        '''
+        chunks = max(1, chunks) if looping else 1
+        self.chunk = max(1, -(-n_samples // chunks))
+        self.items = [plot.plot() for _ in range(0, n_samples, self.chunk)]
+        self.pen = pen
+        self.decimator = Decimator(n_samples, columns, method)
+        self.looping = looping
+        for item in self.items:
+            item.setPen(pen)
+
+    def update(self, xdata, data, added, full=False):
+        '''
+        Decimates the new samples and redraws the curves which changed.
+
+        arguments:
+        - xdata: the values along x, oldest first, or in place if looping
+        - data: the samples, oldest first
+        - added: the number of samples added so far
+        - full: True to decimate and redraw all the samples again
+        '''
+        if full:
+            self.decimator.reset()
+        drawn = self.decimator.drawn
+        self.decimator.update(data, added)
+        numbers, values = self.decimator.points(added, len(data))
+
+        size = len(xdata)
+        if not self.looping:
+            self.items[0].setData(xdata[numbers - (added - size)], values)
+            return
+
+        # in place, from the start of the plot
+        positions = numbers % size
+        wrap = np.flatnonzero(np.diff(positions) < 0)
+        if len(wrap):
+            split = wrap[0] + 1
+            positions = np.concatenate((positions[split:], positions[:split]))
+            values = np.concatenate((values[split:], values[:split]))
+
+        # the points which may have changed are those of the buckets
+        # around the new samples, the oldest one being next to them; a
+        # chunk also ends with the first point of the next one, a bucket
+        # further
+        bucket = self.decimator.bucket
+        first = max(drawn, added - size) - 2 * bucket
+        count = added + bucket - first
+        if count >= size:
+            dirty = range(len(self.items))
+        else:
+            dirty = {(first + offset) % size // self.chunk
+                     for offset in list(range(0, count, self.chunk)) + [count - 1]}
+
+        bounds = np.searchsorted(positions, np.arange(len(self.items) + 1) * self.chunk)
+        for chunk in dirty:
+            start, stop = bounds[chunk], bounds[chunk + 1] + 1
+            self.items[chunk].setData(xdata[positions[start:stop]], values[start:stop])
 
 
 class DataFiller():
@@ -22,26 +242,48 @@ class DataFiller():
     but don't update the displayed graph. When we unfreeze, we
     then see the full recent data.
 
+    Adding data points only stores them and marks the plots and
+    monitors as dirty: they are redrawn by a render clock, at most
+    once per frame, whatever the data rate. Those which are hidden,
+    e.g. behind the settings, stay dirty and are redrawn only once
+    shown again.
+
     Attributes:
         _qtgraphs           (dict) All PlotItems
-        _plots              (dict) All PlotDataItems
-        _data               (dict) The data for all plots
-        _historic_data      (dict) The historic data for all plots
+        _plots              (dict) The PlotState, SweepState if looping, or
+                            DecimatedState if decimated, of all plots
+        _added              (int) The number of samples added so far
+        _fields             (list) The observables, in get_all_fields order
+        _columns            (dict) The row of each observable in the data tables
+        _data               (RingBuffer) The data for all observables
+        _times              (RingBuffer) The host monotonic time of the samples
+        _xloop              (RingBuffer) The x of the samples of the looping plots,
+                            their time since the start of their sweep
+        _xscroll            (array) The x of the samples of the scrolling plots,
+                            their time before the last one, updated in place
+        _sweep_start        (float) The time of the first sample of the sweep
+        trends              (TrendStore) The long term history of all observables,
+                            on the time.monotonic() clock
+        _extrema            (dict) The SlidingMinMax of the historic data per plot
         _default_yrange     (dict) The default y ranges per plot
         _yrange             (dict) The current y ranges per plot
+        _yrange_time        (dict) When the y range of each plot was last set
         _monitors           (dict) The monitors to which to send data
-        _colors             (dict) The plot color
         _config             (dict) The config dict
         _n_samples          (int) The number of samples to plot
         _n_historic_samples (int) The number of samples to keep for historic data
+        _autoscale_hysteresis (float) How much wider than the data the y range
+                            may get before it is shrunk, as a fraction
+        _autoscale_interval (float) The minimum time between two shrinks of a y range
         _sampling           (float) The time interval between samples
         _time_window        (float) The number of seconds shown
-        _xdata              (array) The data along x
         _frozen             (bool) True we are in forzen state
         _first_plot         (PlotDataItem) Reference to the first drwan plot
         _looping            (bool) True displays looping plots
-        _looping_data_idx   (int) The x index of the looping line
         _looping_lines      (dict) A dict of InfiniteLines
+        _dirty              (set) The plots with new data to show
+        _dirty_monitors     (set) The monitors with new data to show
+        _render_timer       (QTimer) The render clock, None to render on every data point
     '''
 
     def __init__(self, config):
@@ -53,26 +295,75 @@ class DataFiller():
         '''
         self._qtgraphs = {}
         self._plots = {}
-        self._data = {}
-        self._historic_data = {}
         self._default_yrange = {}
         self._yrange = {}
+        self._yrange_time = {}
+        self._extrema = {}
         self._monitors = {}
-        self._colors = {}
         self._config = config
         self._n_samples = self._config['nsamples']
         self._n_historic_samples = self._config.get('historic_nsamples',
                                                     200)
+        self._autoscale_hysteresis = self._config.get('autoscale_hysteresis', 0.5)
+        self._autoscale_interval = self._config.get('autoscale_interval', 1.)
         self._sampling = self._config['sampling_interval']
         self._time_window = self._n_samples * self._sampling  # seconds
-        self._xdata = np.linspace(-self._time_window, 0, self._n_samples)
+        self._fields = list(self._config['get_all_fields'])
+        self._columns = {name: i for i, name in enumerate(self._fields)}
+        self._data = RingBuffer(self._n_samples, len(self._fields))
+
+        self._times = RingBuffer(self._n_samples)
+        self._xloop = RingBuffer(self._n_samples)
+        self._xscroll = np.zeros(self._n_samples)
+        self._sweep_start = None
+        self._space_evenly()
+        self.trends = TrendStore(self._fields,
+                                 self._config.get('trend_levels', DEFAULT_LEVELS))
         self._frozen = False
         self._first_plot = None
         self._looping = self._config['use_looping_plots']
-        self._looping_data_idx = {}
+        self._added = 0
         self._looping_lines = {}
         self._x_label = None
 
+        self._dirty = set()
+        self._dirty_monitors = set()
+        self._render_timer = None
+        fps = self._config.get('render_fps', 30)
+        if fps > 0:
+            self._render_timer = QtCore.QTimer()
+            self._render_timer.timeout.connect(self.render)
+            self._render_timer.start(int(1000 / fps))
+
+    def set_sampling_interval(self, sampling):
+        '''
+        Changes the time interval between samples, e.g. when the ESP
+        streams data at a rate different from sampling_interval.
+
+        arguments:
+        - sampling: (float) the time interval between samples in seconds
+        '''
+        self._sampling = sampling
+        self._time_window = self._n_samples * self._sampling
+        if not self._added:
+            self._space_evenly()
+
+        for name in self._qtgraphs:
+            self.set_default_x_range(name)
+        for name in self._plots:
+            self.draw_plot(name, full=True)
+
+    def _space_evenly(self):
+        '''
+        Gives the samples kept evenly spaced times up to now, every
+        sampling interval, as they have until the data come.
+        '''
+        now = time.monotonic()
+        xdata = np.linspace(-self._time_window, 0, self._n_samples)
+        self._times.extend(now + xdata)
+        self._xloop.extend(xdata)
+        self._sweep_start = now
+
     def connect_plot(self, plotname, plot):
         '''
         Connects a plot to this class by
@@ -84,6 +375,9 @@ class DataFiller():
         '''
         plot_config = self._config['plots'][plotname]
         name = plot_config['observable']
+        if name not in self._columns:
+            raise Exception('Cannot connect plot', plotname,
+                            'to', name, 'which is not in get_all_fields.')
 
         # Link X axes if we've already seen a plot
         if self._first_plot:
@@ -92,13 +386,28 @@ class DataFiller():
             self._first_plot = plot
 
         self._qtgraphs[name] = plot
-        self._plots[name] = plot.plot()
-        self._data[name] = np.linspace(0, 0, self._n_samples)
-        self._historic_data[name] = np.linspace(0, 0, self._n_historic_samples)
         self._yrange[name] = None
-        self._plots[name].setData(copy(self._xdata), copy(self._data[name]))
-        self._colors[name] = plot_config['color']
-        self._looping_data_idx[name] = 0
+        self._extrema[name] = SlidingMinMax(self._n_historic_samples)
+        color = self.parse_color(plot_config['color'])
+        pen = pg.mkPen(color, width=self._config['line_width'])
+
+        # Decimate only when it sends fewer points than the samples,
+        # min/max keeping two per pixel column
+        method = plot_config.get('decimation',
+                                 self._config.get('decimation', 'minmax'))
+        columns = self._config.get('decimation_columns', 600)
+        per_column = 2 if method == 'minmax' else 1
+        if method != 'none' and self._n_samples > per_column * columns:
+            self._plots[name] = DecimatedState(
+                plot, pen, self._n_samples, columns, method, self._looping,
+                self._config.get('looping_chunks', 10))
+        elif self._looping:
+            self._plots[name] = SweepState(
+                plot, pen, self._n_samples,
+                self._config.get('looping_chunks', 10))
+        else:
+            self._plots[name] = PlotState(plot.plot(), pen, self._n_samples)
+        self.draw_plot(name, full=True)
 
         # Set the Y axis
         y_axis_label = plot_config['name']
@@ -172,26 +481,42 @@ class DataFiller():
         Set the Y axis range of the plot to the max and min
         from the historic data set.
 
+        The range is changed at once if the data leave it, but it
+        is shrunk only if it got much wider than the data, and not
+        more often than every autoscale_interval, so that the axes
+        are not laid out again on every frame.
+
         arguments:
         - name: the plot name to set the y range
         '''
-        if name not in self._historic_data or name not in self._qtgraphs:
+        if name not in self._qtgraphs:
             raise Exception('Cannot set y range for graph',
                             name, 'as it doesn\'t exist.')
 
-        # Calculate the max and min using the larger historical data sample
-        ymax = np.max(self._historic_data[name])
-        ymin = np.min(self._historic_data[name])
+        # The max and min of the larger historical data sample
+        # are kept up to date as the data come
+        data_min = self._extrema[name].minimum
+        data_max = self._extrema[name].maximum
 
-        if ymax == ymin:
+        if data_min is None or data_max == data_min:
             return
-        span = ymax - ymin
+        span = data_max - data_min
+
+        ymax = data_max + span * 0.1
+        ymin = data_min - span * 0.1
 
-        ymax += span * 0.1
-        ymin -= span * 0.1
+        now = time.monotonic()
+        if self._yrange[name] is not None:
+            shown_min, shown_max = self._yrange[name]
+            fits = shown_min <= data_min and data_max <= shown_max
+            too_wide = shown_max - shown_min > (ymax - ymin) * (1 + self._autoscale_hysteresis)
+            recent = now - self._yrange_time.get(name, 0) < self._autoscale_interval
+            if fits and (not too_wide or recent):
+                return
 
         # Save the range for future use
         self._yrange[name] = (ymin, ymax)
+        self._yrange_time[name] = now
 
         # Set the range to the graph
         self._qtgraphs[name].setYRange(*self._yrange[name])
@@ -314,56 +639,113 @@ class DataFiller():
         - monitor: the monitor to connect
         '''
         name = monitor.observable
-        self._monitors[name] = monitor
-
-        self._data[name] = np.linspace(0, 0, self._n_samples)
-
-        self._looping_data_idx[name] = 0
+        if name not in self._columns:
+            raise Exception('Cannot connect monitor', monitor.configname,
+                            'to', name, 'which is not in get_all_fields.')
 
-        if name not in self._data:
-            self._data[name] = np.linspace(0, 0, self._n_samples)
+        self._monitors[name] = monitor
 
         print('NORMAL: Connected monitor',
               monitor.configname, 'with variable', name)
 
-    def add_data_point(self, name, data_point):
+    def add_data_points(self, rows, times=None):
         '''
-        Adds a data point to the plot with
-        name 'name'
+        Adds data points for all the observables at once
 
         arguments:
-        - name: the name of the plots (and monitor if available)
-        - data_point: (float) the data point to add
-        '''
-
-        # print('NORMAL: Received data for monitor', name)
-
-        if name in self._historic_data:
-            # Save to the historic data dict
-            self._historic_data[name][:-1] = self._historic_data[name][1:]
-            self._historic_data[name][-1] = data_point
-
-        if name in self._data:
-            if self._looping:
-                # Looping plots - update next value
-                self._data[name][self._looping_data_idx[name]] = data_point
-
-                self._looping_data_idx[name] += 1
+        - rows: NumPy array with one row, or a block of rows, of values
+          of the get_all_fields, in order, oldest first
+        - times: the host monotonic time of each row, not decreasing, or
+          a single one for all, default now
+        '''
+
+        rows = np.asarray(rows, dtype=float).reshape(-1, len(self._fields))
+        if times is None:
+            times = time.monotonic()
+        times = np.broadcast_to(np.asarray(times, dtype=float), (len(rows),))
+
+        # A sweep starts with the sample going to the start of the
+        # looping plots, the following ones are placed by their time
+        # since then
+        positions = (self._data.index + np.arange(len(rows))) % self._n_samples
+        starts = np.where(positions == 0, np.arange(len(rows)), -1)
+        np.maximum.accumulate(starts, out=starts)
+        origins = np.where(starts >= 0, times[starts], self._sweep_start)
+        self._sweep_start = origins[-1]
+        self._xloop.extend(times - origins - self._time_window)
+
+        # The ring buffers serve both the looping plots, updated
+        # in place, and the scrolling ones, with no shifting
+        self._data.extend(rows)
+        self._times.extend(times)
+        self._added += len(rows)
+        self.trends.add(times, rows)
+
+        for name, extrema in self._extrema.items():
+            extrema.extend(rows[:, self._columns[name]].tolist())
+
+        self._dirty.update(self._plots)
+        self._dirty_monitors.update(self._monitors)
+        if self._render_timer is None:
+            self.render()
+
+    def render(self):
+        '''
+        Redraws the visible plots and monitors which got new data
+        since they were last drawn. Called by the render clock, and
+        to catch up at once when plots or monitors are shown again.
+        '''
+        dirty, self._dirty = self._dirty, set()
+        for name in dirty:
+            if self._qtgraphs[name].isVisible():
+                self.update_plot(name)
+            else:
+                self._dirty.add(name)
 
-                if self._looping_data_idx[name] == self._n_samples:
-                    self._looping_data_idx[name] = 0
+        dirty, self._dirty_monitors = self._dirty_monitors, set()
+        for name in dirty:
+            if self._monitors[name].isVisible():
+                self.update_monitor(name)
             else:
-                # Scrolling plots - shift data 1 sample left
-                self._data[name][:-1] = self._data[name][1:]
+                self._dirty_monitors.add(name)
+
+    def plot_data(self, name):
+        '''
+        Returns the data of a plot as displayed: in place for
+        looping plots, oldest first for scrolling plots.
 
-                # add the last data point
-                self._data[name][-1] = data_point
+        arguments:
+        - name: the name of the plot
+        '''
+        data = self._data.wrapped() if self._looping else self._data.view()
+        return data[self._columns[name]]
 
-        if name in self._plots:
-            self.update_plot(name)
+    def draw_plot(self, name, full=False):
+        '''
+        Sends the data of a plot to pyqtgraph, only what changed since
+        the last time for looping and decimated plots.
 
-        if name in self._monitors:
-            self.update_monitor(name)
+        arguments:
+        - name: the name of the plot
+        - full: True to send all of it again, e.g. when x changed
+        '''
+        state = self._plots[name]
+        if self._looping:
+            xdata = self._xloop.wrapped()
+        else:
+            # the time before the last sample, the plots keep a copy
+            times = self._times.view()
+            xdata = np.subtract(times, times[-1], out=self._xscroll)
+
+        if isinstance(state, DecimatedState):
+            state.update(xdata, self._data.view()[self._columns[name]],
+                         self._added, full)
+        elif self._looping and not full:
+            # only the samples swept since the last frame
+            state.sweep(xdata, self.plot_data(name),
+                        self._data.index, self._added)
+        else:
+            state.update(xdata, self.plot_data(name))
 
     def update_plot(self, name):
         '''
@@ -376,19 +758,13 @@ class DataFiller():
         if not self._frozen:
             # Update the displayed plot with current data.
             # In frozen mode, we don't update the display.
-            color = self._colors[name]
-            color = color.replace('rgb', '')
-            color = literal_eval(color)
-            self._plots[name].setData(
-                copy(self._xdata),
-                copy(self._data[name]),
-                pen=pg.mkPen(color, width=self._config['line_width']))
-            self.set_default_x_range(name)
+            # The x range only changes with the sampling interval.
+            self.draw_plot(name)
             self.set_y_range(name)
 
             if self._looping:
-                x_val = self._xdata[self._looping_data_idx[name]
-                                    ] - self._sampling * 0.1
+                # where the next sample goes, over the previous sweep
+                x_val = self._xloop.wrapped()[self._data.index] - self._sampling * 0.1
                 self._looping_lines[name].setValue(x_val)
 
     def freeze(self):
@@ -436,9 +812,7 @@ class DataFiller():
         '''
 
         if name in self._monitors:
-            last_data_idx = self._looping_data_idx[name] - \
-                1 if self._looping else -1
-            self._monitors[name].update_value(self._data[name][last_data_idx])
+            self._monitors[name].update_value(self._data.last()[self._columns[name]])
         else:
             return
 
@@ -4,77 +4,162 @@ Data management and dispatching back and forth the ESP32
 """
 
 import sys
-from PyQt5.QtCore import QTimer
-from messagebox import MessageBox
-from communication import ESP32Exception
+import time
+import numpy as np
+from messagebox import MessageBox, show_later
+from communication import ESP32Exception, BITFIELDS
+from sampleclock import SampleClock
 
 class DataHandler():
     '''
-    This class takes care of starting a new QTimer which
-    is entirey dedicated to read data from the ESP32.
+    This class takes care of registering to the serial
+    scheduler the periodic request entirely dedicated
+    to read data from the ESP32.
     '''
 
-    def __init__(self, config, esp32, data_filler, gui_alarm):
+    def __init__(self, config, esp32, scheduler, data_filler, gui_alarm,
+                 alarm_h):
+        #pylint: disable=too-many-arguments
         '''
-        Initializes this class by creating a new QTimer
+        Initializes this class by registering the data request
 
         arguments:
         - config: the config dictionary
         - esp32: the esp32serial instance
+        - scheduler: the SerialScheduler instance
         - data_filler: the instance to the DataFiller class
         - gui_alarm: the alarm class
+        - alarm_h: the AlarmHandler, given the ESP alarm and warning
+                   words if they are in the get all data
         '''
 
         self._config = config
         self._esp32 = esp32
+        self._scheduler = scheduler
         self._data_f = data_filler
         self._gui_alarm = gui_alarm
+        self._alarm_h = alarm_h
 
-        self._timer = QTimer()
-        self._timer.timeout.connect(self.esp32_io)
-        self._start_timer()
+        # The values of a get all are decoded into a preallocated row,
+        # and converted all at once
+        self._fields = list(self._esp32.get_all_fields)
+        conv = self._config['conversions']
+        self._conversions = np.array([conv.get(name, 1.) for name in self._fields])
+        self._row = np.zeros(len(self._fields))
+        self._words = None
+        if all(name in self._fields for name in BITFIELDS):
+            self._words = [self._fields.index(name) for name in BITFIELDS]
+
+        # If requested, let the ESP send the get all frames in binary
+        if self._config.get('binary_frames', False):
+            self._esp32.use_binary_frames(True)
+
+        # If requested, let the ESP push the data, otherwise fall back
+        # to polling with get_all
+        self._streaming = False
+        stream_rate = self._config.get('stream_rate', 0)
+        if stream_rate:
+            self._streaming = self._esp32.start_streaming(stream_rate)
+        if self._streaming:
+            self._data_f.set_sampling_interval(1. / stream_rate)
+
+        # Every sample gets its time, and the timing is watched to tell
+        # when the GUI falls behind: streamed samples wait for the next
+        # drain, so they are late only after two of them
+        period = self._config["sampling_interval"]
+        self._clock = SampleClock(1. / stream_rate if self._streaming else period,
+                                  late_delay=2. * period)
+
+        # When streaming nothing has to be asked, the request is
+        # just a periodic call to drain the frames
+        commands = [] if self._streaming else ["get all"]
+        self._scheduler.register("data", self._config["sampling_interval"],
+                                 commands, self.esp32_io)
+
+    def esp32_io(self, replies):
+        '''
+        This is the main function, called by the scheduler every
+        sampling_interval with the reply to get all, or with no
+        reply at all if the ESP is streaming, in which case the
+        frames streamed since the last time are drained.
 
-    def __del__(self):
-        '''
-        Destructor
-        Stops the timer
+        arguments:
+        - replies: the list of replies from the scheduler
         '''
 
-        self._stop_timer()
+        try:
+            if self._streaming:
+                frames = self._esp32.drain_frames()
+                if frames:
+                    # all the frames of the tick are processed as one block
+                    self._process_rows(np.array([row for _, _, row in frames]),
+                                       [arrival for arrival, _, _ in frames],
+                                       [device for _, device, _ in frames])
+                return
+
+            # the reply to get all has just come
+            arrival = time.monotonic()
+
+            reply = replies[0]
+            if isinstance(reply, ESP32Exception):
+                raise reply
+
+            if isinstance(reply, bytes):
+                # a corrupted or stale binary frame is just skipped
+                if self._esp32.frame_decoder.decode(reply, self._row):
+                    self._process_rows(self._row[np.newaxis], arrival)
+                return
+
+            values = reply.split(',')
+            if len(values) != len(self._fields):
+                raise ESP32Exception("get", "get all", reply)
+            try:
+                self._row[:] = [float(value) for value in values]
+            except ValueError:
+                raise ESP32Exception("get", "get all", reply)
+            self._process_rows(self._row[np.newaxis], arrival)
 
-    def esp32_io(self):
-        '''
-        This is the main function that runs every time a QTimer times out.
-        It runs the get_all to get the data from the ESP.
+        except ESP32Exception as error:
+            self.open_comm_error(str(error))
+
+    def _process_rows(self, rows, arrivals, device_times=None):
         '''
+        Converts the values of one or more get_all, checks them against
+        the alarm thresholds and sends them, timestamped, to the
+        DataFiller.
 
-        try:
-            # Get all params from ESP
-            current_values = self._esp32.get_all()
+        arguments:
+        - rows: 2-D NumPy array with one row of values of the
+                get_all_fields per sample, in order, oldest first.
+                It is converted in place.
+        - arrivals: the host monotonic time of arrival of each row, or
+                    a single one for all
+        - device_times: the time of each row on the ESP32 clock, NaN
+                        where unknown, None if all are
+        '''
 
-            # Converting from str to float
-            for name, value in current_values.items():
-                current_values[name] = float(value)
+        times = self._clock.stamp(arrivals, device_times)
 
-            current_values = self._convert_values(current_values)
+        # the ESP alarms and warnings, as of the last row
+        if self._words is not None:
+            alarm, warning = rows[-1, self._words]
+            self._alarm_h.set_words(int(alarm), int(warning))
 
-            self._gui_alarm.set_data(current_values)
+        np.multiply(rows, self._conversions, out=rows)
 
-            # finally, send values to the DataFiller
-            for name, value in current_values.items():
-                self._data_f.add_data_point(name, value)
+        # the whole block against all the thresholds at once
+        self._gui_alarm.set_data(rows, times)
 
-        except ESP32Exception as error:
-            self.open_comm_error(str(error))
+        # finally, send values to the DataFiller
+        self._data_f.add_data_points(rows, times)
 
-    def _convert_values(self, values):
+    def timing_statistics(self):
         '''
+        Returns: a dict with the statistics of the intervals between
+        samples and of the delay with which they are processed, see
+        SampleClock.statistics.
         '''
-
-        conv = self._config['conversions']
-        return {k: v * conv.get(k, 1.) for (k, v) in values.items()}
-        # for n, v in values.items():
-        #     values[n] = v * conv['pressure'] if 'pressure' in conv else v
+        return self._clock.statistics()
 
     def open_comm_error(self, error):
         '''
@@ -82,37 +167,31 @@ class DataHandler():
         '''
         msg = MessageBox()
 
+        # Don't pile up error windows while this one is open
+        self._stop_requests()
+
         # TODO: find a good exit point
-        callbacks = {msg.Retry: self._restart_timer,
+        callbacks = {msg.Retry: self._start_requests,
                      msg.Abort: lambda: sys.exit(-1)}
 
-        msg.critical("COMMUNICATION ERROR",
-                     "CANNOT COMMUNICATE WITH THE HARDWARE",
-                     "Check cable connections then click retry.\n" + error,
-                     "COMMUNICATION ERROR",
-                     callbacks)()
+        show_later("data_comm_error", lambda: msg.critical(
+            "COMMUNICATION ERROR",
+            "CANNOT COMMUNICATE WITH THE HARDWARE",
+            "Check cable connections then click retry.\n" + error,
+            "COMMUNICATION ERROR",
+            callbacks)())
 
-    def _start_timer(self):
+    def _start_requests(self):
         '''
-        Starts the QTimer.
+        Resumes the data request.
         '''
-        self._timer.start(self._config["sampling_interval"] * 1000)
+        self._scheduler.set_enabled("data", True)
 
-    def _stop_timer(self):
+    def _stop_requests(self):
         '''
-        Stops the QTimer.
+        Suspends the data request.
         '''
-        self._timer.stop()
-
-    def _restart_timer(self):
-        '''
-        Restarts the QTimer if the QTimer is active,
-        or simply starts the QTimer
-        '''
-        if self._timer.isActive():
-            self._stop_timer()
-
-        self._start_timer()
+        self._scheduler.set_enabled("data", False)
 
     def set_data(self, param, value):
         '''
@@ -122,3 +201,21 @@ class DataHandler():
         result = self._esp32.set(param, value)
 
         return result == self._config['return_success_code']
+
+    def set_data_many(self, values):
+        '''
+        Sets several data to the ESP in a single round trip
+
+        arguments:
+        - values: dict of values keyed by ESP parameter name
+
+        returns: a dict keyed by parameter name with True if the value
+        was set, False if the ESP refused it, or the ESP32Exception
+        raised for that parameter.
+        '''
+
+        results = self._esp32.set_many(values)
+
+        success = self._config['return_success_code']
+        return {name: result if isinstance(result, ESP32Exception) else result == success
+                for name, result in results.items()}
@@ -0,0 +1,179 @@
+'''
+Module containing the Decimator class,
+which reduces the last samples of an
+observable to a few points per pixel
+column of a plot
+'''
+import numpy as np
+
+METHODS = ('minmax', 'lttb')
+
+# the key of an empty slot, buckets before the first sample being negative
+EMPTY = np.iinfo(np.int64).min
+
+
+class Decimator():
+    '''
+    Keeps a decimated copy of the last 'n_samples' samples of an
+    observable, for a plot 'columns' pixels wide.
+
+    The samples are grouped in buckets of consecutive samples, one per
+    pixel column, aligned on the number of samples added so far, so
+    that a bucket keeps its samples as the window scrolls or loops.
+    Each bucket is reduced to:
+
+    - 'minmax': its minimum and maximum, in the order they came, so that
+      no peak is lost whatever the zoom;
+    - 'lttb': the sample forming the largest triangle with the sample
+      kept in the previous bucket and the mean of the next bucket,
+      (Largest-Triangle-Three-Buckets), following the shape of the
+      trace with one point per column.
+
+    Only the buckets with new samples are reduced again, as well as the
+    oldest one, partly dropped, and, with LTTB, the one before the new
+    samples, whose next bucket changed: an update costs about the new
+    samples plus a bucket, whatever the window length.
+
+    Attributes:
+        method      (str) 'minmax' or 'lttb'
+        bucket      (int) The number of samples per bucket
+        drawn       (int) The number of samples added when last updated,
+                    EMPTY if never
+        _slots      (int) The number of buckets kept
+        _keys       (array) The bucket held in each slot, EMPTY if none
+        _first_j    (array) The number of the first sample kept per bucket
+        _first_y    (array) Its value
+        _second_j   (array) The number of the second sample kept, with minmax
+        _second_y   (array) Its value
+    '''
+
+    def __init__(self, n_samples, columns, method='minmax'):
+        '''
+        Constructor
+
+        arguments:
+        - n_samples: the number of samples displayed
+        - columns: the number of pixel columns of the plot
+        - method: 'minmax' or 'lttb'
+        '''
+        if method not in METHODS:
+            raise Exception('Unknown decimation method', method,
+                            'expected one of', METHODS)
+        self.method = method
+        self.bucket = max(1, -(-n_samples // max(1, columns)))
+        # the buckets of the window, partial ones at both ends included
+        self._slots = n_samples // self.bucket + 2
+        self._keys = np.full(self._slots, EMPTY, dtype=np.int64)
+        self._first_j = np.zeros(self._slots, dtype=np.int64)
+        self._first_y = np.zeros(self._slots)
+        self._second_j = np.zeros(self._slots, dtype=np.int64)
+        self._second_y = np.zeros(self._slots)
+        self.drawn = EMPTY
+
+    def reset(self):
+        '''
+        Forgets the buckets, so that the next update reduces them all.
+        '''
+        self._keys.fill(EMPTY)
+        self.drawn = EMPTY
+
+    def update(self, data, added):
+        '''
+        Reduces the buckets with samples added since the last update.
+
+        arguments:
+        - data: the last samples, oldest first, those before the first
+          sample added, if any, numbered from -1 down
+        - added: the number of samples added so far
+        '''
+        oldest = added - len(data)
+        if added <= oldest:
+            return
+
+        first = max(self.drawn, oldest) // self.bucket
+        if self.method == 'lttb':
+            first -= 1
+        last = (added - 1) // self.bucket
+
+        # the oldest bucket, then the new ones, in order for LTTB
+        self._reduce(oldest // self.bucket, data, oldest, added)
+        for key in range(max(first, oldest // self.bucket + 1), last + 1):
+            self._reduce(key, data, oldest, added)
+        self.drawn = added
+
+    def _reduce(self, key, data, oldest, added):
+        '''
+        Reduces a bucket.
+
+        arguments:
+        - key: the number of the bucket
+        - data: the last samples, oldest first
+        - oldest: the number of the first of them
+        - added: the number of samples added so far
+        '''
+        start = max(key * self.bucket, oldest)
+        stop = min((key + 1) * self.bucket, added)
+        if start >= stop:
+            return
+        values = data[start - oldest:stop - oldest]
+        slot = key % self._slots
+        self._keys[slot] = key
+
+        if self.method == 'minmax':
+            low = int(np.argmin(values))
+            high = int(np.argmax(values))
+            first, second = min(low, high), max(low, high)
+            self._first_j[slot] = start + first
+            self._first_y[slot] = values[first]
+            self._second_j[slot] = start + second
+            self._second_y[slot] = values[second]
+            return
+
+        # LTTB: the previous point kept, or the first sample if none
+        previous = (key - 1) % self._slots
+        if self._keys[previous] == key - 1 and self._first_j[previous] >= oldest:
+            point_j, point_y = self._first_j[previous], self._first_y[previous]
+        else:
+            point_j, point_y = start, values[0]
+
+        # the mean of the next bucket, or the last sample if none yet
+        following = data[stop - oldest:min(stop + self.bucket, added) - oldest]
+        if len(following):
+            mean_j = stop + (len(following) - 1) / 2.
+            mean_y = following.mean()
+        else:
+            mean_j, mean_y = stop - 1, values[-1]
+
+        areas = np.abs((point_j - mean_j) * (values - point_y)
+                       - (point_j - np.arange(start, stop)) * (mean_y - point_y))
+        best = int(np.argmax(areas))
+        self._first_j[slot] = start + best
+        self._first_y[slot] = values[best]
+
+    def points(self, added, n_samples):
+        '''
+        Returns the points kept for the window of the last samples.
+
+        arguments:
+        - added: the number of samples added so far
+        - n_samples: the number of samples in the window
+
+        returns: (numbers, values), the number of the samples kept and
+        their values, oldest first.
+        '''
+        oldest = added - n_samples
+        keys = np.arange(oldest // self.bucket, (added - 1) // self.bucket + 1)
+        slots = keys % self._slots
+        slots = slots[self._keys[slots] == keys]
+
+        if self.method == 'minmax':
+            numbers = np.column_stack((self._first_j[slots],
+                                       self._second_j[slots])).ravel()
+            values = np.column_stack((self._first_y[slots],
+                                      self._second_y[slots])).ravel()
+        else:
+            numbers = self._first_j[slots]
+            values = self._first_y[slots]
+
+        kept = numbers >= oldest
+        return numbers[kept], values[kept]
@@ -50,10 +50,10 @@ class Cursor():
             self.cursor_label[num].setPos(-10.4, 10)
             plot.addItem(self.cursor_label[num])
 
-            # Find the PlotDataItem displaying data
-            for item in plot.getPlotItem().items:
-                if isinstance(item, PlotDataItem):
-                    self.plot_data_items[num] = item
+            # Find the PlotDataItems displaying data (looping plots
+            # are drawn in several chunks)
+            self.plot_data_items[num] = [item for item in plot.getPlotItem().items
+                                         if isinstance(item, PlotDataItem)]
 
         self.hide_cursors()
 
@@ -108,8 +108,12 @@ class Cursor():
                 mouse_point = view_box.mapSceneToView(pos)
 
                 # Get the x and y data from the plot
-                data_x = self.plot_data_items[num].xData
-                data_y = self.plot_data_items[num].yData
+                items = [item for item in self.plot_data_items[num]
+                         if item.xData is not None and len(item.xData)]
+                if not items:
+                    continue
+                data_x = np.concatenate([item.xData for item in items])
+                data_y = np.concatenate([item.yData for item in items])
 
                 # Find the x index closest to where the mouse if pointing
                 index = (np.abs(data_x - mouse_point.x())).argmin()
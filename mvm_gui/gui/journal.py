@@ -0,0 +1,406 @@
+'''
+Module containing the EventJournal class,
+the persistent record of the alarms, snoozes,
+start/stop and setting changes
+
+The journal is an append-only binary file, kept across the sessions: a
+header made of MAGIC, then one record per event:
+
+    float64     wall clock time, as is: it goes back if the clock does,
+                e.g. on a Raspberry Pi booting without RTC
+    uint8       the kind of event, see KIND_NAMES
+    uint32      a code: the alarm bit, the mode of a start or stop, or 0
+    uint16      length of the text
+    bytes       the text, UTF-8 encoded: the alarm message or name,
+                "name=value" for a setting
+
+Beside it, the index file (the journal path plus INDEX_SUFFIX) cuts the
+journal into blocks of INDEX_STRIDE records, and holds the earliest and
+latest time and the offset of each complete block, after INDEX_MAGIC, as
+two little-endian doubles and a uint64. It is rebuilt from the journal
+if missing or behind, e.g. after a crash.
+'''
+import os
+import struct
+import time
+from bisect import bisect_left, bisect_right
+from threading import Event, Lock, Thread
+
+MAGIC = b"MVMJRNL1"
+INDEX_MAGIC = b"MVMJIDX2"
+INDEX_SUFFIX = ".idx"
+INDEX_STRIDE = 64
+
+# the kinds of events
+ESP_ALARM = 0
+ESP_ALARM_CLEARED = 1
+ESP_WARNING = 2
+ESP_WARNING_CLEARED = 3
+ESP_ALARM_SNOOZE = 4
+ESP_WARNING_SNOOZE = 5
+GUI_ALARM = 6
+GUI_ALARM_SNOOZE = 7
+START = 8
+STOP = 9
+SETTING = 10
+
+KIND_NAMES = {
+    ESP_ALARM: "esp alarm",
+    ESP_ALARM_CLEARED: "esp alarm cleared",
+    ESP_WARNING: "esp warning",
+    ESP_WARNING_CLEARED: "esp warning cleared",
+    ESP_ALARM_SNOOZE: "esp alarm snoozed",
+    ESP_WARNING_SNOOZE: "esp warning snoozed",
+    GUI_ALARM: "gui alarm",
+    GUI_ALARM_SNOOZE: "gui alarm snoozed",
+    START: "start",
+    STOP: "stop",
+    SETTING: "setting",
+}
+
+_RECORD = struct.Struct("<dBIH")
+_INDEX = struct.Struct("<ddQ")
+
+
+def _parse(data, offset):
+    '''
+    Parses a record.
+
+    arguments:
+    - data: a bytes-like object holding records
+    - offset: the offset of the record in data
+
+    returns: ((time, kind, code, text), offset of the next record), or
+    (None, offset) if the record is truncated.
+    '''
+    if offset + _RECORD.size > len(data):
+        return None, offset
+    timestamp, kind, code, length = _RECORD.unpack_from(data, offset)
+    end = offset + _RECORD.size + length
+    if end > len(data):
+        return None, offset
+    text = bytes(data[offset + _RECORD.size:end]).decode(errors="replace")
+    return (timestamp, kind, code, text), end
+
+
+def read_journal(path):
+    '''
+    Reads a whole journal.
+
+    arguments:
+    - path: the path of the journal
+
+    returns: a list of (wall clock time, kind, code, text) tuples, in the
+    order they were recorded, a record truncated by a crash left out.
+    '''
+    with open(path, "rb") as journal:
+        data = journal.read()
+    if not data.startswith(MAGIC):
+        raise ValueError("%s is not an event journal" % path)
+
+    events = []
+    event, offset = _parse(data, len(MAGIC))
+    while event is not None:
+        events.append(event)
+        event, offset = _parse(data, offset)
+    return events
+
+
+class EventJournal():
+    '''
+    Appends the events to the journal without ever blocking the caller:
+    the records are queued, and written by a background thread in
+    batches, with one fsync per batch, flush_interval seconds after the
+    first event of the batch.
+
+    The sparse index, kept in memory and in the index file, tells where
+    to read for a time range, whatever the length of the journal, and
+    even if the clock went back: the latest time of the blocks so far
+    and the earliest time of the blocks from there on never decrease
+    along the journal, so a binary search on each gives the blocks
+    before and after the range, all of whose records are out of it.
+    Unless the clock went back, a query costs two binary searches plus
+    at most two blocks of records out of the range.
+
+    Attributes:
+        path            (str) The path of the journal
+        flush_interval  (float) The longest time, in seconds, an event
+                        waits before being written
+        records         (int) The number of records in the journal,
+                        queued ones included
+        _size           (int) The size of the journal written so far
+        _written        (int) The number of records written so far
+        _block_offsets  (list) The offset of each block, the last one
+                        possibly incomplete
+        _block_min      (list) The earliest time of each block
+        _block_max      (list) The latest time of each block
+        _prefix_max     (list) The latest time of the blocks up to each
+        _suffix_min     (list) The earliest time of the blocks from each
+        _pending        (list) The (time, bytes) of the records queued
+        _batches        (int) The number of batches written
+        _fsync_max      (float) The longest time a batch took to be
+                        written and synced
+    '''
+
+    def __init__(self, path, flush_interval=1.):
+        '''
+        Constructor: opens the journal, creating it if needed, and
+        starts the writer thread.
+
+        arguments:
+        - path: the path of the journal
+        - flush_interval: the longest time, in seconds, an event waits
+          before being written
+        '''
+        self.path = path
+        self.flush_interval = flush_interval
+        self._lock = Lock()
+        self._pending = []
+        self._batches = 0
+        self._fsync_max = 0.
+
+        self._open()
+
+        self._wake = Event()
+        self._stopping = Event()
+        self._thread = Thread(target=self._writer_loop, name="EventJournal",
+                              daemon=True)
+        self._thread.start()
+
+    def _open(self):
+        '''
+        Opens the journal and its index, recovering from a crash: the
+        index is completed from the records of the last complete block
+        on, and a truncated last record is dropped.
+        '''
+        if not os.path.exists(self.path) or not os.path.getsize(self.path):
+            with open(self.path, "wb") as journal:
+                journal.write(MAGIC)
+
+        with open(self.path, "rb") as journal:
+            if journal.read(len(MAGIC)) != MAGIC:
+                raise ValueError("%s is not an event journal" % self.path)
+        size = os.path.getsize(self.path)
+
+        self._block_offsets = []
+        self._block_min = []
+        self._block_max = []
+        index_path = self.path + INDEX_SUFFIX
+        if os.path.exists(index_path):
+            with open(index_path, "rb") as index:
+                entries = index.read()
+            if entries.startswith(INDEX_MAGIC):
+                for offset in range(len(INDEX_MAGIC),
+                                    len(entries) - _INDEX.size + 1, _INDEX.size):
+                    block_min, block_max, block_offset = _INDEX.unpack_from(entries, offset)
+                    if block_offset >= size:
+                        break
+                    self._block_offsets.append(block_offset)
+                    self._block_min.append(block_min)
+                    self._block_max.append(block_max)
+
+        # the last block is read again, as the journal may have been
+        # truncated in it, so at most 2 * INDEX_STRIDE records are read
+        # unless the index was lost
+        start = len(MAGIC)
+        if self._block_offsets:
+            start = self._block_offsets.pop()
+            self._block_min.pop()
+            self._block_max.pop()
+        self._prefix_max = []
+        for block_max in self._block_max:
+            self._prefix_max.append(max(block_max, self._prefix_max[-1])
+                                    if self._prefix_max else block_max)
+        self._suffix_min = list(self._block_min)
+        for block in range(len(self._suffix_min) - 2, -1, -1):
+            self._suffix_min[block] = min(self._suffix_min[block],
+                                          self._suffix_min[block + 1])
+        self._written = len(self._block_offsets) * INDEX_STRIDE
+
+        with open(self.path, "rb") as journal:
+            journal.seek(start)
+            data = journal.read()
+
+        position = 0
+        event, end = _parse(data, position)
+        while event is not None:
+            # the blocks completed are all written to the index below
+            self._index_record(event[0], start + position)
+            position = end
+            event, end = _parse(data, position)
+        self.records = self._written
+
+        offset = start + position
+        if offset < size:
+            print("ERROR: dropping a truncated record at the end of %s" % self.path)
+        self._file = open(self.path, "r+b")
+        self._file.truncate(offset)
+        self._file.seek(offset)
+        self._size = offset
+
+        self._index_file = open(index_path, "wb")
+        self._index_file.write(INDEX_MAGIC)
+        for block in range(len(self._block_offsets) - 1):
+            self._index_file.write(_INDEX.pack(self._block_min[block],
+                                               self._block_max[block],
+                                               self._block_offsets[block]))
+        self._index_file.flush()
+
+    def _index_record(self, timestamp, offset):
+        '''
+        Adds a record written to the journal to the index.
+
+        arguments:
+        - timestamp: the time of the record
+        - offset: its offset in the journal
+
+        returns: a list with the index file entry of the block completed
+        by the previous record, if any.
+        '''
+        complete = []
+        if self._written % INDEX_STRIDE == 0:
+            if self._block_offsets:
+                complete.append(_INDEX.pack(self._block_min[-1], self._block_max[-1],
+                                            self._block_offsets[-1]))
+            self._block_offsets.append(offset)
+            self._block_min.append(timestamp)
+            self._block_max.append(timestamp)
+            self._prefix_max.append(max(timestamp, self._prefix_max[-1])
+                                    if self._prefix_max else timestamp)
+            self._suffix_min.append(timestamp)
+        else:
+            self._block_min[-1] = min(self._block_min[-1], timestamp)
+            self._block_max[-1] = max(self._block_max[-1], timestamp)
+            self._prefix_max[-1] = max(self._prefix_max[-1], timestamp)
+            self._suffix_min[-1] = min(self._suffix_min[-1], timestamp)
+
+        # only when the clock went back does this go further than one block
+        block = len(self._suffix_min) - 2
+        while block >= 0 and self._suffix_min[block] > timestamp:
+            self._suffix_min[block] = timestamp
+            block -= 1
+
+        self._written += 1
+        return complete
+
+    def record(self, kind, code=0, text="", timestamp=None):
+        '''
+        Queues an event.
+
+        arguments:
+        - kind: the kind of event, see KIND_NAMES
+        - code: the alarm bit, the mode of a start or stop, or 0
+        - text: the alarm message or name, "name=value" for a setting
+        - timestamp: the wall clock time of the event, default now
+        '''
+        text = str(text).encode()[:0xFFFF]
+        if timestamp is None:
+            timestamp = time.time()
+        data = _RECORD.pack(timestamp, kind, code & 0xFFFFFFFF, len(text)) + text
+        with self._lock:
+            self._pending.append((timestamp, data))
+            self.records += 1
+        self._wake.set()
+
+    def _writer_loop(self):
+        '''
+        Body of the writer thread.
+        '''
+        while not self._stopping.is_set():
+            self._wake.wait()
+            # let the batch grow, unless closing
+            self._stopping.wait(self.flush_interval)
+            self._wake.clear()
+            self._write_batch()
+        self._write_batch()
+
+    def _write_batch(self):
+        '''
+        Writes and syncs the records queued, and indexes them.
+        '''
+        # the records stay queued until indexed, so that a query in the
+        # meantime finds them
+        with self._lock:
+            batch = list(self._pending)
+        if not batch:
+            return
+
+        start = time.monotonic()
+        self._file.write(b"".join(data for _, data in batch))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+        complete = []
+        with self._lock:
+            for timestamp, data in batch:
+                complete.extend(self._index_record(timestamp, self._size))
+                self._size += len(data)
+            del self._pending[:len(batch)]
+            self._batches += 1
+        self._index_file.write(b"".join(complete))
+        self._index_file.flush()
+        with self._lock:
+            self._fsync_max = max(self._fsync_max, time.monotonic() - start)
+
+    def events(self, start, stop):
+        '''
+        Returns the events in a time range, queued ones included.
+
+        arguments:
+        - start, stop: the wall clock time range, in seconds, both
+          included
+
+        returns: a list of (wall clock time, kind, code, text) tuples, in
+        the order they were recorded.
+        '''
+        with self._lock:
+            # the blocks before first are all earlier than start, those
+            # from last on all later than stop
+            first = bisect_left(self._prefix_max, start)
+            last = bisect_right(self._suffix_min, stop)
+            n_blocks = len(self._block_offsets)
+            begin = self._block_offsets[first] if first < n_blocks else self._size
+            end = self._block_offsets[last] if last < n_blocks else self._size
+            pending = list(self._pending)
+
+        events = []
+        if end > begin:
+            with open(self.path, "rb") as journal:
+                journal.seek(begin)
+                data = journal.read(end - begin)
+            event, position = _parse(data, 0)
+            while event is not None:
+                if start <= event[0] <= stop:
+                    events.append(event)
+                event, position = _parse(data, position)
+
+        for timestamp, data in pending:
+            if start <= timestamp <= stop:
+                events.append(_parse(data, 0)[0])
+        return events
+
+    def statistics(self):
+        '''
+        Returns: a dict with the number of records and batches written,
+        the records queued, and the longest time a batch took to be
+        written and synced, in seconds.
+        '''
+        with self._lock:
+            return {"records": self.records,
+                    "queued": len(self._pending),
+                    "batches": self._batches,
+                    "fsync_max": self._fsync_max}
+
+    def close(self):
+        '''
+        Writes the records queued, stops the writer thread and closes
+        the files.
+        '''
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._wake.set()
+        self._thread.join()
+        self._thread = None
+        self._file.close()
+        self._index_file.close()
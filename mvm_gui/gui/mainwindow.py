@@ -26,6 +26,7 @@ from alarm_handler import AlarmHandler
 from numpad.numpad import NumPad
 from frozenplots.frozenplots import Cursor
 from messagebar.messagebar import MessageBar
+from journal import EventJournal
 
 
 class MainWindow(QtWidgets.QMainWindow):
@@ -37,7 +38,7 @@ class MainWindow(QtWidgets.QMainWindow):
     monitors.
     """
 
-    def __init__(self, config, esp32, *args, **kwargs):
+    def __init__(self, config, esp32, scheduler, *args, **kwargs):
         #pylint: disable=too-many-statements
         """
         Initializes the main window for the MVM GUI. See below for subfunction setup description.
@@ -48,13 +49,27 @@ class MainWindow(QtWidgets.QMainWindow):
 
         self.config = config
         self.esp32 = esp32
+        self.scheduler = scheduler
         settings_file = SettingsFile(self.config["settings_file_path"])
         self.user_settings = settings_file.load()
 
+        '''
+        Open the journal where the alarms, snoozes, start/stop and
+        setting changes are recorded
+        '''
+        self.journal = None
+        if self.config.get("journal_path"):
+            try:
+                self.journal = EventJournal(self.config["journal_path"],
+                                            self.config.get("journal_flush_interval", 1.))
+            except (OSError, ValueError) as error:
+                print("ERROR: cannot open the event journal: %s" % str(error))
+
         '''
         Start the alarm handler, which will check for ESP alarms
         '''
-        self.alarm_h = AlarmHandler(self.config, self.esp32, self.alarmbar)
+        self.alarm_h = AlarmHandler(self.config, self.esp32, self.scheduler,
+                                    self.alarmbar, self.journal)
 
         '''
         Get the toppane and child pages
@@ -276,7 +291,7 @@ class MainWindow(QtWidgets.QMainWindow):
         # for name in config['alarms']:
         #     alarm = GuiAlarm(name, config, self.monitors, self.alarm_h)
         #     self.alarms[name] = alarm
-        self.gui_alarm = GuiAlarms(config, self.esp32, self.monitors)
+        self.gui_alarm = GuiAlarms(config, self.esp32, self.monitors, self.journal)
         for monitor in self.monitors.values():
             monitor.connect_gui_alarm(self.gui_alarm)
 
@@ -313,10 +328,12 @@ class MainWindow(QtWidgets.QMainWindow):
         #data directly to the DataFiller, which will
         #then display them.
         self._data_h = DataHandler(
-            config, self.esp32, self.data_filler, self.gui_alarm)
+            config, self.esp32, self.scheduler, self.data_filler, self.gui_alarm,
+            self.alarm_h)
 
         self.specialbar.connect_datahandler_config_esp32(self._data_h,
-                                                         self.config, self.esp32, self.messagebar)
+                                                         self.config, self.esp32,
+                                                         self.scheduler, self.messagebar)
 
         #Connect settings button to Settings overlay.
         self.settings = Settings(self)
@@ -331,6 +348,7 @@ class MainWindow(QtWidgets.QMainWindow):
             self,
             self.config,
             self.esp32,
+            self.scheduler,
             self.button_startstop,
             self.button_autoassist,
             self.toolbar,
@@ -345,6 +363,20 @@ class MainWindow(QtWidgets.QMainWindow):
             self._start_stop_worker.toggle_mode)
         self.gui_alarm.connect_workers(self._start_stop_worker)
 
+        # Show when the link with the ESP is not healthy, without ever
+        # waiting for it
+        self.scheduler.register("link_state", config["status_sampling_interval"],
+                                [], self.update_link_state)
+
+    def update_link_state(self, _):
+        """
+        Shows in the toolbar the latest state of the link with the ESP.
+        """
+        events = self.esp32.drain_link_events()
+        if events:
+            _, state, reason = events[-1]
+            self.toolbar.set_link_state(state, reason)
+
     def lock_screen(self):
         """
         Perform screen locking.
@@ -502,6 +534,8 @@ class MainWindow(QtWidgets.QMainWindow):
         """
 
         self.toppane.setCurrentWidget(self.main)
+        # catch up with the data received while the plots were hidden
+        self.data_filler.render()
 
     def show_settingsfork(self):
         """
@@ -524,6 +558,8 @@ class MainWindow(QtWidgets.QMainWindow):
         """
 
         self.centerpane.setCurrentWidget(self.plots_all)
+        # catch up with the data received while the plots were hidden
+        self.data_filler.render()
 
     def show_alarmsbar(self):
         """
@@ -550,3 +586,11 @@ class MainWindow(QtWidgets.QMainWindow):
         self.data_filler.unfreeze()
         self.rightbar.setCurrentWidget(self.monitors_bar)
         self.show_specialbar()
+
+    def timing_statistics(self):
+        """
+        Returns: the statistics of the timing of the samples, see
+        DataHandler.timing_statistics.
+        """
+
+        return self._data_h.timing_statistics()
@@ -3,8 +3,47 @@ Module containg the MessageBox which
 handles pop up messages
 '''
 from functools import reduce
+from PyQt5.QtCore import QTimer
 from PyQt5.QtWidgets import QMessageBox
 
+# the (key, show) of the deferred message boxes, the first being shown
+_DEFERRED = []
+
+
+def show_later(key, show):
+    '''
+    Opens a message box from the event loop, once the boxes opened
+    before by show_later are closed, rather than right away. For the
+    functions which must not block, e.g. the scheduler callbacks, as a
+    modal box keeps the timer which called them from firing again.
+
+    arguments:
+    - key           the name of the message: a message is not shown
+                    again while one with the same key is waiting or
+                    shown
+    - show          the function opening the box and calling the
+                    callback of the button clicked, e.g.
+                    lambda: MessageBox().critical(...)()
+    '''
+    if any(waiting == key for waiting, _ in _DEFERRED):
+        return
+    _DEFERRED.append((key, show))
+    if len(_DEFERRED) == 1:
+        QTimer.singleShot(0, _show_deferred)
+
+
+def _show_deferred():
+    '''
+    Shows the deferred message boxes, one at a time.
+    '''
+    while _DEFERRED:
+        try:
+            _DEFERRED[0][1]()
+        except Exception as error: # pylint: disable=W0703
+            print("ERROR: %s message failing: %s" % (_DEFERRED[0][0], str(error)))
+        finally:
+            del _DEFERRED[0]
+
 
 class MessageBox(QMessageBox):
     '''
@@ -11,7 +11,8 @@ from PyQt5 import QtCore, QtWidgets
 import yaml
 
 from mainwindow import MainWindow
-from communication.esp32serial import ESP32Serial, ESP32Exception
+from communication.esp32serial import ESP32Serial, ESP32Exception, LANE_WATCHDOG
+from communication.scheduler import SerialScheduler
 from communication.fake_esp32serial import FakeESP32Serial
 from messagebox import MessageBox
 
@@ -36,8 +37,11 @@ def connect_esp32(config):
             esp32.set("wdenable", 1)
         else:
             err_msg = "Cannot communicate with port %s" % config['port']
-            esp32 = ESP32Serial(config)
+            esp32 = ESP32Serial(config, latency_budget=config['latency_budget'],
+                                record=config.get('traffic_log') or None)
             esp32.set("wdenable", 1)
+        # an older firmware may not send the alarm and warning words
+        config["get_all_fields"] = esp32.detect_get_all_fields()
     except ESP32Exception as error:
         msg = MessageBox()
         answer = msg.critical("Do you want to retry?",
@@ -50,6 +54,19 @@ def connect_esp32(config):
     return esp32
 
 
+def watchdog_replied(replies):
+    """
+    Reports a failed watchdog reset.
+
+    arguments:
+    - replies: the list of replies from the scheduler
+    """
+
+    for reply in replies:
+        if isinstance(reply, ESP32Exception):
+            print("ERROR: watchdog reset failing: %s" % str(reply))
+
+
 def main():
     """
     Main function.
@@ -69,14 +86,35 @@ def main():
     if esp32 is None:
         sys.exit(-1)
 
-    watchdog = QtCore.QTimer()
-    watchdog.timeout.connect(esp32.set_watchdog)
-    watchdog.start(config["wdinterval"] * 1000)
+    # all the periodic traffic with the ESP goes through the scheduler,
+    # which is ticked by a single timer, but for the watchdog reset,
+    # which has a thread of its own not to depend on the GUI thread
+    scheduler = SerialScheduler(esp32, config["scheduler_tick"])
+    scheduler.register_heartbeat("watchdog", config["wdinterval"],
+                                 ["set watchdog_reset 1"], watchdog_replied, LANE_WATCHDOG)
+
+    ticker = QtCore.QTimer()
+    ticker.timeout.connect(scheduler.tick)
+    ticker.start(int(config["scheduler_tick"] * 1000))
 
-    window = MainWindow(config, esp32)
+    window = MainWindow(config, esp32, scheduler)
     window.show()
     app.exec_()
+    ticker.stop()
+    scheduler.stop()
+    print('Serial scheduler statistics:', yaml.dump(scheduler.statistics()), sep='\n')
+    print('Serial lane statistics:', yaml.dump(esp32.lane_statistics()), sep='\n')
+    print('Binary frame statistics:', yaml.dump(esp32.frame_statistics()), sep='\n')
+    print('Sample timing statistics:', yaml.dump(window.timing_statistics()), sep='\n')
+    window.gui_alarm.close()
+    alarm_statistics = window.gui_alarm.statistics()
+    if alarm_statistics is not None:
+        print('Alarm process statistics:', yaml.dump(alarm_statistics), sep='\n')
+    if window.journal is not None:
+        window.journal.close()
+        print('Event journal statistics:', yaml.dump(window.journal.statistics()), sep='\n')
     esp32.set("wdenable", 0)
+    esp32.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,122 @@
+'''
+Module containing the RingBuffer class,
+a fixed size store of the last samples
+with O(1) append
+'''
+import numpy as np
+
+
+class RingBuffer():
+    '''
+    Keeps the last 'size' samples of an observable, or of a table of
+    'width' observables sampled together.
+
+    Every sample is written twice, at index and index + size, in a
+    storage of 2 * size values: the last size samples are then always
+    found, oldest first, in the contiguous slice starting at index.
+    Appending costs the same whatever the size, and reading is a
+    NumPy view, with no copy.
+
+    A table is stored one observable per row, so that the samples of
+    each observable stay contiguous, and whole rows of observables are
+    appended with a single NumPy operation.
+
+    The first half of the storage is also the layout of a looping plot:
+    the samples in place, the next one going at index.
+
+    Attributes:
+        size        (int) The number of samples kept
+        width       (int) The number of observables, None for a single one
+        index       (int) Where the next sample goes, in [0, size)
+        _storage    (array) The 2 * size values, per observable
+    '''
+
+    def __init__(self, size, width=None, fill=0.):
+        '''
+        Constructor
+
+        arguments:
+        - size: the number of samples to keep
+        - width: the number of observables, None for a single one
+        - fill: the value of the samples before the first append
+        '''
+        self.size = size
+        self.width = width
+        self.index = 0
+        shape = 2 * size if width is None else (width, 2 * size)
+        self._storage = np.full(shape, fill, dtype=float)
+
+    def __len__(self):
+        return self.size
+
+    def append(self, value):
+        '''
+        Adds a sample, dropping the oldest one.
+
+        arguments:
+        - value: (float) the sample to add, or the width values of a
+          table row
+        '''
+        index = self.index
+        if self.width is None:
+            self._storage[index] = value
+            self._storage[index + self.size] = value
+        else:
+            self._storage[:, index] = value
+            self._storage[:, index + self.size] = value
+        index += 1
+        self.index = 0 if index == self.size else index
+
+    def extend(self, values):
+        '''
+        Adds several samples, oldest first.
+
+        arguments:
+        - values: the samples to add, as a sequence or an array, of
+          shape (n,), or (n, width) for a table
+        '''
+        # one column per sample, whatever the width
+        columns = np.asarray(values, dtype=float).T
+        size = self.size
+        # only the last size samples survive, where they would have been
+        # written one by one
+        start = (self.index + max(columns.shape[-1] - size, 0)) % size
+        columns = columns[..., -size:]
+        count = columns.shape[-1]
+
+        # up to the end of each half, then from the start of each half
+        first = min(count, size - start)
+        self._storage[..., start:start + first] = columns[..., :first]
+        self._storage[..., start + size:start + size + first] = columns[..., :first]
+        rest = count - first
+        self._storage[..., :rest] = columns[..., first:]
+        self._storage[..., size:size + rest] = columns[..., first:]
+
+        self.index = (start + count) % size
+
+    def view(self):
+        '''
+        Returns: a read-only view of the samples, oldest first, one row
+        per observable for a table.
+        '''
+        data = self._storage[..., self.index:self.index + self.size]
+        data.flags.writeable = False
+        return data
+
+    def wrapped(self):
+        '''
+        Returns: a read-only view of the samples in place, the oldest one
+        at index, as shown by the looping plots.
+        '''
+        data = self._storage[..., :self.size]
+        data.flags.writeable = False
+        return data
+
+    def last(self):
+        '''
+        Returns: the last sample added, or the last table row.
+        '''
+        # a plain index, for a scalar rather than a 0-d array
+        if self.width is None:
+            return self._storage[self.index + self.size - 1]
+        return self._storage[:, self.index + self.size - 1]
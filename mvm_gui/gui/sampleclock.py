@@ -0,0 +1,129 @@
+'''
+Module containing the SampleClock class,
+which timestamps the samples and keeps
+statistics of their timing
+'''
+import time
+import numpy as np
+from ringbuffer import RingBuffer
+from slidingminmax import SlidingMinMax
+
+
+class SampleClock():
+    '''
+    Gives every sample its time on the host monotonic clock, and keeps
+    statistics of the intervals between samples and of the delay with
+    which they are processed.
+
+    The host time of arrival of a sample includes the delays of the
+    serial link and of the reader, and streamed samples read together
+    share it. When the device time is known, the sample time is rather
+    the device time shifted onto the host clock: the smallest recent
+    difference between arrival and device time is the offset of the
+    two clocks plus the shortest transfer delay, so it follows the
+    drift of the device clock without the jitter of the arrivals.
+
+    Attributes:
+        interval    (float) The expected time between two samples
+        last        (float) The time of the last sample, None before
+        _offsets    (SlidingMinMax) The recent arrival - device times
+        _intervals  (RingBuffer) The recent intervals between samples
+        _delays     (RingBuffer) The recent processing delays
+        _count      (int) The number of samples stamped
+        _gaps       (int) The number of intervals longer than twice interval
+        _late       (int) The number of samples processed more than
+                    late_delay after their arrival
+        _late_delay (float) The processing delay beyond which the GUI is
+                    considered falling behind
+    '''
+
+    def __init__(self, interval, window=500, late_delay=None):
+        '''
+        Constructor
+
+        arguments:
+        - interval: the expected time between two samples, in seconds
+        - window: the number of recent samples the statistics and the
+          clock offset are computed on
+        - late_delay: the processing delay, in seconds, beyond which a
+          sample is late, default twice interval
+        '''
+        self.interval = interval
+        self.last = None
+        self._late_delay = 2. * interval if late_delay is None else late_delay
+        self._offsets = SlidingMinMax(window)
+        self._intervals = RingBuffer(window, fill=np.nan)
+        self._delays = RingBuffer(window, fill=np.nan)
+        self._count = 0
+        self._gaps = 0
+        self._late = 0
+
+    def stamp(self, arrivals, device_times=None, now=None):
+        '''
+        Returns the times of a block of samples, and accounts for them
+        in the statistics.
+
+        arguments:
+        - arrivals: the host monotonic times of arrival of the samples,
+          oldest first, as an array, or a single time for all of them
+        - device_times: the times of the samples on the device clock,
+          NaN where unknown, None if all are
+        - now: the host monotonic time of processing, default now
+
+        returns: an array with the time of each sample, on the host
+        monotonic clock, never decreasing.
+        '''
+        arrivals = np.atleast_1d(np.asarray(arrivals, dtype=float))
+        times = arrivals.copy()
+
+        if device_times is not None:
+            device_times = np.asarray(device_times, dtype=float)
+            known = np.isfinite(device_times)
+            if known.any():
+                self._offsets.extend((arrivals[known] - device_times[known]).tolist())
+                times[known] = device_times[known] + self._offsets.minimum
+
+        # never back in time, e.g. when the offset gets smaller
+        if self.last is not None:
+            times[0] = max(times[0], self.last)
+        np.maximum.accumulate(times, out=times)
+
+        if now is None:
+            now = time.monotonic()
+        delays = now - arrivals
+        self._delays.extend(delays)
+        self._late += int(np.count_nonzero(delays > self._late_delay))
+
+        intervals = np.diff(times) if self.last is None else \
+            np.diff(times, prepend=self.last)
+        self._intervals.extend(intervals)
+        self._gaps += int(np.count_nonzero(intervals > 2. * self.interval))
+
+        self._count += len(times)
+        self.last = times[-1]
+        return times
+
+    def statistics(self):
+        '''
+        Returns: a dict with the number of samples, the number of gaps
+        and late samples so far, and the mean, standard deviation (the
+        jitter) and maximum of the recent intervals, and the mean and
+        maximum of the recent processing delays, in seconds.
+        '''
+        intervals = self._intervals.view()
+        intervals = intervals[np.isfinite(intervals)]
+        delays = self._delays.view()
+        delays = delays[np.isfinite(delays)]
+
+        stats = {"samples": self._count,
+                 "gaps": self._gaps,
+                 "late": self._late,
+                 "expected_interval": self.interval}
+        if len(intervals):
+            stats.update({"interval_mean": float(intervals.mean()),
+                          "interval_jitter": float(intervals.std()),
+                          "interval_max": float(intervals.max())})
+        if len(delays):
+            stats.update({"delay_mean": float(delays.mean()),
+                          "delay_max": float(delays.max())})
+        return stats
@@ -9,6 +9,7 @@ from PyQt5 import QtWidgets, uic
 from presets.presets import Presets
 from messagebox import MessageBox
 from communication import ESP32Exception
+from journal import SETTING
 from .settingsfile import SettingsFile
 
 
@@ -33,6 +34,9 @@ class Settings(QtWidgets.QMainWindow):
         self._config = self.mainparent.config
         self._data_h = self.mainparent._data_h
         self._toolsettings = self.mainparent.toolsettings
+        self._journal = self.mainparent.journal
+        # The values last set in the ESP, the changes are journaled
+        self._sent_values = {}
         # self._start_stop_worker = self.mainparent._start_stop_worker
 
         # This contains all the default params
@@ -332,6 +336,7 @@ class Settings(QtWidgets.QMainWindow):
         '''
 
         settings_to_file = {}
+        esp_values = {}
         for param, btn in self._all_spinboxes.items():
             settings_to_file[param] = self._current_values[param]
 
@@ -361,21 +366,7 @@ class Settings(QtWidgets.QMainWindow):
             btn.setStyleSheet("color: red")
 
             esp_param_name = self._config['esp_settable_param'][param]
-
-            # Finally, try to set the value to the ESP
-            # Raise an error message if this fails.
-            try:
-                if self._data_h.set_data(esp_param_name, value):
-                    # Now set the color to green, as we know it has been set
-                    btn.setStyleSheet("color: green")
-            except ESP32Exception as error:
-                msg = MessageBox()
-                msg.critical("Critical",
-                             "Severe Hardware Communication Error",
-                             str(error),
-                             "Communication error",
-                             {msg.Retry: lambda: self.send_values_to_hardware,
-                              msg.Abort: lambda: sys.exit(-1)})()
+            esp_values[esp_param_name] = value
 
             if param == 'respiratory_rate':
                 self.toolsettings_lookup["respiratory_rate"].update(value)
@@ -385,6 +376,35 @@ class Settings(QtWidgets.QMainWindow):
             elif param == 'insp_pressure':
                 self.toolsettings_lookup["insp_pressure"].update(value)
 
+        # Finally, try to set all the values to the ESP at once
+        # Raise an error message if any of them fails.
+        results = self._data_h.set_data_many(esp_values)
+
+        errors = []
+        for param, btn in self._all_spinboxes.items():
+            result = results[self._config['esp_settable_param'][param]]
+            if isinstance(result, ESP32Exception):
+                errors.append(str(result))
+            elif result:
+                # Now set the color to green, as we know it has been set
+                btn.setStyleSheet("color: green")
+
+                esp_param_name = self._config['esp_settable_param'][param]
+                value = esp_values[esp_param_name]
+                if self._journal is not None and \
+                        self._sent_values.get(esp_param_name) != value:
+                    self._journal.record(SETTING, text="%s=%s" % (esp_param_name, value))
+                self._sent_values[esp_param_name] = value
+
+        if errors:
+            msg = MessageBox()
+            msg.critical("Critical",
+                         "Severe Hardware Communication Error",
+                         "\n".join(errors),
+                         "Communication error",
+                         {msg.Retry: lambda: self.send_values_to_hardware,
+                          msg.Abort: lambda: sys.exit(-1)})()
+
         settings_file = SettingsFile(self._config["settings_file_path"])
         settings_file.store(settings_to_file)
 
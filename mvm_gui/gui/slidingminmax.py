@@ -0,0 +1,88 @@
+'''
+Module containing the SlidingMinMax class,
+the running minimum and maximum of the
+last samples of an observable
+'''
+from collections import deque
+
+
+class SlidingMinMax():
+    '''
+    Keeps the minimum and maximum of the last 'window' samples.
+
+    Two monotonic deques hold the samples which can still become the
+    minimum, in increasing order, and the maximum, in decreasing order:
+    a new sample evicts the ones it makes useless, and the oldest one
+    leaves when it falls out of the window. Every sample enters and
+    leaves each deque once, so an update costs O(1) amortized.
+
+    Attributes:
+        window      (int) The number of samples considered
+        _count      (int) The number of samples pushed so far
+        _mins       (deque) The (count, value) candidates to the minimum
+        _maxs       (deque) The (count, value) candidates to the maximum
+    '''
+
+    def __init__(self, window):
+        '''
+        Constructor
+
+        arguments:
+        - window: the number of samples considered
+        '''
+        self.window = window
+        self._count = 0
+        self._mins = deque()
+        self._maxs = deque()
+
+    def push(self, value):
+        '''
+        Adds a sample, forgetting the one which leaves the window.
+
+        arguments:
+        - value: (float) the sample to add
+        '''
+        self.extend((value,))
+
+    def extend(self, values):
+        '''
+        Adds several samples, oldest first.
+
+        arguments:
+        - values: the samples to add, as an iterable of floats
+        '''
+        mins = self._mins
+        maxs = self._maxs
+        count = self._count
+        window = self.window
+
+        for value in values:
+            while mins and mins[-1][1] >= value:
+                mins.pop()
+            mins.append((count, value))
+            while maxs and maxs[-1][1] <= value:
+                maxs.pop()
+            maxs.append((count, value))
+
+            oldest = count - window
+            if mins[0][0] <= oldest:
+                mins.popleft()
+            if maxs[0][0] <= oldest:
+                maxs.popleft()
+            count += 1
+
+        self._count = count
+
+    @property
+    def minimum(self):
+        '''
+        Returns: the minimum of the window, None before the first sample.
+        '''
+        return self._mins[0][1] if self._mins else None
+
+    @property
+    def maximum(self):
+        '''
+        Returns: the maximum of the window, None before the first sample.
+        '''
+        return self._maxs[0][1] if self._maxs else None
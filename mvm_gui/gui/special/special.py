@@ -5,8 +5,8 @@ This includes country-specific-procedurings, pause functions, and freezing funct
 """
 
 from PyQt5 import QtWidgets, uic
-from PyQt5 import QtCore
-from messagebox import MessageBox
+from messagebox import MessageBox, show_later
+from communication import ESP32Exception, LANE_CONTROL
 
 
 class SpecialBar(QtWidgets.QWidget):
@@ -33,9 +33,11 @@ class SpecialBar(QtWidgets.QWidget):
             lambda: self.paused_released('pause_inhale'))
         self.button_lung_recruit.pressed.connect(self.toggle_lung_recruit)
         self._lung_recruit = False
-        self._timer = {}
+        self._paused = set()
 
-    def connect_datahandler_config_esp32(self, data_h, config, esp32, messagebar):
+    def connect_datahandler_config_esp32(self, data_h, config, esp32, scheduler,
+                                         messagebar):
+        #pylint: disable=too-many-arguments
         """
         Passes the data handler and the confi dict to this class.
 
@@ -43,11 +45,13 @@ class SpecialBar(QtWidgets.QWidget):
         - data_h: A reference to the data handler.
         - config: A dictionary of configuration parameters from default_settings.yaml
         - esp32: A reference to the esp32
+        - scheduler: A reference to the serial scheduler
         - messagebar: Reference to the MessageBar used for confirmation.
         """
         self._data_h = data_h
         self._config = config
         self._esp32 = esp32
+        self._scheduler = scheduler
         self._messagebar = messagebar
 
     def is_configured(self):
@@ -58,14 +62,25 @@ class SpecialBar(QtWidgets.QWidget):
         """
         return hasattr(self, "_data_h") and hasattr(self, "_config")
 
-    def _get_lung_recruit_eta(self):
+    def _get_lung_recruit_eta(self, replies):
         """
-        Retrieves the Lungh Recruitment ETA from the esp32 and displays the result in Stop button
+        Called periodically by the scheduler with the Lungh Recruitment ETA retrieved
+        from the esp32, displays the result in Stop button.
+
+        arguments:
+        - replies: the reply to get pause_lg_time
         """
-        eta = float(self._esp32.get("pause_lg_time"))
+        if isinstance(replies[0], ESP32Exception):
+            print("ERROR: lung recruitment ETA failing: %s" % str(replies[0]))
+            return
+
+        try:
+            eta = float(replies[0])
+        except ValueError:
+            print("ERROR: lung recruitment ETA failing: %s" % replies[0])
+            return
         if eta == 0:
             self.stop_lung_recruit()
-            self._lung_recruit_timer.stop()
         else:
             self.button_lung_recruit.setText(
                 "Stop\nLung Recruitment\n%d" % int(eta))
@@ -80,21 +95,21 @@ class SpecialBar(QtWidgets.QWidget):
         self.button_lung_recruit.setText(
             "Stop\nLung Recruitment\n %d" % lr_time)
 
-        self._esp32.set("pause_lg_p", lr_pres)
-        self._esp32.set("pause_lg_time", lr_time)
+        self._esp32.set_many({"pause_lg_p": lr_pres,
+                              "pause_lg_time": lr_time})
         self._esp32.set("pause_lg", 1)
 
-        self._lung_recruit_timer = QtCore.QTimer()
-        self._lung_recruit_timer.timeout.connect(self._get_lung_recruit_eta)
-        self._lung_recruit_timer.start(500)
+        self._scheduler.register("lung_recruit_eta", 0.5, ["get pause_lg_time"],
+                                 self._get_lung_recruit_eta, LANE_CONTROL)
 
     def stop_lung_recruit(self):
         """
         Stops the lung recruitment procedure
         """
         self._lung_recruit = False
-        self._esp32.set("pause_lg", 0)
-        self._lung_recruit_timer.stop()
+        # not waited for, as it is called by the scheduler too
+        self._esp32.set_async("pause_lg", 0)
+        self._scheduler.unregister("lung_recruit_eta")
         self.button_lung_recruit.setText("Country-Specific\nProcedures")
 
     def toggle_lung_recruit(self):
@@ -124,13 +139,14 @@ class SpecialBar(QtWidgets.QWidget):
             raise Exception(
                 'Can only call paused_pressed with pause_exhale or pause_inhale.')
 
-        for other_pause in self._timer:
+        for other_pause in list(self._paused):
             self.paused_released(other_pause)
 
-        self._timer[mode] = QtCore.QTimer(self)
-        self._timer[mode].timeout.connect(
-            lambda: self.send_signal(mode=mode, pause=True))
-        self._timer[mode].start(self._config['expinsp_setinterval'] * 1000)
+        self._paused.add(mode)
+        self._scheduler.register(mode, self._config['expinsp_setinterval'],
+                                 ["set %s 1" % mode],
+                                 lambda replies: self.keep_signal(mode, replies),
+                                 LANE_CONTROL)
 
     def paused_released(self, mode):
         """
@@ -146,10 +162,35 @@ class SpecialBar(QtWidgets.QWidget):
             raise Exception(
                 'Can only call paused_pressed with pause_exhale or pause_inhale.')
 
-        self.stop_timer(mode)
+        self.stop_signal(mode)
 
         self.send_signal(mode=mode, pause=False)
 
+    def keep_signal(self, mode, replies):
+        """
+        Called periodically by the scheduler, which keeps sending
+        the pause signal to the ESP while the button is pressed.
+
+        arguments:
+        - mode: The pause mode (either 'pause_exhale' or 'pause_inhale')
+        - replies: the reply to the set
+        """
+        try:
+            if isinstance(replies[0], ESP32Exception):
+                raise replies[0]
+            if replies[0] != self._config['return_success_code']:
+                raise Exception('Call to set_data failed.')
+        except Exception as error:
+            self.stop_signal(mode)
+            msg = MessageBox()
+            detail = str(error)
+            show_later("pause_comm_error", lambda: msg.critical(
+                "Critical",
+                "Severe hardware communication error",
+                detail,
+                "Communication error",
+                {msg.Ok: lambda: None})())
+
     def send_signal(self, mode, pause):
         """
         Sends signal the appropriate signal the ESP
@@ -168,16 +209,16 @@ class SpecialBar(QtWidgets.QWidget):
                                         "Severe hardware communication error",
                                         str(error),
                                         "Communication error",
-                                        {msg.Ok: lambda: self.stop_timer(mode)})
+                                        {msg.Ok: lambda: self.stop_signal(mode)})
             confirm_func()
 
-    def stop_timer(self, mode):
+    def stop_signal(self, mode):
         """
-        Stops the QTimer which sends
+        Stops the periodic request which sends
         signals to the ESP
 
         arguments:
         - mode: The pause mode (either 'pause_exhale' or 'pause_inhale')
         """
-        if hasattr(self, '_timer'):
-            self._timer[mode].stop()
+        self._paused.discard(mode)
+        self._scheduler.unregister(mode)
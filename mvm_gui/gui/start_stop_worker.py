@@ -3,8 +3,9 @@ A file from class StartStopWorker
 '''
 import sys
 from PyQt5.QtCore import QTimer
-from messagebox import MessageBox
-from communication.esp32serial import ESP32Exception
+from messagebox import MessageBox, show_later
+from communication.esp32serial import ESP32Exception, LANE_CONTROL
+from journal import START, STOP
 
 
 class StartStopWorker():
@@ -21,8 +22,8 @@ class StartStopWorker():
     DO_RUN = 1
     DONOT_RUN = 0
 
-    def __init__(self, main_window, config, esp32, button_startstop,
-                 button_mode, toolbar, settings):
+    def __init__(self, main_window, config, esp32, scheduler,
+                 button_startstop, button_mode, toolbar, settings):
         #pylint: disable=too-many-arguments
         '''
         Constructor
@@ -31,6 +32,7 @@ class StartStopWorker():
         - main_window: the main window
         - config: the config dictionary
         - esp32: the instance of the ESP32Serial class
+        - scheduler: the instance of the SerialScheduler class
         - button_startstop: The start/stop button
         - button_mode: The PCV/PSV button
         - toolbar: The toolbar
@@ -45,6 +47,7 @@ class StartStopWorker():
         self._toolbar = toolbar
         self._settings = settings
         self._messagebar = self._main_window.messagebar
+        self._journal = self._main_window.journal
 
         self._mode_text = "PCV"
 
@@ -53,13 +56,17 @@ class StartStopWorker():
 
         self._backup_ackowledged = False
 
-        self._esp32_io()
+        # the last run, mode and backup polled, a change being acted upon
+        # only once two polls in a row agree
+        self._polled = None
+
+        self._update_status(*self._get_status())
 
         self._init_settings_panel()
 
-        self._timer = QTimer()
-        self._timer.timeout.connect(self._esp32_io)
-        self._start_timer()
+        scheduler.register("status", self._config["status_sampling_interval"],
+                           ["get run", "get mode", "get backup"], self._esp32_io,
+                           LANE_CONTROL)
 
     def _init_settings_panel(self):
         '''
@@ -80,8 +87,12 @@ class StartStopWorker():
             # If the ESP is running, read the current
             # parameters from the ESP and set those
             # values to the settings panels
-            for param, esp_name in self._config['esp_settable_param'].items():
-                value = float(self._esp32.get(esp_name))
+            esp_params = self._config['esp_settable_param']
+            esp_values = self._esp32.get_many(esp_params.values())
+            for param, esp_name in esp_params.items():
+                if isinstance(esp_values[esp_name], ESP32Exception):
+                    raise esp_values[esp_name]
+                value = float(esp_values[esp_name])
                 print('Reading Settings parameters from ESP:', param, value)
                 if esp_name == 'ratio':
                     converted_value = (value**-1 - 1)**-1
@@ -89,27 +100,60 @@ class StartStopWorker():
                 else:
                     self._settings.update_spinbox_value(param, value)
 
-    def _esp32_io(self):
+    def _esp32_io(self, replies):
         '''
-        The callback function called every time the
-        QTimer times out.
+        The callback function called periodically by
+        the scheduler with the run, mode and backup
+        variables read from the ESP.
+
+        arguments:
+        - replies: the replies to get run, mode and backup
         '''
 
         try:
-            self._call_esp32()
+            for reply in replies:
+                if isinstance(reply, ESP32Exception):
+                    raise reply
+            try:
+                status = tuple(int(reply) for reply in replies)
+            except ValueError:
+                raise ESP32Exception("get", "get run, mode and backup",
+                                     ", ".join(replies))
+            if any(value not in (0, 1) for value in status):
+                # a garbled or misplaced reply, not worth stopping for
+                print("ERROR: ignoring run %d, mode %d, backup %d" % status)
+                return
+            previous, self._polled = self._polled, status
+            if status == previous:
+                self._update_status(*status)
         except ESP32Exception as error:
             self._raise_comm_error(str(error))
 
-    def _call_esp32(self):
+    def _get_status(self):
         '''
         Gets the run, mode and backup vairables
-        from the ESP, and passes them to the
-        StartStopWorker class.
+        from the ESP.
+
+        returns: the (run, mode, backup) tuple
+        '''
+
+        values = self._esp32.get_many(['run', 'mode', 'backup'])
+        for value in values.values():
+            if isinstance(value, ESP32Exception):
+                raise value
+
+        return int(values['run']), int(values['mode']), int(values['backup'])
+
+    def _update_status(self, run, mode, backup):
         '''
+        Passes the run, mode and backup variables
+        read from the ESP to the StartStopWorker class.
 
-        run = int(self._esp32.get('run'))
-        mode = int(self._esp32.get('mode'))
-        backup = int(self._esp32.get('backup'))
+        arguments:
+        - run: the run value (0 or 1)
+        - mode: the mode value (0 or 1)
+        - backup: the backup flag (0 or 1)
+        '''
 
         if backup:
             if not self._backup_ackowledged:
@@ -133,11 +177,12 @@ class StartStopWorker():
 
         callbacks = {msg.Ok: self._acknowlege_backup}
 
-        msg.warning("CHANGE OF MODE",
-                    "The ventilator changed from PSV to PCV mode.",
-                    "The microcontroller raised the backup flag.",
-                    "",
-                    callbacks)()
+        show_later("backup", lambda: msg.warning(
+            "CHANGE OF MODE",
+            "The ventilator changed from PSV to PCV mode.",
+            "The microcontroller raised the backup flag.",
+            "",
+            callbacks)())
 
     def _acknowlege_backup(self):
         '''
@@ -155,10 +200,10 @@ class StartStopWorker():
 
         # TODO: find a good exit point
         msg = MessageBox()
-        msg.critical('COMMUNICATION ERROR',
-                     'Error communicating with the hardware', message,
-                     '** COMMUNICATION ERROR **', {msg.Ok: lambda:
-                                                           sys.exit(-1)})()
+        show_later("start_stop_comm_error", lambda: msg.critical(
+            'COMMUNICATION ERROR',
+            'Error communicating with the hardware', message,
+            '** COMMUNICATION ERROR **', {msg.Ok: lambda: sys.exit(-1)})())
 
     def is_running(self):
         """
@@ -181,10 +226,7 @@ class StartStopWorker():
             result = self._esp32.set('mode', self.MODE_PSV)
 
             if result:
-                self._mode_text = "PSV"
-                self._button_mode.setText("Set\nPCV")
-                self.update_startstop_text()
-                self._mode = self.MODE_PSV
+                self._show_mode(self.MODE_PSV)
             else:
                 self._raise_comm_error('Cannot set PSV mode.')
 
@@ -192,13 +234,26 @@ class StartStopWorker():
             result = self._esp32.set('mode', self.MODE_PCV)
 
             if result:
-                self._mode_text = "PCV"
-                self._button_mode.setText("Set\nPSV")
-                self.update_startstop_text()
-                self._mode = self.MODE_PCV
+                self._show_mode(self.MODE_PCV)
             else:
                 self._raise_comm_error('Cannot set PCV mode.')
 
+    def _show_mode(self, mode):
+        '''
+        Shows the mode the ESP is in.
+
+        arguments:
+        - mode: MODE_PCV or MODE_PSV
+        '''
+        if mode == self.MODE_PSV:
+            self._mode_text = "PSV"
+            self._button_mode.setText("Set\nPCV")
+        else:
+            self._mode_text = "PCV"
+            self._button_mode.setText("Set\nPSV")
+        self.update_startstop_text()
+        self._mode = mode
+
     def update_startstop_text(self):
         '''
         Updates the text in the Start/Stop button
@@ -219,6 +274,7 @@ class StartStopWorker():
 
         if result:
             self._run = self.DO_RUN
+            self._record_run("user")
             self.show_stop_button()
         else:
             self._raise_comm_error('Cannot start ventilator.')
@@ -250,10 +306,22 @@ class StartStopWorker():
 
         if result:
             self._run = self.DONOT_RUN
+            self._record_run("user")
             self.show_start_button()
         else:
             self._raise_comm_error('Cannot stop ventilator.')
 
+    def _record_run(self, source):
+        '''
+        Records a start or stop in the journal, if any.
+
+        arguments:
+        - source: who started or stopped, "user" or "esp"
+        '''
+        if self._journal is not None:
+            self._journal.record(START if self._run == self.DO_RUN else STOP,
+                                 self._mode, "%s %s" % (source, self._mode_text))
+
     def show_start_button(self):
         '''
         Shows the start button
@@ -331,51 +399,33 @@ class StartStopWorker():
             return
 
         self._run = run
+        self._record_run("esp")
 
         if run == self.DONOT_RUN:
             # TODO: this should be an alarm
             msg = MessageBox()
-            msg.critical('STOPPING VENTILATION',
-                         'The hardware has stopped the ventilation.',
-                         'The microcontroller has stopped the ventilation by sending run = ' +
-                         str(run),
-                         'The microcontroller has stopped the ventilation by sending run = ' +
-                         str(run),
-                         {msg.Ok: self.show_start_button})()
+            show_later("stopped", lambda: msg.critical(
+                'STOPPING VENTILATION',
+                'The hardware has stopped the ventilation.',
+                'The microcontroller has stopped the ventilation by sending run = ' +
+                str(run),
+                'The microcontroller has stopped the ventilation by sending run = ' +
+                str(run),
+                # unless started again meanwhile
+                {msg.Ok: lambda: None if self.is_running() else self.show_start_button()})())
 
         else:
             self.show_stop_button()
 
-    def _start_timer(self):
-        '''
-        Starts the QTimer.
-        '''
-        self._timer.start(self._config["status_sampling_interval"] * 1000)
-
-    def _stop_timer(self):
-        '''
-        Stops the QTimer.
-        '''
-        self._timer.stop()
-
-    def _restart_timer(self):
-        '''
-        Restarts the QTimer if the QTimer is active,
-        or simply starts the QTimer
-        '''
-        if self._timer.isActive():
-            self._stop_timer()
-
-        self._start_timer()
-
     def set_mode(self, mode):
         '''
         Sets the mode variable directly.
         Usually called at start up, when reading
-        the mode value from the ESP.
+        the mode value from the ESP, which is
+        in that mode already: it is only shown.
 
         arguments:
         - mode: the mode value (0 or 1) to set
         '''
         if self._mode != mode:
-            self.toggle_mode()
+            self._show_mode(mode)
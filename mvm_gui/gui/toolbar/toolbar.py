@@ -25,6 +25,7 @@ class Toolbar(QtWidgets.QWidget):
             QtWidgets.QPushButton, "button_unlockscreen")
 
         self.button_unlockscreen.blinkstate = True
+        self.link_text = ""
 
         self.blinktimer = QtCore.QTimer(self)
         self.blinktimer.setInterval(500)  # .5 seconds
@@ -39,7 +40,7 @@ class Toolbar(QtWidgets.QWidget):
         arguments:
         - mode_text: (str) the current mode (PCV/PSV)
         '''
-        self.label_status.setText("Status: Stopped\n" + mode_text)
+        self.label_status.setText("Status: Stopped\n" + mode_text + self.link_text)
         self.label_status.setStyleSheet(
             "QLabel { background-color : red; color: yellow;}")
 
@@ -50,10 +51,27 @@ class Toolbar(QtWidgets.QWidget):
         arguments:
         - mode_text: (str) the current mode (PCV/PSV)
         '''
-        self.label_status.setText("Status: Running\n" + mode_text)
+        self.label_status.setText("Status: Running\n" + mode_text + self.link_text)
         self.label_status.setStyleSheet(
             "QLabel { background-color : green;  color: yellow;}")
 
+    def set_link_state(self, state, reason=""):
+        '''
+        Shows the state of the link with the ESP below the status,
+        unless the link is ok
+
+        arguments:
+        - state: (str) the link state (ok/degraded/down)
+        - reason: (str) what caused the change, shown as tooltip
+        '''
+        status = self.label_status.text()
+        if self.link_text:
+            status = status[:-len(self.link_text)]
+
+        self.link_text = "" if state == "ok" else "\nLink: " + state
+        self.label_status.setText(status + self.link_text)
+        self.label_status.setToolTip(reason)
+
     def blink_unlock(self):
         '''
         Sets blinking
@@ -0,0 +1,245 @@
+'''
+Module containing the TrendStore class,
+the long term history of the observables
+at decreasing resolutions
+'''
+import numpy as np
+from ringbuffer import RingBuffer
+
+# (bucket width in seconds, number of buckets kept) of each level, finest
+# first: 1 h at 1 s, 12 h at 10 s, 72 h at 1 min and at 10 min
+DEFAULT_LEVELS = ((1, 3600), (10, 4320), (60, 4320), (600, 432))
+
+
+class TrendLevel():
+    '''
+    One level of the TrendStore: the min, max and mean of all the
+    observables over buckets of a fixed width.
+
+    The open bucket accumulates the samples, or the buckets of the
+    finer level, until one belonging to the next bucket comes: it is
+    then closed, stored, and merged into the coarser level.
+
+    Attributes:
+        width       (float) The bucket width in seconds
+        capacity    (int) The number of buckets kept
+        upper       (TrendLevel) The coarser level, None for the last one
+        filled      (int) The number of buckets stored, up to capacity
+        _times      (RingBuffer) The start time of the buckets
+        _values     (RingBuffer) The mins, maxs and means of the buckets,
+                    one row per observable and statistic
+        _key        (int) The number of the open bucket, None if none
+        _min        (array) The minimum of the open bucket
+        _max        (array) The maximum of the open bucket
+        _sum        (array) The sum of the samples of the open bucket
+        _count      (int) The number of samples in the open bucket
+    '''
+
+    def __init__(self, width, capacity, n_fields, upper=None):
+        '''
+        Constructor
+
+        arguments:
+        - width: the bucket width in seconds
+        - capacity: the number of buckets kept
+        - n_fields: the number of observables
+        - upper: the coarser level, None for the last one
+        '''
+        self.width = width
+        self.capacity = capacity
+        self.upper = upper
+        self.filled = 0
+        self._times = RingBuffer(capacity)
+        self._values = RingBuffer(capacity, 3 * n_fields)
+
+        self._key = None
+        self._min = np.full(n_fields, np.inf)
+        self._max = np.full(n_fields, -np.inf)
+        self._sum = np.zeros(n_fields)
+        self._count = 0
+
+    def merge(self, start, mins, maxs, sums, count):
+        '''
+        Adds samples to the level.
+
+        arguments:
+        - start: the time of the samples, or the start of the finer
+          bucket holding them
+        - mins, maxs, sums: the min, max and sum of the samples, for
+          every observable
+        - count: the number of samples
+        '''
+        key = int(start // self.width)
+        if key != self._key:
+            if self._key is not None:
+                self._close()
+            self._key = key
+
+        np.minimum(self._min, mins, out=self._min)
+        np.maximum(self._max, maxs, out=self._max)
+        self._sum += sums
+        self._count += count
+
+    def _close(self):
+        '''
+        Stores the open bucket, merges it into the coarser level and
+        empties it.
+        '''
+        start = self._key * self.width
+        self._times.append(start)
+        self._values.append(np.concatenate((self._min, self._max,
+                                            self._sum / self._count)))
+        self.filled = min(self.filled + 1, self.capacity)
+
+        if self.upper is not None:
+            self.upper.merge(start, self._min, self._max, self._sum, self._count)
+
+        self._min.fill(np.inf)
+        self._max.fill(-np.inf)
+        self._sum.fill(0.)
+        self._count = 0
+
+    def oldest(self):
+        '''
+        Returns: the start time of the oldest bucket, None if empty.
+        '''
+        if self.filled:
+            return self._times.view()[self.capacity - self.filled]
+        if self._key is not None:
+            return self._key * self.width
+        return None
+
+    def buckets(self, field, start, stop):
+        '''
+        Returns the buckets of an observable in a time range, the open
+        one included.
+
+        arguments:
+        - field: the index of the observable
+        - start, stop: the time range, in seconds
+
+        returns: (times, mins, maxs, means), arrays of the start time and
+        the statistics of the buckets overlapping the range, oldest first,
+        possibly read-only views, valid until the next samples are added.
+        '''
+        first = self.capacity - self.filled
+        times = self._times.view()[first:]
+        values = self._values.view()[:, first:]
+        n_fields = values.shape[0] // 3
+
+        # a bucket overlaps the range if it starts before its end and
+        # ends after its start
+        low = np.searchsorted(times, start - self.width, side='right')
+        high = np.searchsorted(times, stop, side='left')
+        times = times[low:high]
+        mins = values[field, low:high]
+        maxs = values[n_fields + field, low:high]
+        means = values[2 * n_fields + field, low:high]
+
+        if self._count and start - self.width < self._key * self.width < stop:
+            times = np.append(times, self._key * self.width)
+            mins = np.append(mins, self._min[field])
+            maxs = np.append(maxs, self._max[field])
+            means = np.append(means, self._sum[field] / self._count)
+
+        return times, mins, maxs, means
+
+
+class TrendStore():
+    '''
+    Keeps the long term history of all the observables as a pyramid
+    of TrendLevels: each level holds the min, max and mean over
+    buckets of increasing width, kept for an increasing time, with
+    a bounded memory. Only the finest level sees the samples, each
+    coarser one is fed with the buckets of the previous one as they
+    close.
+
+    Times are in seconds, on the clock the samples are added with.
+
+    Attributes:
+        fields      (list) The names of the observables, in order
+        levels      (list) The TrendLevels, finest first
+        _columns    (dict) The index of each observable
+    '''
+
+    def __init__(self, fields, levels=DEFAULT_LEVELS):
+        '''
+        Constructor
+
+        arguments:
+        - fields: the names of the observables, in the order of the rows
+        - levels: the (bucket width in seconds, number of buckets kept)
+          of each level, finest first, each width a multiple of the
+          previous one
+        '''
+        self.fields = list(fields)
+        self._columns = {name: i for i, name in enumerate(self.fields)}
+
+        self.levels = []
+        upper = None
+        for width, capacity in reversed(levels):
+            upper = TrendLevel(width, capacity, len(self.fields), upper)
+            self.levels.insert(0, upper)
+
+    def add(self, times, rows):
+        '''
+        Adds samples of all the observables.
+
+        arguments:
+        - times: the time of the samples, in seconds and not decreasing,
+          as an array, or a single time for all of them
+        - rows: 2-D NumPy array with one row of values of the fields
+          per sample, in order
+        '''
+        rows = np.asarray(rows, dtype=float).reshape(-1, len(self.fields))
+        level = self.levels[0]
+
+        # usually all the samples of a call fall into the same bucket
+        if np.ndim(times) == 0 or times[0] // level.width == times[-1] // level.width:
+            start = times if np.ndim(times) == 0 else times[0]
+            if len(rows) == 1:
+                level.merge(start, rows[0], rows[0], rows[0], 1)
+            else:
+                level.merge(start, rows.min(axis=0), rows.max(axis=0),
+                            rows.sum(axis=0), len(rows))
+            return
+
+        # otherwise one merge per bucket
+        times = np.asarray(times, dtype=float)
+        keys = times // level.width
+        bounds = np.flatnonzero(np.diff(keys)) + 1
+        for begin, end in zip(np.r_[0, bounds], np.r_[bounds, len(rows)]):
+            block = rows[begin:end]
+            level.merge(times[begin], block.min(axis=0), block.max(axis=0),
+                        block.sum(axis=0), end - begin)
+
+    def query(self, name, start, stop, pixels):
+        '''
+        Returns the history of an observable over a time range, at
+        about the resolution of a plot of the given width.
+
+        The finest level with buckets at least (stop - start) / pixels
+        wide, and going back to start, is used, so that no more than
+        about pixels buckets are returned.
+
+        arguments:
+        - name: the name of the observable
+        - start, stop: the time range, in seconds
+        - pixels: the width of the plot
+
+        returns: (times, mins, maxs, means), arrays of the start time and
+        the statistics of the buckets, oldest first.
+        '''
+        if name not in self._columns:
+            raise Exception('Cannot query the trend of', name,
+                            'which is not in get_all_fields.')
+
+        resolution = (stop - start) / max(pixels, 1)
+        chosen = self.levels[-1]
+        for level in self.levels:
+            oldest = level.oldest()
+            if level.width >= resolution and oldest is not None and oldest <= start:
+                chosen = level
+                break
+
+        return chosen.buckets(self._columns[name], start, stop)
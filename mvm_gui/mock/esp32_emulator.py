@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+"""
+ESP32 emulator on a pseudo-terminal.
+
+It speaks the same protocol as mock.ino (get, set, get all, valore=, and
+the stream_rate and binary_frames extensions), with the pressure and
+flow waveforms of the PEEP model, so that the real ESP32Serial code can
+be exercised without any hardware. The replies can be delayed, with
+jitter, and errors can be injected: lost replies, garbled replies and
+noise lines.
+
+Usage (Linux/macOS only, pty is required):
+    ./esp32_emulator.py --link /tmp/ttyESP32 --latency 0.005 --drop 0.01
+then set port: '/tmp/ttyESP32' in gui/default_settings.yaml.
+"""
+
+import argparse
+import heapq
+import os
+import pty
+import random
+import select
+import sys
+import time
+import tty
+from threading import Thread
+
+import yaml
+
+GUI_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'gui')
+sys.path.insert(0, GUI_DIR)
+# pylint: disable=C0413
+from communication.binaryframe import BINARY_REPLY, BINARY_STREAM, encode_frame
+from communication.peep import PEEP
+
+WATCHDOG_TIMEOUT = 5
+WATCHDOG_ALARM = 30
+GUI_ALARM = 29
+
+
+class ESP32Emulator:
+    #pylint: disable=too-many-instance-attributes
+    """
+    Emulates the ESP32 firmware behind a pseudo-terminal.
+
+    Class members:
+    - fields: the get_all_fields, in order
+    - latency: the delay, in seconds, before each reply is sent
+    - jitter: the standard deviation, in seconds, of a gaussian delay
+        added to the latency
+    - drop_rate: the probability for a reply to be lost
+    - garble_rate: the probability for a reply to be corrupted
+    - noise_rate: the probability for a noise line to precede a reply
+    - parameters: {str: str} the values of the settable parameters
+    - statistics: {str: int} counters of the commands and of the
+        injected errors
+    """
+
+    def __init__(self, fields, latency=0., jitter=0., drop_rate=0.,
+                 garble_rate=0., noise_rate=0., seed=None):
+        #pylint: disable=too-many-arguments
+        """
+        Constructor
+
+        Arguments: see relevant class members.
+        - seed: the seed of the random errors, for reproducible runs
+        """
+        self.fields = list(fields)
+        self.latency = latency
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.garble_rate = garble_rate
+        self.noise_rate = noise_rate
+        self._random = random.Random(seed)
+
+        self._peep = PEEP()
+        self._generators = {
+            "pressure": self._peep.pressure,
+            "flow": self._peep.flow,
+            "o2": lambda: random.randint(30, 99),
+            "bpm": lambda: random.randint(6, 7),
+            "tidal": lambda: random.randint(1000, 1499),
+            "peep": lambda: random.randint(4, 19),
+            "temperature": lambda: random.randint(10, 49),
+            "battery_powered": lambda: 0,
+            "battery_charge": lambda: random.randint(20, 99),
+            "peak": lambda: random.randint(70, 79),
+            "total_inspired_volume": lambda: random.randint(1000, 1999),
+            "total_expired_volume": lambda: random.randint(1000, 1999),
+            "volume_minute": lambda: random.randint(10, 99),
+            "alarm": self._get_alarm,
+            "warning": lambda: self._warning}
+
+        self.parameters = {
+            "run": "0", "mode": "0", "backup": "0", "wdenable": "0",
+            "pcv_trigger": "5", "pcv_trigger_enable": "0",
+            "rate": "12", "ratio": "2", "ptarget": "15",
+            "assist_ptrigger": "1", "assist_flow_min": "20",
+            "pressure_support": "10", "backup_enable": "1",
+            "backup_min_time": "10", "pause_lg_time": "10",
+            "pause_lg_p": "10"}
+        self._alarm = 0
+        self._warning = 0
+        self._pause_lg_expiration = time.monotonic()
+        self._watchdog_expiration = time.monotonic() + WATCHDOG_TIMEOUT
+
+        self._binary = False
+        self._sequence = {BINARY_REPLY: 0, BINARY_STREAM: 0}
+        self._stream_period = 0.
+        self._stream_next = 0.
+
+        self._outbox = []
+        self._last_due = 0.
+        self._order = 0
+
+        self.statistics = {"commands": 0, "dropped": 0, "garbled": 0,
+                           "noise": 0}
+
+        self._master = None
+        self._slave = None
+        self._thread = None
+        self._running = False
+
+    def open(self):
+        """
+        Opens the pseudo-terminal.
+
+        returns: the path of the serial port to connect to.
+        """
+        self._master, self._slave = pty.openpty()
+        tty.setraw(self._slave)
+        return os.ttyname(self._slave)
+
+    def start(self):
+        """
+        Opens the pseudo-terminal, if needed, and serves it from a
+        background thread.
+
+        returns: the path of the serial port to connect to.
+        """
+        port = os.ttyname(self._slave) if self._slave else self.open()
+        self._running = True
+        self._thread = Thread(target=self.serve, name="ESP32Emulator",
+                              daemon=True)
+        self._thread.start()
+        return port
+
+    def stop(self):
+        """
+        Stops serving and closes the pseudo-terminal.
+        """
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        for descriptor in (self._master, self._slave):
+            if descriptor is not None:
+                os.close(descriptor)
+        self._master = self._slave = None
+
+    def serve(self):
+        """
+        Reads the commands and sends the replies until stop() is called.
+        """
+        self._running = True
+        buffer = bytearray()
+        while self._running:
+            now = time.monotonic()
+            wait = 0.05
+            if self._outbox:
+                wait = min(wait, max(self._outbox[0][0] - now, 0.))
+            if self._stream_period:
+                wait = min(wait, max(self._stream_next - now, 0.))
+
+            readable, _, _ = select.select([self._master], [], [], wait)
+            if readable:
+                try:
+                    buffer += os.read(self._master, 4096)
+                except OSError:
+                    break
+
+            # the firmware reads up to '\r' and trims the command
+            index = buffer.find(b'\r')
+            while index >= 0:
+                command = buffer[:index].decode(errors="replace").strip()
+                del buffer[:index + 1]
+                if command:
+                    self._handle(command)
+                index = buffer.find(b'\r')
+
+            self._stream()
+            self._flush()
+
+    def _handle(self, command):
+        """
+        Runs a command and queues its reply.
+        """
+        self.statistics["commands"] += 1
+        verb = command[:3]
+        name = command[4:].split(' ')[0]
+
+        if verb == "get" and name == "all" and self._binary:
+            self._reply(self._binary_frame(BINARY_REPLY))
+        elif verb == "get":
+            self._reply(b"valore=" + self._get(name).encode() + b"\r\n")
+        elif verb == "set":
+            value = command[4 + len(name):].strip().split(' ')[0]
+            self._reply(b"valore=" + self._set(name, value).encode() + b"\r\n")
+        else:
+            self._reply(b"valore=notok\r\n")
+
+    def _get_all(self):
+        """
+        Returns: the list of the get_all_fields values.
+        """
+        return [self._generators.get(name, lambda: random.randint(10, 99))()
+                for name in self.fields]
+
+    def _binary_frame(self, prefix):
+        """
+        Returns: a whole binary get all line, see binaryframe.py.
+        """
+        sequence = self._sequence[prefix]
+        self._sequence[prefix] = (sequence + 1) & 0xFFFF
+        return prefix + encode_frame(sequence, self._get_all(), self.fields) + b"\r\n"
+
+    def _get(self, name):
+        """
+        Returns: the reply to a get command, as mock.ino does.
+        """
+        now = time.monotonic()
+        if name == "all":
+            return ",".join("%.2f" % value for value in self._get_all())
+        if name == "pause_lg_time":
+            return str(max(int(self._pause_lg_expiration - now), 0))
+        if name in ("alarm", "warning"):
+            return str(self._generators[name]())
+        if name == "version":
+            return "emulator"
+        if name in self._generators:
+            return "%.2f" % self._generators[name]()
+        return self.parameters.get(name, "unknown")
+
+    def _set(self, name, value):
+        # pylint: disable=too-many-return-statements, too-many-branches
+        """
+        Returns: the reply to a set command, as mock.ino does.
+        """
+        now = time.monotonic()
+        if name == "alarm":
+            if value == "0":
+                self._alarm = 0
+            elif value == "1":
+                self._alarm |= 1 << GUI_ALARM
+            else:
+                return "notok"
+            return "OK"
+        if name == "alarm_snooze":
+            self._alarm &= ~(1 << int(value))
+            return "OK"
+        if name == "warning" and value == "0":
+            self._warning = 0
+            return "OK"
+        if name == "_hwalarm":
+            self._alarm |= 1 << int(value)
+            return "OK"
+        if name == "_hwwarning":
+            self._warning |= 1 << int(value)
+            return "OK"
+
+        if name == "stream_rate":
+            rate = float(value)
+            self._stream_period = 1. / rate if rate > 0 else 0.
+            self._stream_next = now
+        elif name == "binary_frames":
+            self._binary = value == "1"
+        elif name in ("watchdog_reset", "wdenable") and value == "1":
+            self._watchdog_expiration = now + WATCHDOG_TIMEOUT
+            if name == "wdenable":
+                self._alarm &= ~(1 << WATCHDOG_ALARM)
+        elif name == "pause_lg" and value == "1":
+            self._pause_lg_expiration = now + float(
+                self.parameters["pause_lg_time"])
+
+        self.parameters[name] = value
+        return "OK"
+
+    def _get_alarm(self):
+        """
+        Returns: the alarm word, the watchdog alarm raised if the GUI
+        stopped resetting it.
+        """
+        if self.parameters["wdenable"] == "1" and \
+                time.monotonic() > self._watchdog_expiration:
+            self._alarm |= 1 << WATCHDOG_ALARM
+        return self._alarm
+
+    def _stream(self):
+        """
+        Queues a streamed frame, if one is due.
+        """
+        if not self._stream_period or time.monotonic() < self._stream_next:
+            return
+
+        self._stream_next += self._stream_period
+        if self._binary:
+            self._reply(self._binary_frame(BINARY_STREAM))
+        else:
+            self._reply(b"stream=" + self._get("all").encode() + b"\r\n")
+
+    def _reply(self, data):
+        """
+        Queues some data to be sent after the latency, injecting the
+        configured errors.
+        """
+        if self._random.random() < self.drop_rate:
+            self.statistics["dropped"] += 1
+            return
+
+        if self._random.random() < self.garble_rate:
+            self.statistics["garbled"] += 1
+            data = bytearray(data)
+            data[self._random.randrange(len(data) - 2)] ^= 0x5a
+            data = bytes(data)
+
+        if self._random.random() < self.noise_rate:
+            self.statistics["noise"] += 1
+            data = b"\x00noise\xff\r\n" + data
+
+        delay = self.latency
+        if self.jitter:
+            delay += abs(self._random.gauss(0., self.jitter))
+
+        # a serial line keeps the order, however long each reply takes
+        due = max(time.monotonic() + delay, self._last_due)
+        self._last_due = due
+        self._order += 1
+        heapq.heappush(self._outbox, (due, self._order, data))
+
+    def _flush(self):
+        """
+        Writes the replies which are due.
+        """
+        now = time.monotonic()
+        while self._outbox and self._outbox[0][0] <= now:
+            _, _, data = heapq.heappop(self._outbox)
+            view = memoryview(data)
+            while view:
+                try:
+                    view = view[os.write(self._master, view):]
+                except OSError:
+                    return
+
+
+def main():
+    """
+    Main function.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument("--settings", default=os.path.join(GUI_DIR, "default_settings.yaml"),
+                        help="the GUI settings, for the get_all_fields")
+    parser.add_argument("--link", help="create a symlink to the serial port here")
+    parser.add_argument("--latency", type=float, default=0.,
+                        help="reply delay in seconds")
+    parser.add_argument("--jitter", type=float, default=0.,
+                        help="standard deviation of the extra reply delay in seconds")
+    parser.add_argument("--drop", type=float, default=0.,
+                        help="probability of losing a reply")
+    parser.add_argument("--garble", type=float, default=0.,
+                        help="probability of corrupting a reply")
+    parser.add_argument("--noise", type=float, default=0.,
+                        help="probability of a noise line before a reply")
+    parser.add_argument("--seed", type=int, help="seed of the injected errors")
+    args = parser.parse_args()
+
+    with open(args.settings) as fsettings:
+        config = yaml.load(fsettings, Loader=yaml.FullLoader)
+
+    emulator = ESP32Emulator(config["get_all_fields"], args.latency, args.jitter,
+                             args.drop, args.garble, args.noise, args.seed)
+    port = emulator.open()
+    if args.link:
+        if os.path.lexists(args.link):
+            os.remove(args.link)
+        os.symlink(port, args.link)
+        print("ESP32 emulator on %s -> %s" % (args.link, port))
+    else:
+        print("ESP32 emulator on %s" % port)
+
+    try:
+        emulator.serve()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(yaml.dump(emulator.statistics))
+        if args.link and os.path.islink(args.link):
+            os.remove(args.link)
+
+
+if __name__ == "__main__":
+    main()
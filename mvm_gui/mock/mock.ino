@@ -42,9 +42,9 @@ unsigned long now()
   return Time::from_micros(micros());
 }
 
-size_t send(Stream& connection, String const& data)
+size_t send(Stream& connection, String const& data,
+            String const& header = String("valore="))
 {
-  auto const header = String("valore=");
   auto const len = header.length() + data.length();
 
   auto sent = connection.print(header);
@@ -100,6 +100,16 @@ mvm::alarm_t warning_status = 0;
 unsigned long pause_lg_expiration = mvm::now<mvm::Seconds>() + 10;
 unsigned long gui_watchdog_expr = mvm::now<mvm::Seconds>() + 5;
 
+// streaming of the get all frames, disabled when the period is 0
+unsigned long stream_period_ms = 0;
+unsigned long stream_next_ms = 0;
+
+// binary encoding of the get all frames, see
+// gui/communication/binaryframe.py for the layout
+bool binary_frames = false;
+uint16_t reply_sequence = 0;
+uint16_t stream_sequence = 0;
+
 void setup()
 {
   Serial.begin(115200);
@@ -169,6 +179,12 @@ String set(String const& command)
   } else if (name == "_hwwarning") {
     warning_status = mvm::raise_hw_alarm(value.toInt(), warning_status);
     return "OK";
+  } else if (name == "stream_rate") {
+    auto const rate = value.toInt();
+    stream_period_ms = rate > 0 ? 1000ul / rate : 0;
+    stream_next_ms = millis();
+  } else if (name == "binary_frames") {
+    binary_frames = value == "1";
   } else if (name == "wdenable" && value == "1") {
     gui_watchdog_expr = mvm::now<mvm::Seconds>() + 5;
     alarm_status = mvm::snooze_hw_alarm(30, alarm_status);
@@ -203,7 +219,9 @@ String get(String const& command)
       + String(random(70, 80))     + "," // peak
       + String(random(1000, 2000)) + "," // total_inspired_volume
       + String(random(1000, 2000)) + "," // total_expired_volume
-      + String(random(10, 100));         // volume_minute
+      + String(random(10, 100))    + "," // volume_minute
+      + String(alarm_status)       + "," // alarm
+      + String(warning_status);          // warning
   } else if (name == "pause_lg_time") {
     auto const now = mvm::now<mvm::Seconds>();
     return now > pause_lg_expiration ? "0" : String(pause_lg_expiration - now);
@@ -230,6 +248,67 @@ String get(String const& command)
   }
 }
 
+// CRC-16/CCITT-FALSE
+uint16_t crc16(uint8_t const* data, size_t len)
+{
+  uint16_t crc = 0xFFFF;
+
+  for (size_t i = 0; i < len; ++i) {
+    crc ^= uint16_t(data[i]) << 8;
+    for (int bit = 0; bit < 8; ++bit) {
+      crc = crc & 0x8000 ? (crc << 1) ^ 0x1021 : crc << 1;
+    }
+  }
+
+  return crc;
+}
+
+size_t send_binary(Stream& connection, String const& header,
+                   uint16_t sequence)
+{
+  auto const values = get("get all");
+
+  std::vector<uint8_t> frame;
+  frame.push_back(sequence & 0xFF);
+  frame.push_back(sequence >> 8);
+
+  // the measures as floats, the alarm and warning words, the last two
+  // values, as they are
+  int start = 0;
+  while (true) {
+    auto const comma = values.indexOf(',', start);
+    if (comma == -1) {
+      break;
+    }
+
+    if (values.indexOf(',', comma + 1) != -1) {
+      float const value = values.substring(start, comma).toFloat();
+
+      uint8_t bytes[sizeof(value)];
+      memcpy(bytes, &value, sizeof(value)); // the ESP32 is little-endian
+      frame.insert(frame.end(), bytes, bytes + sizeof(value));
+    }
+    start = comma + 1;
+  }
+
+  mvm::alarm_t const words[] = {alarm_status, warning_status};
+  for (auto const word : words) {
+    uint8_t bytes[sizeof(word)];
+    memcpy(bytes, &word, sizeof(word));
+    frame.insert(frame.end(), bytes, bytes + sizeof(word));
+  }
+
+  auto const crc = crc16(frame.data(), frame.size());
+  frame.push_back(crc & 0xFF);
+  frame.push_back(crc >> 8);
+
+  auto sent = connection.print(header);
+  sent += connection.write(frame.data(), frame.size());
+  sent += connection.println("");
+
+  return sent;
+}
+
 void serial_loop(Stream& connection)
 {
   if (connection.available() > 0) {
@@ -238,6 +317,9 @@ void serial_loop(Stream& connection)
     auto const command_type = command.substring(0, 3);
 
     if (command.length() == 0) {
+    } else if (command_type == "get" && binary_frames
+               && parse_word(command) == "all") {
+      send_binary(connection, "valbin=", reply_sequence++);
     } else if (command_type == "get") {
       mvm::send(connection, get(command));
     } else if (command_type == "set") {
@@ -248,10 +330,28 @@ void serial_loop(Stream& connection)
   }
 }
 
+void stream_loop(Stream& connection)
+{
+  if (stream_period_ms == 0) {
+    return;
+  }
+
+  auto const now = millis();
+  if (now >= stream_next_ms) {
+    stream_next_ms += stream_period_ms;
+    if (binary_frames) {
+      send_binary(connection, "strbin=", stream_sequence++);
+    } else {
+      mvm::send(connection, get("get all"), String("stream="));
+    }
+  }
+}
+
 void loop()
 {
   serial_loop(Serial);
   serial_loop(Debug);
+  stream_loop(Serial);
 
   if (parameters["wdenable"] == "1") {
     auto const now = mvm::now<mvm::Seconds>();
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Plays back a traffic log recorded by the GUI.
+
+The log is recorded by setting traffic_log in gui/default_settings.yaml.
+Its ESP32 side is played on a pseudo-terminal, at the recorded pace or
+as fast as the GUI asks for it, so that a session can be reproduced
+without any hardware.
+
+Usage (Linux/macOS only, pty is required):
+    ./replay_traffic.py /tmp/session.traffic --link /tmp/ttyESP32 --speed 1
+then set port: '/tmp/ttyESP32' in gui/default_settings.yaml.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+GUI_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'gui')
+sys.path.insert(0, GUI_DIR)
+# pylint: disable=C0413
+from communication.traffic import TrafficReplayer, OUTGOING
+
+
+def main():
+    """
+    Main function.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument("log", help="the traffic log to play")
+    parser.add_argument("--link", help="create a symlink to the serial port here")
+    parser.add_argument("--speed", type=float, default=1.,
+                        help="replay speed, 1 for real time, 0 for as fast as possible")
+    args = parser.parse_args()
+
+    replayer = TrafficReplayer(args.log, args.speed)
+    records = replayer.records
+    if records:
+        commands = sum(direction == OUTGOING for _, direction, _ in records)
+        print("%d records, %d commands, %.1f s" %
+              (len(records), commands, records[-1][0] - records[0][0]))
+
+    port = replayer.start()
+    if args.link:
+        if os.path.lexists(args.link):
+            os.remove(args.link)
+        os.symlink(port, args.link)
+        print("Replaying on %s -> %s" % (args.link, port))
+    else:
+        print("Replaying on %s" % port)
+
+    try:
+        while not replayer.done:
+            time.sleep(0.1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        replayer.stop()
+        if args.link and os.path.islink(args.link):
+            os.remove(args.link)
+
+
+if __name__ == "__main__":
+    main()